@@ -48,6 +48,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -81,6 +82,62 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Файловый кэш общий для всех процессов: импорт из management-команды
+# сбрасывает прогноз, закэшированный веб-сервером.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.django_cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# Фоновые задачи: 'thread' -- пул потоков внутри веб-процесса,
+# 'command' -- только отдельный воркер `python manage.py run_jobs`
+BACKGROUND_JOBS = 'thread'
+BACKGROUND_JOB_WORKERS = 2
+
+# Под ASGI-сервером (uvicorn/daphne, см. README) дашборд и API отдаются асинхронными
+# вариантами; подбор прогноза идёт в пуле из FORECAST_WORKERS потоков
+ASYNC_VIEWS = False
+FORECAST_WORKERS = 2
+
+# Выбор модели прогноза (длина сезона, затухание тренда) бэктестами в пуле из
+# FORECAST_SELECTION_WORKERS процессов (0 -- в самом запросе; пока пул запускается или занят,
+# тоже в запросе). Запрос ждёт его не дольше FORECAST_SELECTION_BUDGET_MS, потом берёт лучшую
+# из досчитанных (None -- без ограничения); если не досчиталась ни одна, прогноз не сохраняется
+FORECAST_SELECTION_WORKERS = 2
+FORECAST_SELECTION_BUDGET_MS = 300
+# подбор параметров: 'minimize' (L-BFGS-B), 'grid' или 'grid-refine' (см. benchmark_forecast)
+FORECAST_FITTER = 'minimize'
+
+# Готовые выгрузки: файлы переиспользуются, пока данные пользователя не менялись
+EXPORT_ROOT = BASE_DIR / 'exports'
+EXPORT_MAX_AGE = 24 * 60 * 60
+EXPORT_MAX_TOTAL_BYTES = 1024 ** 3
+
+# CSV между превью и подтверждением импорта; брошенные превью удаляет run_jobs
+UPLOAD_ROOT = BASE_DIR / 'uploads'
+UPLOAD_MAX_AGE = 60 * 60
+
+# Метрики (/metrics, формат Prometheus). Каждый процесс сбрасывает свои в METRICS_DIR,
+# чтобы /metrics видел все воркеры и run_jobs (снимки завершившихся процессов
+# сворачиваются в retired.json); None -- только текущий процесс
+METRICS_ENABLED = True
+METRICS_DIR = BASE_DIR / '.metrics'
+METRICS_FLUSH_INTERVAL = 5
+# /metrics без входа staff-пользователем: скрейперу с заголовком "Authorization: Bearer <METRICS_TOKEN>"
+# или с адресов METRICS_ALLOWED_IPS. За прокси на том же хосте все запросы идут с 127.0.0.1,
+# поэтому по умолчанию список пуст
+METRICS_TOKEN = None
+METRICS_ALLOWED_IPS = []
+# запросы дольше этого пишутся в лог core.slow_requests с самыми долгими SQL; None -- не писать
+SLOW_REQUEST_SECONDS = 1.0
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Client, Project, Category, Invoice
+from .models import Client, Project, Category, Invoice, ForecastState, MonthlyRollup, ExportJob, ImportJob
 
 
 @admin.register(Client)
@@ -30,4 +30,38 @@ class CategoryAdmin(admin.ModelAdmin):
 class InvoiceAdmin(admin.ModelAdmin):
     list_display = ('date', 'owner', 'project', 'amount', 'paid', 'status')
     list_filter = ('status', 'paid', 'date')
-    search_fields = ('project__title', 'project__client__name', 'external_id', 'description')
\ No newline at end of file
+    search_fields = ('project__title', 'project__client__name', 'external_id', 'description')
+
+
+
+
+@admin.register(ForecastState)
+class ForecastStateAdmin(admin.ModelAdmin):
+    list_display = ('owner', 'slen', 'alpha', 'beta', 'gamma', 'fitted_at', 'updated_at')
+
+
+
+
+
+@admin.register(MonthlyRollup)
+class MonthlyRollupAdmin(admin.ModelAdmin):
+    list_display = ('owner', 'month', 'client', 'category', 'paid', 'total', 'count')
+    list_filter = ('paid', 'month')
+
+
+
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('owner', 'format', 'status', 'rows', 'size', 'created_at', 'finished_at', 'last_accessed_at')
+    list_filter = ('status', 'format')
+
+
+
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('owner', 'filename', 'status', 'rows', 'created', 'skipped', 'errors', 'created_at', 'finished_at')
+    list_filter = ('status',)
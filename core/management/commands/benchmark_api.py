@@ -0,0 +1,143 @@
+import json
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import JsonResponse
+from django.test import RequestFactory
+
+from core.models import Category, Client, Invoice, Project
+from core.utils.api import INVOICE_API_KEYS, invoice_api_rows, orjson
+from core.views import InvoiceListApiView
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+def _legacy_payload(qs, n):
+    # так InvoiceListApiView отдавал данные раньше: объекты моделей + JsonResponse
+    data = []
+    for inv in qs.select_related('project', 'category', 'project__client').order_by('-date', '-id')[:n]:
+        data.append({
+            'id': inv.id,
+            'date': inv.date.isoformat(),
+            'project': inv.project.title if inv.project else '',
+            'client': inv.project.client.name if inv.project and inv.project.client else '',
+            'category': inv.category.name if inv.category else '',
+            'amount': str(inv.amount),
+            'paid': bool(inv.paid),
+            'external_id': inv.external_id,
+            'description': inv.description or '',
+        })
+    return JsonResponse({'invoices': data}).content
+
+
+def _values_rows(qs, n):
+    return [dict(zip(INVOICE_API_KEYS, row)) for row in invoice_api_rows(qs.order_by('-date', '-id'))[:n]]
+
+
+def _values_stdlib(qs, n):
+    return json.dumps({'invoices': _values_rows(qs, n)}, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+
+
+def _values_orjson(qs, n):
+    return orjson.dumps({'invoices': _values_rows(qs, n)}, default=str)
+
+
+class Command(BaseCommand):
+    help = ('Compare invoice API serialization paths (model objects + JsonResponse, values() + json/orjson, '
+            'NDJSON streaming) at several result sizes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[200, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--username', type=str,
+                            help='Benchmark on this user\'s invoices instead of generated ones')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated benchmark data')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['username']:
+                    try:
+                        user = User.objects.get(username=options['username'])
+                    except User.DoesNotExist:
+                        raise CommandError(f"User not found: {options['username']}")
+                else:
+                    user = self.generate(max(options['sizes']))
+                self.run(user, options)
+                if not options['keep'] and not options['username']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('generated data rolled back')
+
+    def generate(self, n):
+        user, _ = User.objects.get_or_create(username='bench_api')
+        have = Invoice.objects.filter(owner=user).count()
+        if have >= n:
+            return user
+        rng = random.Random(42)
+        clients = Client.objects.bulk_create([Client(owner=user, name=f'Client {i}') for i in range(20)])
+        projects = Project.objects.bulk_create([
+            Project(owner=user, client=clients[i % 20], title=f'Project {i}') for i in range(60)
+        ])
+        categories = Category.objects.bulk_create([Category(owner=user, name=f'Category {i}') for i in range(8)])
+        started = time.perf_counter()
+        start = date(2015, 1, 1)
+        Invoice.objects.bulk_create([
+            Invoice(owner=user, project=rng.choice(projects), category=rng.choice(categories),
+                    date=start + timedelta(days=rng.randrange(3650)),
+                    amount=Decimal(rng.randrange(1000, 500000)) / 100, paid=rng.random() < 0.8,
+                    external_id=f'bench-{have + i}', description=f'Work item {i}')
+            for i in range(n - have)
+        ], batch_size=2000)
+        self.stdout.write(f'generated {n - have} invoices in {time.perf_counter() - started:.1f}s')
+        return user
+
+    def best(self, fn, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - started)
+        return best, result
+
+    def run(self, user, options):
+        qs = Invoice.objects.filter(owner=user)
+        factory = RequestFactory()
+        view = InvoiceListApiView.as_view()
+
+        def ndjson(n):
+            request = factory.get('/api/invoices/', {'format': 'ndjson', 'limit': n})
+            request.user = user
+            return b''.join(view(request).streaming_content)
+
+        def page(n):
+            request = factory.get('/api/invoices/', {'limit': n})
+            request.user = user
+            return view(request).content
+
+        paths = [('objects+JsonResponse', _legacy_payload), ('values+json', _values_stdlib)]
+        if orjson is not None:
+            paths.append(('values+orjson', _values_orjson))
+        paths.append(('ndjson view', lambda qs, n: ndjson(n)))
+
+        self.stdout.write(f"encoder in the API: {'orjson' if orjson is not None else 'json'}")
+        self.stdout.write(f"{'rows':>8} {'path':<22} {'ms':>10} {'rows/s':>12} {'bytes':>12}")
+        total = qs.count()
+        for n in options['sizes']:
+            rows = min(n, total)
+            for name, fn in paths:
+                elapsed, body = self.best(lambda: fn(qs, n), options['repeat'])
+                self.stdout.write(f"{n:>8} {name:<22} {elapsed * 1000:>10.1f} {rows / elapsed:>12.0f} {len(body):>12}")
+            if n <= InvoiceListApiView.max_limit:
+                elapsed, body = self.best(lambda: page(n), options['repeat'])
+                self.stdout.write(f"{n:>8} {'page view':<22} {elapsed * 1000:>10.1f} {rows / elapsed:>12.0f} {len(body):>12}")
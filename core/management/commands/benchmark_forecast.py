@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand
+import time
+import timeit
+import numpy as np
+from scipy.optimize import minimize
+
+from core.utils.forecast import (
+    FITTERS, HW_BACKEND, fit_hw_params, triple_exponential_smoothing, triple_exponential_smoothing_np,
+)
+
+
+def _reference_fit(series, slen):
+    # так параметры подбирались до перехода на массивы
+    def objective(params):
+        a, b, g = params
+        preds = triple_exponential_smoothing(series, slen, 0, a, b, g)
+        return np.sqrt(np.mean((series - preds) ** 2))
+
+    opt = minimize(objective, x0=[0.1, 0.1, 0.1], bounds=((0, 1), (0, 1), (0, 1)))
+    return tuple(opt.x), float(opt.fun)
+
+
+def _best_time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+class Command(BaseCommand):
+    help = ('Compare the list-based and array-based Holt-Winters implementations, and the parameter '
+            'fitters (L-BFGS-B, grid search, grid + refinement) on speed and RMSE, on random series')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lengths', type=int, nargs='+', default=[12, 36, 120, 600],
+                            help='Series lengths (months) to benchmark')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--number', type=int, default=200, help='Calls per measurement')
+        parser.add_argument('--series', type=int, default=10, help='Random series per length for the fitters')
+        parser.add_argument('--slen', type=int, default=3, help='Season length')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(42)
+        slen = options['slen']
+        self.stdout.write(f'backend: {HW_BACKEND}')
+        self.stdout.write(f"{'months':>8} {'reference, us':>14} {'array, us':>10} {'speedup':>8} {'max diff':>10} "
+                          f"{'fit ref, ms':>12} {'fit new, ms':>12} {'speedup':>8}")
+        for n in options['lengths']:
+            months = np.arange(n)
+            series = 1000 + 10 * months + 300 * np.sin(2 * np.pi * months / slen) + rng.normal(0, 50, n)
+
+            ref = np.array(triple_exponential_smoothing(series, slen, 6, 0.3, 0.1, 0.2))
+            new = triple_exponential_smoothing_np(series, slen, 6, 0.3, 0.1, 0.2)
+            diff = float(np.max(np.abs(ref - new)))
+
+            timings = {}
+            for name, fn in (('reference', triple_exponential_smoothing), ('array', triple_exponential_smoothing_np)):
+                best = min(timeit.repeat(lambda: fn(series, slen, 6, 0.3, 0.1, 0.2),
+                                         repeat=options['repeat'], number=options['number']))
+                timings[name] = best / options['number'] * 1e6
+            fit_ref = _best_time(lambda: _reference_fit(series, slen), options['repeat']) * 1e3
+            fit_new = _best_time(lambda: fit_hw_params(series, slen), options['repeat']) * 1e3
+            self.stdout.write(
+                f"{n:>8} {timings['reference']:>14.1f} {timings['array']:>10.1f} "
+                f"{timings['reference'] / timings['array']:>7.1f}x {diff:>10.2e} "
+                f"{fit_ref:>12.1f} {fit_new:>12.1f} {fit_ref / fit_new:>7.1f}x"
+            )
+        self.compare_fitters(rng, slen, options)
+
+    def compare_fitters(self, rng, slen, options):
+        # время и RMSE каждого способа подбора; "worse" -- на скольких рядах RMSE
+        # хуже лучшего из способов больше чем на 1% (застрял в локальном минимуме)
+        self.stdout.write('')
+        self.stdout.write(f"{'months':>8} " + ' '.join(f"{f + ', ms':>18} {'rmse':>9} {'worse':>6}" for f in FITTERS))
+        for n in options['lengths']:
+            months = np.arange(n)
+            series_list = [
+                1000 + rng.uniform(-20, 20) * months
+                + rng.uniform(0, 500) * np.sin(2 * np.pi * months / slen) + rng.normal(0, rng.uniform(20, 200), n)
+                for _ in range(options['series'])
+            ]
+            seconds = {f: 0.0 for f in FITTERS}
+            rmse = {f: [] for f in FITTERS}
+            for series in series_list:
+                for fitter in FITTERS:
+                    seconds[fitter] += _best_time(lambda: fit_hw_params(series, slen, fitter=fitter), options['repeat'])
+                    rmse[fitter].append(fit_hw_params(series, slen, fitter=fitter)[1])
+            best = np.min([rmse[f] for f in FITTERS], axis=0)
+            self.stdout.write(f'{n:>8} ' + ' '.join(
+                f'{seconds[f] / len(series_list) * 1e3:>18.2f} {np.mean(rmse[f]):>9.2f} '
+                f'{int(np.sum(np.array(rmse[f]) > best * 1.01)):>6}'
+                for f in FITTERS
+            ))
@@ -0,0 +1,110 @@
+import csv
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.utils.dataset import dataset_rows, write_dataset_csv
+from core.utils.importer import BATCH_SIZE, csv_ranges, import_invoice_files, import_invoices_from_file
+from core.utils.parsing import PARSED_FIELDS, parse_csv_range, parse_invoice_row
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+def _parse_serial(paths):
+    for path in paths:
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                try:
+                    parse_invoice_row(row)
+                except ValueError:
+                    pass
+
+
+def _parse_pool(paths, workers):
+    # то же, что делает import_invoice_files до записи в базу
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for path in paths:
+            fieldnames, ranges = csv_ranges(path, BATCH_SIZE)
+            futures += [pool.submit(parse_csv_range, path, start, end, fieldnames, first)
+                        for start, end, first, _ in ranges]
+        for future in futures:
+            rows, _ = future.result()
+            [dict(zip(PARSED_FIELDS, row)) for row in rows]
+
+
+def _measure(fn):
+    """(wall seconds, CPU seconds of this process) of one call."""
+    wall, cpu = time.perf_counter(), time.process_time()
+    fn()
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+class Command(BaseCommand):
+    help = ('Compare single-process and pooled CSV import of several generated files: parsing alone and the '
+            'full import, wall time and CPU time of the main (writing) process')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Rows in all files together')
+        parser.add_argument('--files', type=int, default=4)
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, os.cpu_count() or 1])
+        parser.add_argument('--parse-only', action='store_true', help='Skip the full import with database writes')
+
+    def handle(self, *args, **options):
+        per_file = options['rows'] // options['files']
+        workers = sorted(set(options['workers']))
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for n in range(options['files']):
+                paths.append(os.path.join(tmp, f'part{n}.csv'))
+                with open(paths[-1], 'w', newline='', encoding='utf-8') as f:
+                    write_dataset_csv(f, dataset_rows(f'import-{n}', clients=20, invoices=per_file,
+                                                      end=date(2025, 12, 31), prefix=f'F{n}'))
+            rows = per_file * len(paths)
+            self.stdout.write(f'{rows} rows in {len(paths)} files, {os.cpu_count()} CPUs')
+            self.stdout.write(f"{'stage':<8} {'mode':<12} {'wall s':>8} {'main CPU s':>11} {'rows/s':>9} {'speedup':>8}")
+
+            def report(stage, mode, wall, cpu, base):
+                self.stdout.write(f'{stage:<8} {mode:<12} {wall:>8.2f} {cpu:>11.2f} {rows / wall:>9.0f} '
+                                  f'{base / wall:>7.2f}x')
+
+            wall, cpu = _measure(lambda: _parse_serial(paths))
+            report('parse', 'in-process', wall, cpu, wall)
+            for n in workers:
+                report('parse', f'{n} workers', *_measure(lambda: _parse_pool(paths, n)), wall)
+
+            if not options['parse_only']:
+                self.run_imports(paths, workers, report)
+
+    def run_imports(self, paths, workers, report):
+        def serial():
+            owner = User.objects.create_user(username='bench_import_serial')
+            for path in paths:
+                with open(path, 'rb') as f:
+                    import_invoices_from_file(f, owner)
+
+        def pooled(n):
+            owner = User.objects.create_user(username=f'bench_import_{n}')
+            for _ in import_invoice_files([(path, owner) for path in paths], workers=n):
+                pass
+
+        # всё, что записали, откатываем
+        try:
+            with transaction.atomic():
+                wall, cpu = _measure(serial)
+                report('import', 'in-process', wall, cpu, wall)
+                for n in workers:
+                    report('import', f'{n} workers', *_measure(lambda: pooled(n)), wall)
+                raise Rollback
+        except Rollback:
+            pass
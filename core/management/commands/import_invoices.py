@@ -1,26 +1,76 @@
 # core/management/commands/import_invoices.py
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+import csv
+import fnmatch
+import glob
 import os
+import time
 
-from core.utils.importer import import_invoices_from_file
+from core.utils.importer import import_invoices_from_file, iter_import_chunks, import_invoice_files
 
 User = get_user_model()
 
+REJECT_COLUMNS = ['date', 'amount', 'client', 'project', 'category', 'paid', 'external_id', 'description']
+
 class Command(BaseCommand):
-    help = "Import invoices from CSV. Usage: python manage.py import_invoices path/to/file.csv --username USERNAME"
+    help = ("Import invoices from CSV. Usage: python manage.py import_invoices path/to/file.csv --username USERNAME\n"
+            "Several files or globs (exports/*.csv) are imported in parallel, see --workers and --owner-map.")
 
     def add_arguments(self, parser):
-        parser.add_argument('csvfile', type=str, help='Path to CSV file')
+        parser.add_argument('csvfile', type=str, nargs='+', help='Path(s) to CSV file(s), globs allowed')
         parser.add_argument('--username', type=str, help='Owner username for created objects (optional)')
+        parser.add_argument('--chunk-size', type=int, default=0,
+                            help='Streaming mode: commit every N rows and write bad rows to a rejects file')
+        parser.add_argument('--rejects', type=str,
+                            help='Rejects CSV for streaming mode (default: <csvfile>.rejects.csv)')
+        parser.add_argument('--resume-from-line', type=int, default=1,
+                            help='Streaming mode: first data line to import (1 = first row after the header)')
+        parser.add_argument('--resume-offset', type=int, default=0,
+                            help='Streaming mode: byte offset of --resume-from-line, as printed by an earlier run; '
+                                 'the file is read from there instead of re-reading the committed rows')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Parallel mode: number of parsing processes (default: CPU count)')
+        parser.add_argument('--owner-map', type=str,
+                            help='CSV with "pattern,username" lines; file names matching the pattern '
+                                 'are imported for that user, the rest for --username')
 
     def handle(self, *args, **options):
-        csvfile = options['csvfile']
-        username = options.get('username')
+        files = self.expand_files(options['csvfile'])
+        if len(files) > 1 or options['workers'] > 0:
+            self.import_parallel(files, options)
+            return
+
+        csvfile = files[0]
+        owner = self.get_owner(options.get('username'))
 
-        if not os.path.exists(csvfile):
-            raise CommandError(f"File not found: {csvfile}")
+        if options['chunk_size'] > 0 or options['resume_from_line'] > 1 or options['resume_offset']:
+            self.import_streaming(csvfile, owner, options)
+            return
+
+        with open(csvfile, 'rb') as f:
+            result = import_invoices_from_file(f, owner=owner)
 
+        self.stdout.write(self.style.SUCCESS(f"Created: {result['created']}, Skipped: {result['skipped']}"))
+        if result['errors']:
+            for e in result['errors']:
+                self.stdout.write(self.style.ERROR(e))
+
+    def expand_files(self, patterns):
+        files = []
+        for pattern in patterns:
+            matched = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+            if not matched:
+                raise CommandError(f"No files match: {pattern}")
+            for path in matched:
+                if not os.path.exists(path):
+                    raise CommandError(f"File not found: {path}")
+                if path not in files:
+                    files.append(path)
+        return files
+
+    def get_owner(self, username):
         owner = None
         if username:
             try:
@@ -32,11 +82,119 @@ class Command(BaseCommand):
 
         if owner is None:
             raise CommandError("Owner not specified and no superuser found. Use --username.")
+        return owner
 
-        with open(csvfile, 'rb') as f:
-            result = import_invoices_from_file(f, owner=owner)
+    def read_owner_map(self, path):
+        if not os.path.exists(path):
+            raise CommandError(f"File not found: {path}")
+        mapping = []
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) < 2 or not row[0].strip() or row[0].startswith('#'):
+                    continue
+                mapping.append((row[0].strip(), row[1].strip()))
+        return mapping
 
-        self.stdout.write(self.style.SUCCESS(f"Created: {result['created']}, Skipped: {result['skipped']}"))
-        if result['errors']:
-            for e in result['errors']:
-                self.stdout.write(self.style.ERROR(e))
+    def import_parallel(self, files, options):
+        if options['resume_from_line'] > 1 or options['resume_offset']:
+            raise CommandError("--resume-from-line and --resume-offset work with a single file only")
+
+        mapping = self.read_owner_map(options['owner_map']) if options.get('owner_map') else []
+        owners = {}
+        jobs = []
+        for path in files:
+            username = next(
+                (user for pattern, user in mapping
+                 if fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(os.path.basename(path), pattern)),
+                options.get('username'),
+            )
+            if username not in owners:
+                owners[username] = self.get_owner(username)
+            jobs.append((path, owners[username]))
+
+        rejects_path = options.get('rejects') or 'import_rejects.csv'
+        with open(rejects_path, 'w', newline='', encoding='utf-8') as rej:
+            writer = csv.writer(rej)
+            writer.writerow(['file', 'line', 'error'] + REJECT_COLUMNS)
+
+            def on_error(path, line, row, message):
+                writer.writerow([path, line, message] + [row.get(k) or '' for k in REJECT_COLUMNS])
+
+            started = time.monotonic()
+            totals = {}
+            rows = 0
+            try:
+                for path, progress in import_invoice_files(jobs, workers=options['workers'] or None,
+                                                           chunk_size=options['chunk_size'] or 1000,
+                                                           on_error=on_error):
+                    rows += progress['rows'] - totals.get(path, {}).get('rows', 0)
+                    totals[path] = progress
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f"{path} line {progress['line']}: created {progress['created']}, "
+                        f"skipped {progress['skipped']}, errors {progress['errors']} "
+                        f"({rows / elapsed if elapsed else 0:.0f} rows/s total)"
+                    )
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        elapsed = time.monotonic() - started
+        for path, owner in jobs:
+            progress = totals.get(path, {'created': 0, 'skipped': 0, 'errors': 0})
+            self.stdout.write(self.style.SUCCESS(
+                f"{path} ({owner.username}): Created: {progress['created']}, "
+                f"Skipped: {progress['skipped']}, Errors: {progress['errors']}"
+            ))
+        self.stdout.write(f"{rows} rows from {len(jobs)} file(s) in {elapsed:.1f}s")
+        if any(p['errors'] for p in totals.values()):
+            self.stdout.write(self.style.WARNING(f"Rejected rows written to {rejects_path}"))
+
+    def import_streaming(self, csvfile, owner, options):
+        chunk_size = options['chunk_size'] or 1000
+        start_line = max(1, options['resume_from_line'])
+        if options['resume_offset'] and start_line == 1:
+            raise CommandError("--resume-offset needs the matching --resume-from-line")
+        rejects_path = options.get('rejects') or f"{csvfile}.rejects.csv"
+
+        # при resume дописываем в уже существующий файл отказов
+        append = start_line > 1 and os.path.exists(rejects_path)
+        with open(csvfile, 'rb') as f, open(rejects_path, 'a' if append else 'w', newline='', encoding='utf-8') as rej:
+            writer = csv.writer(rej)
+            if not append:
+                writer.writerow(['line', 'error'] + REJECT_COLUMNS)
+
+            def on_error(line, row, message):
+                writer.writerow([line, message] + [row.get(k) or '' for k in REJECT_COLUMNS])
+
+            started = time.monotonic()
+            progress = None
+            try:
+                for progress in iter_import_chunks(f, owner, chunk_size=chunk_size, start_line=start_line,
+                                                   on_error=on_error, start_offset=options['resume_offset'] or None):
+                    rej.flush()
+                    elapsed = time.monotonic() - started
+                    rate = progress['rows'] / elapsed if elapsed else 0
+                    self.stdout.write(
+                        f"line {progress['line']} (offset {progress['offset']}): created {progress['created']}, "
+                        f"skipped {progress['skipped']}, errors {progress['errors']} ({rate:.0f} rows/s)"
+                    )
+            except ValueError as e:
+                raise CommandError(str(e))
+            except DatabaseError as e:
+                if progress is None:
+                    raise CommandError(f"Import failed: {e}")
+                raise CommandError(f"Import failed after line {progress['line']}: {e} ({self.resume_hint(progress)})")
+
+        if progress is None:
+            self.stdout.write(self.style.WARNING(f"Nothing to import after line {start_line - 1}"))
+            return
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Created: {progress['created']}, Skipped: {progress['skipped']}, Errors: {progress['errors']} "
+            f"in {elapsed:.1f}s. Committed through line {progress['line']} ({self.resume_hint(progress)})."
+        ))
+        if progress['errors']:
+            self.stdout.write(self.style.WARNING(f"Rejected rows written to {rejects_path}"))
+
+    def resume_hint(self, progress):
+        return f"use --resume-from-line {progress['line'] + 1} --resume-offset {progress['offset']} to continue"
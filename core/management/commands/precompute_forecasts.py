@@ -0,0 +1,106 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone as dt_timezone
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core.models import ForecastState, MonthlyRollup
+from core.utils.cache import get_data_versions, set_cached_forecast
+from core.utils.forecast import FITTERS, eligible_models, forecast_from_points, save_forecast_state
+
+
+def is_fallback(saved):
+    """A state fitted without a backtest although the history allows one: the model was never selected."""
+    return saved.backtest_rmse is None and bool(eligible_models(saved.fitted_len))
+
+
+class Command(BaseCommand):
+    help = 'Precompute dashboard forecasts for all users so the dashboard does not fit models on request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=6)
+        parser.add_argument('--workers', type=int, default=None, help='Fitting processes (default: CPU count)')
+        parser.add_argument('--changed-since', type=str,
+                            help='Only users whose invoices changed since this date/datetime (ISO)')
+        parser.add_argument('--fitter', choices=FITTERS, help='Parameter fitter (default: FORECAST_FITTER)')
+        parser.add_argument('--force', action='store_true',
+                            help='Recompute even if the stored forecast matches the current data')
+
+    def handle(self, *args, **options):
+        months_ahead = options['months_ahead']
+        fitter = options['fitter'] or getattr(settings, 'FORECAST_FITTER', 'minimize')
+        since = None
+        if options.get('changed_since'):
+            since = parse_datetime(options['changed_since'])
+            if since is None:
+                day = parse_date(options['changed_since'])
+                if day is None:
+                    raise CommandError(f"Invalid --changed-since: {options['changed_since']}")
+                since = datetime(day.year, day.month, day.day)
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=dt_timezone.utc)
+        started = time.monotonic()
+
+        # версии данных -- это метки времени последнего изменения (см. core.utils.cache)
+        states = {s.owner_id: s for s in ForecastState.objects.all()}
+        versions = get_data_versions(list(
+            MonthlyRollup.objects.order_by().values_list('owner_id', flat=True).distinct()
+        ))
+        todo = []
+        for owner_id, version in versions.items():
+            saved = states.get(owner_id)
+            # запасную модель, сохранённую по таймауту выбора, выбираем заново при любых флагах
+            if saved and is_fallback(saved):
+                todo.append(owner_id)
+                continue
+            if not options['force'] and saved and saved.has_result(months_ahead, version):
+                continue
+            if since and saved and version / 1e9 < since.timestamp():
+                continue
+            todo.append(owner_id)
+
+        # одним запросом помесячные суммы сразу по всем выбранным пользователям
+        points = {owner_id: [] for owner_id in todo}
+        monthly = (
+            MonthlyRollup.objects.filter(owner_id__in=todo)
+            .values('owner_id', 'month')
+            .annotate(total=Sum('total'))
+            .order_by('owner_id', 'month')
+        )
+        for r in monthly:
+            if r['total']:
+                points[r['owner_id']].append((r['month'], float(r['total'])))
+        query_time = time.monotonic() - started
+
+        fit_started = time.monotonic()
+        stored = skipped = 0
+        with ProcessPoolExecutor(max_workers=options['workers'] or None) as pool:
+            futures = {}
+            for owner_id in todo:
+                saved = states.get(owner_id)
+                state = saved.to_state() if saved and not is_fallback(saved) else None
+                futures[pool.submit(forecast_from_points, points[owner_id], months_ahead, state,
+                                    fitter=fitter)] = owner_id
+            for future in as_completed(futures):
+                owner_id = futures[future]
+                result, state = future.result()
+                if state is None:
+                    skipped += 1
+                    continue
+                save_forecast_state(owner_id, states.get(owner_id), state, result, months_ahead, versions[owner_id])
+                set_cached_forecast(owner_id, months_ahead, versions[owner_id], result)
+                stored += 1
+        fit_time = time.monotonic() - fit_started
+
+        total = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Forecasts stored: {stored}, too short history: {skipped}, "
+            f"up to date: {len(versions) - len(todo)} (users with invoices: {len(versions)})"
+        ))
+        self.stdout.write(
+            f"monthly totals query: {query_time:.2f}s, fitting+saving: {fit_time:.2f}s "
+            f"({fit_time / len(todo) * 1000 if todo else 0:.1f} ms/user), total: {total:.2f}s"
+        )
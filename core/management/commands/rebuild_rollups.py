@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+import time
+
+from core.utils.cache import bump_data_version
+from core.utils.rollup import rebuild_rollups
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the MonthlyRollup summary table from invoices (all users or --username)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, help='Rebuild only this user')
+
+    def handle(self, *args, **options):
+        owner_ids = None
+        if options.get('username'):
+            try:
+                owner_ids = [User.objects.get(username=options['username']).pk]
+            except User.DoesNotExist:
+                raise CommandError(f"User not found: {options['username']}")
+
+        started = time.monotonic()
+        rows = rebuild_rollups(owner_ids)
+        for owner_id in owner_ids or User.objects.values_list('pk', flat=True):
+            bump_data_version(owner_id)
+        self.stdout.write(self.style.SUCCESS(f'Rollup rows written: {rows} in {time.monotonic() - started:.2f}s'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from core.utils.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = ('Re-create the invoice full-text search table and its triggers and refill it. '
+            '`migrate` restores lost SQLite triggers by itself, this is for manual repairs.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        with transaction.atomic(using=options['database']):
+            backend = install_search_index(connection)
+        if backend is None:
+            self.stdout.write(self.style.WARNING(
+                f"{connection.vendor} has no supported full-text index, search uses icontains"))
+            return
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt ({backend})"))
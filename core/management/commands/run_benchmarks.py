@@ -0,0 +1,230 @@
+import io
+import json
+import os
+import platform
+import time
+from datetime import date, datetime, timezone
+
+import django
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+
+from core.models import Invoice
+from core.utils.api import orjson
+from core.utils.cache import bump_data_version
+from core.utils.dataset import dataset_rows, write_dataset, write_dataset_csv
+from core.utils.forecast import HW_BACKEND, forecast_monthly
+from core.utils.importer import import_invoices_from_file
+from core.views import DashboardView, ExportInvoicesCSVView, InvoiceListApiView, InvoiceListView
+
+User = get_user_model()
+
+BENCHMARK_DIR = os.path.join(settings.BASE_DIR, 'benchmarks')
+
+BENCHMARKS = ('import', 'forecast_monthly', 'dashboard_first', 'dashboard', 'invoice_list', 'invoice_search',
+              'api_page', 'api_ndjson', 'export_csv')
+
+# у этих время растёт с числом строк, для них пишется и rows_per_sec
+ROW_BENCHMARKS = {'import', 'forecast_monthly', 'api_ndjson', 'export_csv'}
+
+# разница меньше этого -- шум, даже если в процентах она большая
+NOISE_SECONDS = 0.002
+
+
+class Rollback(Exception):
+    pass
+
+
+def _best(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'numpy': np.__version__,
+        'database': connection.vendor,
+        'hw_backend': HW_BACKEND,
+        'json': 'orjson' if orjson is not None else 'json',
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Rows (name, size, seconds, baseline seconds or None, change or None, regressed)
+    for the current ``results`` against a ``baseline`` report.
+    """
+    base = {(r['name'], r['size']): r['seconds'] for r in baseline.get('results', [])}
+    rows = []
+    for r in results:
+        before = base.get((r['name'], r['size']))
+        if before is None:
+            rows.append((r['name'], r['size'], r['seconds'], None, None, False))
+            continue
+        change = r['seconds'] / before - 1 if before else 0.0
+        regressed = change > tolerance and r['seconds'] - before > NOISE_SECONDS
+        rows.append((r['name'], r['size'], r['seconds'], before, change, regressed))
+    return rows
+
+
+class Command(BaseCommand):
+    help = ('Time the importer, forecast_monthly, the dashboard, the list/search/API views and the CSV export on '
+            'seeded generated data of several sizes (rolled back afterwards), write the results as JSON and '
+            'compare them with a stored baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='Invoices per user')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the best one counts')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='Run only these benchmarks')
+        parser.add_argument('--output', type=str, default=os.path.join(BENCHMARK_DIR, 'latest.json'),
+                            help="JSON results file ('-' for stdout)")
+        parser.add_argument('--baseline', type=str, default=os.path.join(BENCHMARK_DIR, 'baseline.json'),
+                            help='Baseline to compare with, if the file exists')
+        parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Slowdown against the baseline (0.25 = 25%%) reported as a regression')
+
+    def handle(self, *args, **options):
+        only = set(options['only'] or BENCHMARKS)
+        results = []
+        owner_ids = []
+        try:
+            with transaction.atomic():
+                for size in options['sizes']:
+                    results.extend(self.run_size(size, only, options, owner_ids))
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            # после отката id пользователей займут другие -- их версии в кэше должны смениться
+            for owner_id in owner_ids:
+                bump_data_version(owner_id)
+
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'seed': options['seed'],
+            'repeat': options['repeat'],
+            'environment': environment(),
+            'results': results,
+        }
+        self.write_json(report, options['output'])
+
+        regressions = []
+        if os.path.exists(options['baseline']) and not options['save_baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = self.report_comparison(report, baseline, options['tolerance'])
+        if options['save_baseline']:
+            self.write_json(report, options['baseline'])
+            self.stdout.write(f"baseline saved to {options['baseline']}")
+        if regressions:
+            raise CommandError(f"{len(regressions)} regression(s) over {options['tolerance']:.0%}: "
+                               + ', '.join(f'{name}@{size}' for name, size in regressions))
+
+    def write_json(self, report, path):
+        data = json.dumps(report, indent=2)
+        if path == '-':
+            self.stdout.write(data)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(data + '\n')
+
+    def report_comparison(self, report, baseline, tolerance):
+        if baseline.get('environment') != report['environment']:
+            self.stdout.write(self.style.WARNING('baseline was recorded in a different environment'))
+        self.stdout.write(f"{'benchmark':<18} {'size':>8} {'ms':>10} {'baseline':>10} {'change':>8}")
+        regressions = []
+        for name, size, seconds, before, change, regressed in compare(report['results'], baseline, tolerance):
+            if before is None:
+                self.stdout.write(f'{name:<18} {size:>8} {seconds * 1000:>10.1f} {"-":>10} {"new":>8}')
+                continue
+            line = f'{name:<18} {size:>8} {seconds * 1000:>10.1f} {before * 1000:>10.1f} {change:>+8.0%}'
+            if regressed:
+                regressions.append((name, size))
+                line = self.style.ERROR(line + '  REGRESSION')
+            self.stdout.write(line)
+        return regressions
+
+    def run_size(self, size, only, options, owner_ids):
+        repeat = options['repeat']
+        # одни и те же данные для заданных seed и размера
+        end = date(2025, 12, 31)
+
+        def rows(prefix):
+            return dataset_rows(f"{options['seed']}-{size}", clients=max(5, size // 2000), invoices=size,
+                                years=5, end=end, prefix=prefix)
+
+        started = time.perf_counter()
+        user = User.objects.create_user(username=f'bench_{size}')
+        owner_ids.append(user.pk)
+        write_dataset(user, rows('BENCH'))
+        self.stdout.write(f'size {size}: generated in {time.perf_counter() - started:.1f}s')
+
+        factory = RequestFactory()
+
+        def get(view, path, params=None, **headers):
+            request = factory.get(path, params or {}, **headers)
+            request.user = user
+            response = view(request)
+            if response.streaming:
+                return b''.join(response.streaming_content)
+            if hasattr(response, 'render'):
+                response.render()
+            return response.content
+
+        dashboard = DashboardView.as_view()
+        invoice_list = InvoiceListView.as_view()
+        api = InvoiceListApiView.as_view()
+        export = ExportInvoicesCSVView.as_view()
+
+        csv_file = io.StringIO()
+        write_dataset_csv(csv_file, rows('IMPORT'))
+        csv_bytes = csv_file.getvalue().encode('utf-8')
+
+        def run_import():
+            # каждый прогон -- в новый пользователь, и тут же откатывается
+            sid = transaction.savepoint()
+            target = User.objects.create_user(username=f'bench_import_{size}')
+            import_invoices_from_file(io.BytesIO(csv_bytes), owner=target)
+            transaction.savepoint_rollback(sid)
+
+        benchmarks = [
+            ('import', run_import),
+            ('forecast_monthly', lambda: forecast_monthly(Invoice.objects.filter(owner=user))),
+            ('dashboard', lambda: get(dashboard, '/dashboard/')),
+            ('invoice_list', lambda: get(invoice_list, '/invoices/')),
+            ('invoice_search', lambda: get(invoice_list, '/invoices/', {'q': 'migration'})),
+            ('api_page', lambda: get(api, '/api/invoices/', {'limit': 100})),
+            ('api_ndjson', lambda: get(api, '/api/invoices/', {'format': 'ndjson'})),
+            ('export_csv', lambda: get(export, '/invoices/export/')),
+        ]
+        results = []
+        if 'dashboard_first' in only:
+            # первый запрос считает прогноз, следующие берут его из кэша
+            started = time.perf_counter()
+            get(dashboard, '/dashboard/')
+            results.append({'name': 'dashboard_first', 'size': size, 'seconds': time.perf_counter() - started})
+        for name, fn in benchmarks:
+            if name not in only:
+                continue
+            seconds = _best(fn, repeat)
+            results.append({'name': name, 'size': size, 'seconds': seconds})
+        for r in results:
+            if r['name'] in ROW_BENCHMARKS:
+                r['rows_per_sec'] = round(size / r['seconds'])
+            self.stdout.write(f"{r['name']:<18} {size:>8} {r['seconds'] * 1000:>10.1f} ms")
+        return results
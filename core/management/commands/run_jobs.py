@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import ExportJob, ImportJob
+from core.utils import metrics
+from core.utils.export import evict_exports, run_export_job
+from core.utils.importer import import_job_stats, requeue_stale_import_jobs, run_import_job
+from core.utils.uploads import cleanup_uploads
+
+
+class Command(BaseCommand):
+    help = ('Run queued background jobs (CSV imports and exports). Needed when BACKGROUND_JOBS = "command"; '
+            'with the default in-process pool it only picks up jobs left over after a restart.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run what is queued now and exit')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between queue polls')
+
+    def handle(self, *args, **options):
+        last_evict = 0
+        while True:
+            # импорт, чей воркер умер, продолжится с последней закоммиченной строки
+            requeued = requeue_stale_import_jobs()
+            if requeued:
+                self.stdout.write(f"requeued {requeued} stalled import(s)")
+
+            for pk in ImportJob.objects.filter(status='pending').order_by('created_at').values_list('pk', flat=True):
+                if run_import_job(pk):
+                    job = ImportJob.objects.get(pk=pk)
+                    stats = import_job_stats(job)
+                    self.stdout.write(
+                        f"import #{pk} ({job.filename}): {job.status}, {job.rows} rows, created {job.created}, "
+                        f"skipped {job.skipped}, errors {job.errors} ({stats['rows_per_sec']:.0f} rows/s)"
+                    )
+
+            pending = list(
+                ExportJob.objects.filter(status='pending').order_by('created_at').values_list('pk', flat=True)
+            )
+            for pk in pending:
+                started = time.monotonic()
+                if run_export_job(pk):
+                    job = ExportJob.objects.get(pk=pk)
+                    self.stdout.write(
+                        f"export #{pk} ({job.format}): {job.status}, {job.rows} rows, "
+                        f"{job.size} bytes in {time.monotonic() - started:.1f}s"
+                    )
+
+            # файлы устаревают и без новых выгрузок, брошенные превью импорта тоже
+            if time.monotonic() - last_evict > 60 or options['once']:
+                removed, freed = evict_exports()
+                last_evict = time.monotonic()
+                if removed:
+                    self.stdout.write(f"evicted {removed} export file(s), {freed} bytes")
+                abandoned = cleanup_uploads()
+                if abandoned:
+                    self.stdout.write(f"removed {abandoned} abandoned upload(s)")
+
+            # метрики импорта этого процесса видны на /metrics через METRICS_DIR
+            metrics.flush(force=True)
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -1,12 +1,26 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from core.models import Invoice
+import time
+
+from core.utils.statuses import BATCH_SIZE, update_invoice_statuses
+
 
 class Command(BaseCommand):
-    help = 'Mark invoices overdue where date < today and not paid'
+    help = 'Sync invoice statuses (overdue/paid/sent) with paid and the due date, in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Invoices per UPDATE')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the watermark and check all unpaid invoices for being overdue')
 
     def handle(self, *args, **options):
-        today = timezone.localdate()
-        qs = Invoice.objects.filter(paid=False, date__lt=today).exclude(status='overdue')
-        updated = qs.update(status='overdue')
-        self.stdout.write(self.style.SUCCESS(f'Updated {updated} invoices to overdue'))
\ No newline at end of file
+        def on_batch(name, number, updated, seconds):
+            self.stdout.write(f'{name}: batch {number} updated {updated} in {seconds * 1000:.1f} ms')
+
+        started = time.monotonic()
+        totals = update_invoice_statuses(batch_size=options['batch_size'], sleep=options['sleep'],
+                                         full=options['full'], on_batch=on_batch)
+        summary = ', '.join(f'{name}: {count}' for name, count in totals.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated {sum(totals.values())} invoices ({summary}) in {time.monotonic() - started:.2f}s'
+        ))
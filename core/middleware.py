@@ -0,0 +1,129 @@
+# core/middleware.py
+import heapq
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import FileResponse
+
+from core.utils import metrics
+
+logger = logging.getLogger('core.slow_requests')
+
+# сколько самых долгих запросов к БД показывать в логе медленного запроса
+SLOW_REQUEST_TOP_QUERIES = 5
+
+
+class QueryStats:
+    """connection.execute_wrapper that counts SQL queries and their time; keeps the SQL if ``keep``."""
+
+    def __init__(self, keep=False):
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = [] if keep else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if self.queries is not None:
+                self.queries.append((elapsed, sql))
+
+
+def _add_wrapper(wrapper):
+    connection.execute_wrappers.append(wrapper)
+
+
+def _remove_wrapper(wrapper):
+    connection.execute_wrappers.remove(wrapper)
+
+
+class MetricsMiddleware:
+    """
+    Records latency, SQL query count and SQL time of every request per view
+    (see core.utils.metrics) and logs requests slower than SLOW_REQUEST_SECONDS
+    together with their slowest queries. Streaming responses are measured until
+    the last chunk is sent. Works under WSGI and ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, 'SLOW_REQUEST_SECONDS', None)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        stats = QueryStats(keep=self.slow_seconds is not None)
+        with connection.execute_wrapper(stats):
+            response = self.get_response(request)
+        # FileResponse не оборачиваем, чтобы сервер мог отдать файл через sendfile
+        if response.streaming and not response.is_async and not isinstance(response, FileResponse):
+            response.streaming_content = self._stream(response.streaming_content, request, response, stats, started)
+        else:
+            self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stats = QueryStats(keep=self.slow_seconds is not None)
+        # под ASGI запросы к БД идут в отдельном потоке запроса (sync_to_async),
+        # а соединения у каждого потока свои -- обёртку ставим в том потоке
+        await sync_to_async(_add_wrapper)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_remove_wrapper)(stats)
+        if response.streaming and response.is_async:
+            response.streaming_content = self._astream(response.streaming_content, request, response, stats, started)
+        else:
+            self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def _stream(self, content, request, response, stats, started):
+        try:
+            with connection.execute_wrapper(stats):
+                yield from content
+        finally:
+            self.record(request, response, stats, time.perf_counter() - started)
+
+    async def _astream(self, content, request, response, stats, started):
+        await sync_to_async(_add_wrapper)(stats)
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            await sync_to_async(_remove_wrapper)(stats)
+            self.record(request, response, stats, time.perf_counter() - started)
+
+    def record(self, request, response, stats, elapsed):
+        match = request.resolver_match
+        # по имени маршрута, а не по пути: число рядов метрик не растёт от id в URL
+        view = match.view_name if match else 'unmatched'
+        metrics.inc('http_requests_total', view=view, method=request.method, status=str(response.status_code))
+        metrics.observe('http_request_duration_seconds', elapsed, view=view)
+        metrics.observe('http_request_db_queries', stats.count, view=view)
+        metrics.observe('http_request_db_seconds', stats.seconds, view=view)
+        if self.slow_seconds is not None and elapsed >= self.slow_seconds:
+            metrics.inc('http_slow_requests_total', view=view)
+            top = heapq.nlargest(SLOW_REQUEST_TOP_QUERIES, stats.queries, key=lambda q: q[0])
+            logger.warning(
+                'Slow request %s %s (%s): %.3fs, %d queries in %.3fs%s',
+                request.method, request.get_full_path(), view, elapsed, stats.count, stats.seconds,
+                ''.join(f'\n  {seconds * 1000:8.1f} ms  {sql[:500]}' for seconds, sql in top),
+            )
+        metrics.flush()
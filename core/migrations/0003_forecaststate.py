@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-18 07:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_invoice_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slen', models.PositiveSmallIntegerField()),
+                ('alpha', models.FloatField()),
+                ('beta', models.FloatField()),
+                ('gamma', models.FloatField()),
+                ('level', models.FloatField()),
+                ('trend', models.FloatField()),
+                ('seasonals', models.JSONField(default=list)),
+                ('months', models.JSONField(default=list, help_text='месяцы (YYYY-MM), уже учтённые в состоянии')),
+                ('values', models.JSONField(default=list, help_text='суммы по этим месяцам')),
+                ('resid_sum', models.FloatField(default=0)),
+                ('resid_sq', models.FloatField(default=0)),
+                ('fitted_at', models.DateTimeField()),
+                ('fitted_len', models.PositiveIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='forecast_state', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_forecaststate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forecaststate',
+            name='result',
+            field=models.JSONField(blank=True, help_text='готовый прогноз для result_version', null=True),
+        ),
+        migrations.AddField(
+            model_name='forecaststate',
+            name='result_months_ahead',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='forecaststate',
+            name='result_version',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
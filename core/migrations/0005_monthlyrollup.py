@@ -0,0 +1,52 @@
+# Generated by Django 6.0 on 2026-10-18 08:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def build_rollups(apps, schema_editor):
+    Invoice = apps.get_model('core', 'Invoice')
+    MonthlyRollup = apps.get_model('core', 'MonthlyRollup')
+    rows = (
+        Invoice.objects
+        .annotate(month=TruncMonth('date'))
+        .values('owner_id', 'month', 'project__client_id', 'category_id', 'paid')
+        .annotate(total=Sum('amount'), n=Count('id'))
+        .order_by()
+    )
+    MonthlyRollup.objects.bulk_create([
+        MonthlyRollup(owner_id=r['owner_id'], month=r['month'], client_id=r['project__client_id'],
+                      category_id=r['category_id'], paid=r['paid'], total=r['total'], count=r['n'])
+        for r in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_forecaststate_result'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='первое число месяца')),
+                ('paid', models.BooleanField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.category')),
+                ('client', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.client')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'month'], name='rollup_owner_month')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
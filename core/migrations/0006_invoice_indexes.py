@@ -0,0 +1,51 @@
+# Generated by Django 6.0 on 2026-10-18 09:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def rename_duplicate_external_ids(apps, schema_editor):
+    # до ограничения уникальности дубли могли появиться через форму создания инвойса;
+    # первый инвойс сохраняет external_id, остальным дописываем id
+    Invoice = apps.get_model('core', 'Invoice')
+    duplicates = (
+        Invoice.objects.exclude(external_id='')
+        .values('owner_id', 'external_id')
+        .annotate(n=Count('id'), first_id=Min('id'))
+        .filter(n__gt=1)
+        .order_by()
+    )
+    for dup in duplicates:
+        for inv in Invoice.objects.filter(owner_id=dup['owner_id'], external_id=dup['external_id']) \
+                .exclude(id=dup['first_id']):
+            inv.external_id = f"{inv.external_id}-dup-{inv.id}"[:200]
+            inv.save(update_fields=['external_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_monthlyrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_external_ids, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['owner', 'date', 'id'], name='invoice_owner_date'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['owner', 'paid', 'date'], name='invoice_owner_paid_date'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('paid', False)), fields=['date'], name='invoice_unpaid_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.UniqueConstraint(condition=models.Q(('external_id', ''), _negated=True), fields=('owner', 'external_id'), name='invoice_owner_external_id_uniq'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-18 13:20
+
+from django.db import migrations
+
+from core.utils.search import install_search_index, uninstall_search_index
+
+
+def create_search_index(apps, schema_editor):
+    # на базах без FTS5/tsvector ничего не создаётся, поиск остаётся на icontains
+    install_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_exportjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_invoice_status_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forecaststate',
+            name='backtest_rmse',
+            field=models.FloatField(blank=True, help_text='ошибка модели на бэктесте при выборе', null=True),
+        ),
+        migrations.AddField(
+            model_name='forecaststate',
+            name='damped',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='forecaststate',
+            name='phi',
+            field=models.FloatField(default=1.0, help_text='затухание тренда, 1 -- без затухания'),
+        ),
+        migrations.AlterField(
+            model_name='forecaststate',
+            name='slen',
+            field=models.PositiveSmallIntegerField(help_text='длина сезона, 1 -- без сезонности'),
+        ),
+    ]
@@ -1,6 +1,6 @@
 from django.db import models
 from django.contrib.auth import get_user_model
-from datetime import date
+from datetime import date, datetime
 
 
 User = get_user_model()
@@ -40,6 +40,10 @@ class Category(models.Model):
         return self.name
 
 
+# оплаченные со статусом не 'paid' и неоплаченные со статусом 'paid'
+STATUS_UNSYNCED = (models.Q(paid=True) & ~models.Q(status='paid')) | models.Q(paid=False, status='paid')
+
+
 class Invoice(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
@@ -61,6 +65,25 @@ class Invoice(models.Model):
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            # список инвойсов, помесячные агрегаты: owner + диапазон/сортировка по дате
+            models.Index(fields=['owner', 'date', 'id'], name='invoice_owner_date'),
+            # сортировка списка по сумме (keyset по amount, id)
+            models.Index(fields=['owner', 'amount', 'id'], name='invoice_owner_amount'),
+            # фильтр paid в списке и просроченные на дашборде
+            models.Index(fields=['owner', 'paid', 'date'], name='invoice_owner_paid_date'),
+            # update_invoice_statuses идёт по всем пользователям, но только по неоплаченным
+            models.Index(fields=['date'], condition=models.Q(paid=False), name='invoice_unpaid_date'),
+            # status не совпадает с paid -- update_invoice_statuses находит их без скана таблицы
+            models.Index(fields=['id'], condition=STATUS_UNSYNCED, name='invoice_status_unsynced'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'external_id'],
+                condition=~models.Q(external_id=''),
+                name='invoice_owner_external_id_uniq',
+            ),
+        ]
 
 
     def __str__(self):
@@ -68,4 +91,190 @@ class Invoice(models.Model):
 
     @property
     def is_overdue(self):
-        return (not self.paid) and (self.date < date.today())
\ No newline at end of file
+        return (not self.paid) and (self.date < date.today())
+
+class ForecastState(models.Model):
+    """
+    Last chosen Holt-Winters model, its fitted parameters and smoothing state for a
+    user's monthly series, so the next forecast can continue from here instead of
+    selecting and refitting the model.
+    """
+    owner = models.OneToOneField(User, on_delete=models.CASCADE, related_name='forecast_state')
+    slen = models.PositiveSmallIntegerField(help_text="длина сезона, 1 -- без сезонности")
+    damped = models.BooleanField(default=False)
+    alpha = models.FloatField()
+    beta = models.FloatField()
+    gamma = models.FloatField()
+    phi = models.FloatField(default=1.0, help_text="затухание тренда, 1 -- без затухания")
+    backtest_rmse = models.FloatField(null=True, blank=True, help_text="ошибка модели на бэктесте при выборе")
+    level = models.FloatField()
+    trend = models.FloatField()
+    seasonals = models.JSONField(default=list)
+    months = models.JSONField(default=list, help_text="месяцы (YYYY-MM), уже учтённые в состоянии")
+    values = models.JSONField(default=list, help_text="суммы по этим месяцам")
+    resid_sum = models.FloatField(default=0)
+    resid_sq = models.FloatField(default=0)
+    fitted_at = models.DateTimeField()
+    fitted_len = models.PositiveIntegerField()
+    result = models.JSONField(null=True, blank=True, help_text="готовый прогноз для result_version")
+    result_months_ahead = models.PositiveSmallIntegerField(null=True, blank=True)
+    result_version = models.CharField(max_length=32, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+    def __str__(self):
+        return f"{self.owner} — {len(self.months)} months"
+
+    def has_result(self, months_ahead, version):
+        return (self.result is not None and self.result_months_ahead == months_ahead
+                and self.result_version == str(version))
+
+    def to_state(self):
+        return {
+            'slen': self.slen,
+            'damped': self.damped,
+            'params': [self.alpha, self.beta, self.gamma],
+            'phi': self.phi,
+            'backtest_rmse': self.backtest_rmse,
+            'months': self.months,
+            'values': self.values,
+            'level': self.level,
+            'trend': self.trend,
+            'seasonals': self.seasonals,
+            'state_len': len(self.months),
+            'resid_sum': self.resid_sum,
+            'resid_sq': self.resid_sq,
+            'fitted_at': self.fitted_at.isoformat(),
+            'fitted_len': self.fitted_len,
+        }
+
+    def update_from_state(self, state):
+        self.slen = state['slen']
+        self.damped = state['damped']
+        self.alpha, self.beta, self.gamma = state['params']
+        self.phi = state['phi']
+        self.backtest_rmse = state['backtest_rmse']
+        self.months = state['months']
+        self.values = state['values']
+        self.level = state['level']
+        self.trend = state['trend']
+        self.seasonals = state['seasonals']
+        self.resid_sum = state['resid_sum']
+        self.resid_sq = state['resid_sq']
+        self.fitted_at = datetime.fromisoformat(state['fitted_at'])
+        self.fitted_len = state['fitted_len']
+
+
+class MonthlyRollup(models.Model):
+    """
+    Pre-aggregated invoice totals per owner, month, client, category and paid flag.
+    Kept up to date on every invoice write (see core.signals and the importer);
+    can be rebuilt from scratch with the rebuild_rollups command.
+    Rows are only ever read through Sum(). Deleting a client or category turns its
+    keys into NULL ones, so until the owner's rollups are rebuilt (core.signals does
+    that on commit) several rows can share a key; deltas are added to only one of them.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_rollups')
+    month = models.DateField(help_text="первое число месяца")
+    client = models.ForeignKey(Client, on_delete=models.SET_NULL, null=True, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='+')
+    paid = models.BooleanField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+
+    class Meta:
+        indexes = [models.Index(fields=['owner', 'month'], name='rollup_owner_month')]
+
+
+    def __str__(self):
+        return f"{self.owner} {self.month:%Y-%m} — {self.total}"
+
+
+class ExportJob(models.Model):
+    """Background export of a user's invoices to a compressed file on disk."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('expired', 'Expired'),
+    ]
+    FORMAT_CHOICES = [
+        ('csv', 'CSV (gzip)'),
+        ('jsonl', 'JSON Lines (gzip)'),
+        ('parquet', 'Parquet'),
+    ]
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='csv')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    data_version = models.CharField(max_length=32, help_text="версия данных, с которой сделан файл")
+    path = models.CharField(max_length=500, blank=True)
+    size = models.BigIntegerField(default=0)
+    rows = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
+
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['owner', 'format', 'data_version'], name='exportjob_reuse')]
+
+
+    def __str__(self):
+        return f"{self.owner} {self.format} — {self.status}"
+
+
+class ImportJob(models.Model):
+    """Background import of an uploaded CSV file; progress is updated after every committed chunk."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='import_jobs')
+    filename = models.CharField(max_length=255)
+    path = models.CharField(max_length=500, help_text="загруженный файл на диске до конца импорта")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    size = models.BigIntegerField(default=0)
+    position = models.BigIntegerField(default=0, help_text="сколько байт файла уже обработано")
+    line = models.IntegerField(default=0, help_text="последняя закоммиченная строка данных")
+    rows = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    errors = models.IntegerField(default=0)
+    error_lines = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+    def __str__(self):
+        return f"{self.filename} ({self.owner}) — {self.status}"
+
+
+
+class InvoiceStatusWatermark(models.Model):
+    """
+    Where update_invoice_statuses stopped: unpaid invoices due before ``date`` or
+    with an id up to ``last_invoice_id`` have already been marked overdue.
+    """
+    date = models.DateField()
+    last_invoice_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+    def __str__(self):
+        return f"{self.date} (id <= {self.last_invoice_id})"
@@ -0,0 +1,100 @@
+from decimal import Decimal
+from django.db import connections, transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Category, Invoice, Project
+from .utils.cache import bump_data_version
+from .utils.rollup import add_delta, apply_deltas, rebuild_rollups, rollup_key
+from .utils.search import ensure_search_triggers
+
+
+def _old_rollup_key(invoice):
+    old = (
+        Invoice.objects.filter(pk=invoice.pk)
+        .values('owner_id', 'date', 'project__client_id', 'category_id', 'paid', 'amount')
+        .first()
+    )
+    if old is None:
+        return None, None
+    key = rollup_key(old['owner_id'], old['date'], old['project__client_id'], old['category_id'], old['paid'])
+    return key, old['amount']
+
+
+def _amount(invoice):
+    # до сохранения amount может быть float/str -- приводим так же, как это сделает БД
+    return Decimal(str(invoice.amount)).quantize(Decimal('0.01'))
+
+
+def _rollup_key(invoice):
+    client_id = invoice.project.client_id if invoice.project_id else None
+    return rollup_key(invoice.owner_id, invoice.date, client_id, invoice.category_id, invoice.paid)
+
+
+@receiver(pre_save, sender=Invoice)
+def invoice_before_save(sender, instance, raw=False, **kwargs):
+    # запоминаем, что было в БД, чтобы вычесть старое значение из сводки
+    instance._rollup_old = _old_rollup_key(instance) if instance.pk and not raw else (None, None)
+
+
+@receiver(post_save, sender=Invoice)
+def invoice_saved(sender, instance, raw=False, **kwargs):
+    bump_data_version(instance.owner_id)
+    if raw:
+        return
+    deltas = {}
+    old_key, old_amount = getattr(instance, '_rollup_old', (None, None))
+    if old_key is not None:
+        add_delta(deltas, old_key, -old_amount, -1)
+    add_delta(deltas, _rollup_key(instance), _amount(instance), 1)
+    apply_deltas(deltas)
+
+
+@receiver(post_delete, sender=Invoice)
+def invoice_deleted(sender, instance, **kwargs):
+    bump_data_version(instance.owner_id)
+    # при удалении пользователя его сводка удаляется каскадом сама
+    try:
+        key = _rollup_key(instance)
+    except Project.DoesNotExist:
+        key = rollup_key(instance.owner_id, instance.date, None, instance.category_id, instance.paid)
+    apply_deltas({key: (-_amount(instance), -1)})
+
+
+@receiver(pre_save, sender=Project)
+def project_before_save(sender, instance, raw=False, **kwargs):
+    instance._old_client_id = (
+        Project.objects.filter(pk=instance.pk).values_list('client_id', flat=True).first()
+        if instance.pk and not raw else None
+    )
+
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, created, raw=False, **kwargs):
+    # инвойсы проекта переехали к другому клиенту -- пересобираем сводку владельца
+    if not created and not raw and getattr(instance, '_old_client_id', None) not in (None, instance.client_id):
+        _schedule_rebuild(instance.owner_id)
+
+
+@receiver(post_delete, sender=Project)
+def project_deleted(sender, instance, **kwargs):
+    # у инвойсов проекта обнуляется project, т.е. и клиент
+    _schedule_rebuild(instance.owner_id)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    # строки сводки удалённой категории стали строками без категории -- сливаем их с такими же.
+    # Клиент удаляется вместе с проектами, это уже пересобирает сводку в project_deleted
+    _schedule_rebuild(instance.owner_id)
+
+
+def _schedule_rebuild(owner_id):
+    transaction.on_commit(lambda: rebuild_rollups([owner_id]))
+    bump_data_version(owner_id)
+
+
+def restore_search_triggers(sender, using, **kwargs):
+    # подключается в CoreConfig.ready на post_migrate
+    with transaction.atomic(using=using):
+        ensure_search_triggers(connections[using])
@@ -4,24 +4,33 @@ document.addEventListener('DOMContentLoaded', () => {
 
   if (!searchInput || !wrapper) return;
 
+  const baseUrl = searchInput.dataset.url || '/invoices/';
   let timer = null;
   const delay = 300;
+  // последний запрошенный запрос и его fetch: повтор не отправляем, устаревший отменяем
+  let lastQuery = searchInput.value.trim();
+  let controller = null;
 
   function fetchAndReplace(q) {
-    const url = '/invoices/' + (q ? `?q=${encodeURIComponent(q)}` : '');
-    fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
-      .then(resp => resp.text())
+    if (q === lastQuery) return;
+    lastQuery = q;
+    if (controller) controller.abort();
+    controller = new AbortController();
+
+    const url = baseUrl + (q ? `?q=${encodeURIComponent(q)}` : '');
+    // сервер отдаёт только фрагмент с таблицей, без всей страницы
+    fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' }, signal: controller.signal })
+      .then(resp => {
+        if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+        return resp.text();
+      })
       .then(html => {
-        const parser = new DOMParser();
-        const doc = parser.parseFromString(html, 'text/html');
-        const newWrapper = doc.querySelector('#invoices-wrapper');
-        if (newWrapper) {
-          wrapper.innerHTML = newWrapper.innerHTML;
-        } else {
-          wrapper.innerHTML = '<div class="alert alert-info">No results</div>';
-        }
+        wrapper.innerHTML = html;
+        history.replaceState(null, '', url);
       })
       .catch(err => {
+        if (err.name === 'AbortError') return;
+        lastQuery = null;  // дать повторить тот же запрос
         console.error('Search fetch error', err);
       });
   }
@@ -38,7 +47,47 @@ document.addEventListener('DOMContentLoaded', () => {
     if (e.key === 'Enter') {
       e.preventDefault();
       const q = searchInput.value.trim();
-      location.href = '/invoices/' + (q ? `?q=${encodeURIComponent(q)}` : '');
+      location.href = baseUrl + (q ? `?q=${encodeURIComponent(q)}` : '');
+    }
+  });
+});
+
+// Фоновая выгрузка: ставим задачу, опрашиваем статус и скачиваем готовый файл
+document.addEventListener('DOMContentLoaded', () => {
+  const btn = document.getElementById('export-job-btn');
+  const status = document.getElementById('export-job-status');
+  if (!btn || !status) return;
+
+  const csrf = (document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/) || [])[1] || '';
+
+  function poll(job) {
+    if (job.status === 'done') {
+      status.textContent = `Готово: ${job.rows} строк`;
+      btn.disabled = false;
+      location.href = job.download_url;
+      return;
     }
+    if (job.status === 'failed' || job.status === 'expired') {
+      status.textContent = 'Выгрузка не удалась' + (job.error ? `: ${job.error}` : '');
+      btn.disabled = false;
+      return;
+    }
+    status.textContent = job.status === 'running' ? 'Выгрузка идёт…' : 'Выгрузка в очереди…';
+    setTimeout(() => {
+      fetch(job.status_url)
+        .then(resp => resp.json())
+        .then(poll)
+        .catch(err => { console.error('Export status error', err); btn.disabled = false; });
+    }, 1000);
+  }
+
+  btn.addEventListener('click', () => {
+    btn.disabled = true;
+    const body = new FormData();
+    body.append('format', 'csv');
+    fetch(btn.dataset.url, { method: 'POST', body, headers: { 'X-CSRFToken': csrf } })
+      .then(resp => resp.json())
+      .then(poll)
+      .catch(err => { console.error('Export request error', err); btn.disabled = false; });
   });
 });
@@ -0,0 +1,54 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from core.models import Category, Client, Project, Invoice
+from core.utils.api import dumps
+from datetime import date
+from decimal import Decimal
+import json
+
+User = get_user_model()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class InvoiceApiSerializationTest(TestCase):
+    def setUp(self):
+        self.u = User.objects.create_user(username='api', password='pass')
+        client = Client.objects.create(owner=self.u, name='ACME')
+        project = Project.objects.create(owner=self.u, client=client, title='Site')
+        category = Category.objects.create(owner=self.u, name='Dev')
+        for d in range(1, 8):
+            Invoice.objects.create(owner=self.u, project=project, category=category, date=date(2024, 1, d),
+                                   amount=Decimal('10.50') * d, external_id=f'E{d}', description='Ünïcode')
+        self.bare = Invoice.objects.create(owner=self.u, date=date(2024, 2, 1), amount=5, paid=False)
+        self.client.force_login(self.u)
+        self.url = reverse('core:api_invoices')
+
+    def test_payload_shape(self):
+        response = self.client.get(self.url, {'limit': 2})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        invoices = response.json()['invoices']
+        self.assertEqual(invoices[0], {
+            'id': self.bare.pk, 'date': '2024-02-01', 'project': '', 'client': '', 'category': '',
+            'amount': '5.00', 'paid': False, 'external_id': '', 'description': '',
+        })
+        self.assertEqual(invoices[1]['amount'], '73.50')
+        self.assertEqual(invoices[1]['client'], 'ACME')
+        self.assertEqual(invoices[1]['description'], 'Ünïcode')
+
+    def test_ndjson_stream(self):
+        response = self.client.get(self.url, {'format': 'ndjson', 'order': 'amount'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 8)
+        self.assertEqual([r['amount'] for r in rows[:2]], ['5.00', '10.50'])
+
+        limited = self.client.get(self.url, {'format': 'ndjson', 'limit': 3})
+        self.assertEqual(len(b''.join(limited.streaming_content).splitlines()), 3)
+
+    def test_dumps(self):
+        self.assertEqual(json.loads(dumps({'a': Decimal('1.10'), 'd': date(2024, 1, 2)})),
+                         {'a': '1.10', 'd': '2024-01-02'})
+        self.assertTrue(dumps([1], newline=True).endswith(b'\n'))
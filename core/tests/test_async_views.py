@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+from datetime import date, timedelta
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.urls import include, path
+from core.models import Client, Project, Invoice
+from core.utils import jobs, metrics
+from core.views import AsyncDashboardView, AsyncInvoiceListApiView
+
+User = get_user_model()
+
+urlpatterns = [
+    path('async/dashboard/', AsyncDashboardView.as_view()),
+    path('async/api/invoices/', AsyncInvoiceListApiView.as_view()),
+    path('', include('core.urls', namespace='core')),
+    path('accounts/', include('django.contrib.auth.urls')),
+]
+
+
+# прогноз считается в другом потоке, ему нужны закоммиченные данные
+@override_settings(ROOT_URLCONF=__name__, METRICS_DIR=None,
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AsyncViewsTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.u = User.objects.create_user(username='async', password='pass')
+        client = Client.objects.create(owner=self.u, name='ACME')
+        project = Project.objects.create(owner=self.u, client=client, title='Site')
+        for m in range(1, 13):
+            Invoice.objects.create(owner=self.u, project=project, date=date(2024, m, 1), amount=100 * m,
+                                   external_id=f'A{m}', description='design work' if m % 2 else 'hosting')
+        Invoice.objects.create(owner=self.u, project=project, date=date.today() - timedelta(days=3),
+                               amount=50, paid=False)
+        self.client.force_login(self.u)
+        self.async_client = AsyncClient()
+
+    async def test_dashboard_matches_sync_view(self):
+        await self.async_client.aforce_login(self.u)
+        metrics.reset()
+        response = await self.async_client.get('/async/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        # запросы из потока sync_to_async тоже попадают в метрики
+        self.assertIn('http_request_db_queries_sum{view="core.views.AsyncDashboardView"} ', metrics.render())
+        self.assertNotIn('http_request_db_queries_sum{view="core.views.AsyncDashboardView"} 0\n', metrics.render())
+        sync_response = await asyncio.to_thread(self.client.get, '/dashboard/')
+        for key in ('count', 'total_income', 'overdue_sum', 'overdue_count', 'best_month', 'client_labels',
+                    'forecast_data', 'historic_data'):
+            self.assertEqual(response.context[key], sync_response.context[key], key)
+        self.assertEqual(len(response.context['forecast_data']), 6)
+
+    async def test_api_matches_sync_view(self):
+        await self.async_client.aforce_login(self.u)
+        for params in ({'limit': 5}, {'limit': 5, 'count': 1}, {'q': 'design', 'order': 'date'},
+                       {'order': 'amount', 'paid': '1'}):
+            response = await self.async_client.get('/async/api/invoices/', params)
+            sync_response = await asyncio.to_thread(self.client.get, '/api/invoices/', params)
+            self.assertEqual(response.json(), sync_response.json(), params)
+
+        first = (await self.async_client.get('/async/api/invoices/', {'limit': 5})).json()
+        second = (await self.async_client.get('/async/api/invoices/', {'limit': 5, 'cursor': first['next']})).json()
+        self.assertEqual(len(second['invoices']), 5)
+        self.assertNotEqual(first['invoices'][0]['id'], second['invoices'][0]['id'])
+        self.assertEqual((await self.async_client.get('/async/api/invoices/', {'cursor': 'bad'})).status_code, 400)
+        self.assertEqual((await self.async_client.get('/async/api/invoices/', {'limit': 'x'})).status_code, 400)
+
+        response = await self.async_client.get('/async/api/invoices/', {'format': 'ndjson'})
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.splitlines()), 13)
+
+    async def test_login_required(self):
+        response = await self.async_client.get('/async/dashboard/')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/accounts/login/', response['Location'])
+
+    @override_settings(FORECAST_WORKERS=1)
+    async def test_blocking_work_is_bounded(self):
+        jobs._cpu_executor = None
+        self.addCleanup(setattr, jobs, '_cpu_executor', None)
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def work():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+            return threading.current_thread().name
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.ensure_future(ticker())
+        names = await asyncio.gather(*(jobs.run_blocking(work) for _ in range(3)))
+        task.cancel()
+        self.assertEqual(max(peak), 1)
+        self.assertTrue(all(name.startswith('core-cpu') for name in names))
+        # цикл событий не стоял, пока шла работа
+        self.assertGreater(ticks, 5)
@@ -0,0 +1,46 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.urls import reverse
+from core.models import Client, Project, Invoice
+from core.views import DashboardView
+from datetime import date, timedelta
+
+User = get_user_model()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DashboardTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.u = User.objects.create_user(username='dash', password='pass')
+        client = Client.objects.create(owner=self.u, name='ACME')
+        project = Project.objects.create(owner=self.u, client=client, title='Site')
+        for m in range(1, 9):
+            Invoice.objects.create(owner=self.u, project=project, date=date(2024, m, 1), amount=100 * m)
+        Invoice.objects.create(owner=self.u, project=project, date=date.today() - timedelta(days=3),
+                               amount=50, paid=False)
+        Invoice.objects.create(owner=self.u, project=project, date=date.today() + timedelta(days=3),
+                               amount=70, paid=False)
+
+    def test_dashboard_numbers(self):
+        data = DashboardView().get_dashboard_data(self.u)
+        self.assertEqual(data['count'], 10)
+        self.assertEqual(data['unpaid_sum'], 120)
+        self.assertEqual(data['overdue_sum'], 50)
+        self.assertEqual(data['overdue_count'], 1)
+        self.assertEqual(data['best_month'], '2024-08')
+        self.assertEqual(data['client_labels'], ['ACME'])
+        self.assertEqual(len(data['forecast_data']), 6)
+
+    def test_query_budget(self):
+        view = DashboardView()
+        view.get_dashboard_data(self.u)
+        with self.assertNumQueries(DashboardView.query_budget):
+            view.get_dashboard_data(self.u)
+
+    def test_page_renders(self):
+        self.client.force_login(self.u)
+        response = self.client.get(reverse('core:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Cashflow')
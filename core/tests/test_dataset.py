@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+from collections import Counter
+from datetime import date
+from io import StringIO
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from core.models import Invoice, MonthlyRollup
+from core.utils.dataset import dataset_rows
+from core.utils.importer import import_invoices_from_file
+
+User = get_user_model()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DatasetTest(TestCase):
+    def test_rows_are_seeded_and_seasonal(self):
+        end = date(2025, 12, 31)
+        rows = list(dataset_rows(7, clients=4, projects_per_client=3, invoices=6000, years=3, end=end))
+        self.assertEqual(rows, list(dataset_rows(7, clients=4, projects_per_client=3, invoices=6000, years=3, end=end)))
+        self.assertNotEqual(rows, list(dataset_rows(8, clients=4, projects_per_client=3, invoices=6000, years=3, end=end)))
+
+        self.assertEqual(len(rows), 6000)
+        self.assertEqual([r['date'] for r in rows], sorted(r['date'] for r in rows))
+        self.assertTrue(date(2023, 1, 1) <= rows[0]['date'] and rows[-1]['date'] <= end)
+        self.assertEqual(len({r['client'] for r in rows}), 4)
+        self.assertLessEqual(len({r['project'] for r in rows}), 12)
+        by_month = Counter(r['date'].month for r in rows)
+        # декабрь -- пик сезона, июнь -- провал
+        self.assertGreater(by_month[12], 1.5 * by_month[6])
+        by_year = Counter(r['date'].year for r in rows)
+        self.assertGreater(by_year[2025], by_year[2023])
+
+    def test_generate_to_db_and_csv(self):
+        out = StringIO()
+        call_command('generate_dataset', '--users', '2', '--invoices', '300', '--prefix', 'ds', stdout=out)
+        self.assertEqual(Invoice.objects.filter(owner__username='ds1').count(), 300)
+        self.assertEqual(Invoice.objects.filter(owner__username='ds2').count(), 300)
+        # сводка ведётся так же, как при импорте
+        self.assertEqual(sum(MonthlyRollup.objects.filter(owner__username='ds1').values_list('count', flat=True)), 300)
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', '--users', '1', '--prefix', 'ds', stdout=StringIO())
+
+        with tempfile.TemporaryDirectory() as root:
+            call_command('generate_dataset', '--users', '1', '--invoices', '300', '--prefix', 'ds',
+                         '--csv', root, stdout=StringIO())
+            user = User.objects.create_user('csv')
+            with open(os.path.join(root, 'ds1.csv'), 'rb') as f:
+                result = import_invoices_from_file(f, owner=user)
+        self.assertEqual((result['created'], result['errors']), (300, []))
+        # CSV и запись в БД дают одни и те же данные
+        self.assertEqual(
+            list(Invoice.objects.filter(owner=user).order_by('external_id').values_list('date', 'amount', 'paid')),
+            list(Invoice.objects.filter(owner__username='ds1').order_by('external_id')
+                 .values_list('date', 'amount', 'paid')),
+        )
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RunBenchmarksTest(TestCase):
+    def test_results_and_baseline(self):
+        with tempfile.TemporaryDirectory() as root:
+            output = os.path.join(root, 'latest.json')
+            baseline = os.path.join(root, 'baseline.json')
+            args = ['--sizes', '200', '--repeat', '1', '--only', 'forecast_monthly', 'api_page', 'export_csv',
+                    '--output', output, '--baseline', baseline]
+            call_command('run_benchmarks', *args, '--save-baseline', stdout=StringIO())
+            with open(output) as f:
+                report = json.load(f)
+            self.assertEqual(sorted(r['name'] for r in report['results']), ['api_page', 'export_csv', 'forecast_monthly'])
+            self.assertTrue(all(r['size'] == 200 and r['seconds'] > 0 for r in report['results']))
+            self.assertIn('rows_per_sec', next(r for r in report['results'] if r['name'] == 'export_csv'))
+            self.assertIn('python', report['environment'])
+            # данные бенчмарка откатываются
+            self.assertFalse(User.objects.filter(username__startswith='bench_').exists())
+
+            # базовая линия в 100 раз быстрее -- это регрессия
+            for r in report['results']:
+                r['seconds'] /= 100
+            with open(baseline, 'w') as f:
+                json.dump(report, f)
+            out = StringIO()
+            with self.assertRaisesMessage(CommandError, 'regression'):
+                call_command('run_benchmarks', *args, stdout=out)
+            self.assertIn('REGRESSION', out.getvalue())
@@ -0,0 +1,130 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from core.models import Category, Client, Project, Invoice, ExportJob
+from core.utils.export import evict_exports, run_export_job
+from datetime import date
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+
+User = get_user_model()
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.u = User.objects.create_user(username='exp', password='pass')
+        client = Client.objects.create(owner=self.u, name='ACME')
+        project = Project.objects.create(owner=self.u, client=client, title='Site')
+        category = Category.objects.create(owner=self.u, name='Dev')
+        for d in range(1, 31):
+            Invoice.objects.create(owner=self.u, project=project, category=category, date=date(2024, 1, d),
+                                   amount=d, external_id=f'X{d}', description='a, "quoted" one')
+        Invoice.objects.create(owner=self.u, date=date(2024, 2, 1), amount=5, paid=False)
+        self.client.force_login(self.u)
+
+    def test_streaming_export(self):
+        # сессия + пользователь + один SELECT со всеми JOIN, без запроса на строку
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('core:invoice_export'))
+            body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0], ['date', 'amount', 'client', 'project', 'category', 'paid', 'external_id', 'description'])
+        self.assertEqual(rows[1], ['2024-02-01', '5.00', '', '', '', 'False', '', ''])
+        self.assertEqual(rows[2], ['2024-01-30', '30.00', 'ACME', 'Site', 'Dev', 'True', 'X30', 'a, "quoted" one'])
+        self.assertEqual(len(rows), 32)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   BACKGROUND_JOBS='command')
+class ExportJobTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(EXPORT_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.u = User.objects.create_user(username='bg', password='pass')
+        client = Client.objects.create(owner=self.u, name='ACME')
+        self.project = Project.objects.create(owner=self.u, client=client, title='Site')
+        for d in range(1, 11):
+            Invoice.objects.create(owner=self.u, project=self.project, date=date(2024, 1, d), amount=d)
+        self.client.force_login(self.u)
+
+    def request_job(self, fmt='csv'):
+        response = self.client.post(reverse('core:export_job_create'), {'format': fmt})
+        return response, response.json()
+
+    def test_job_lifecycle_and_reuse(self):
+        response, data = self.request_job()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(data['status'], 'pending')
+        self.assertIsNone(data['download_url'])
+
+        self.assertTrue(run_export_job(data['id']))
+        self.assertFalse(run_export_job(data['id']))  # второй раз задачу не взять
+
+        status = self.client.get(data['status_url']).json()
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['rows'], 10)
+
+        download = self.client.get(status['download_url'])
+        body = gzip.decompress(b''.join(download.streaming_content)).decode('utf-8')
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0][0], 'date')
+        self.assertEqual(rows[1][:3], ['2024-01-10', '10.00', 'ACME'])
+        self.assertEqual(len(rows), 11)
+        self.assertIsNotNone(ExportJob.objects.get(pk=data['id']).last_accessed_at)
+
+        # данные не менялись -- тот же файл
+        response, again = self.request_job()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(again['id'], data['id'])
+
+        # новый инвойс поднимает версию -- нужна новая выгрузка, старый файл вытесняется
+        with self.captureOnCommitCallbacks(execute=True):
+            Invoice.objects.create(owner=self.u, project=self.project, date=date(2024, 2, 1), amount=1)
+        response, fresh = self.request_job()
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(fresh['id'], data['id'])
+        run_export_job(fresh['id'])
+        old = ExportJob.objects.get(pk=data['id'])
+        self.assertEqual(old.status, 'expired')
+        self.assertEqual(self.client.get(reverse('core:export_job_download', args=[old.pk])).status_code, 404)
+
+    def test_jsonl_and_other_users(self):
+        _, data = self.request_job('jsonl')
+        run_export_job(data['id'])
+        job = ExportJob.objects.get(pk=data['id'])
+        with gzip.open(job.path, 'rt', encoding='utf-8') as f:
+            first = json.loads(f.readline())
+        self.assertEqual(first['amount'], '10.00')
+        self.assertEqual(first['client'], 'ACME')
+
+        other = User.objects.create_user(username='other', password='pass')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(data['status_url']).status_code, 404)
+        self.assertEqual(self.request_job('xml')[0].status_code, 400)
+
+    def test_eviction_by_size_and_age(self):
+        _, data = self.request_job()
+        run_export_job(data['id'])
+        job = ExportJob.objects.get(pk=data['id'])
+        self.assertTrue(os.path.exists(job.path))
+
+        with override_settings(EXPORT_MAX_TOTAL_BYTES=job.size - 1):
+            self.assertEqual(evict_exports(), (1, job.size))
+        self.assertFalse(os.path.exists(job.path))
+
+        _, data = self.request_job()
+        run_export_job(data['id'])
+        job = ExportJob.objects.get(pk=data['id'])
+        self.assertEqual(evict_exports(), (0, 0))
+        with override_settings(EXPORT_MAX_AGE=0):
+            self.assertEqual(evict_exports()[0], 1)
@@ -0,0 +1,84 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.http import QueryDict
+from django.urls import reverse
+from core.models import Category, Client, Project, Invoice
+from core.utils.filters import INVOICE_SORTS, InvalidQuery, compile_invoice_query, _compile
+from datetime import date
+
+User = get_user_model()
+
+
+class CompileInvoiceQueryTest(TestCase):
+    def test_sort_whitelist_and_tiebreaker(self):
+        for key, ordering in INVOICE_SORTS.items():
+            self.assertEqual(ordering[-1].lstrip('-'), 'id', key)
+        self.assertEqual(compile_invoice_query(QueryDict('')).ordering, ('-date', '-id'))
+        self.assertEqual(compile_invoice_query(QueryDict('order=amount')).ordering, ('amount', 'id'))
+        self.assertEqual(compile_invoice_query(QueryDict('q=x')).ordering, ('-search_rank', '-id'))
+        # rank без поиска не имеет смысла
+        self.assertEqual(compile_invoice_query(QueryDict('order=rank')).ordering, ('-date', '-id'))
+
+        for bad in ('order=description', 'order=project__client__notes', 'paid=maybe', 'client=1%20OR%201',
+                    'date_from=2024-13-01'):
+            with self.assertRaises(InvalidQuery, msg=bad):
+                compile_invoice_query(QueryDict(bad))
+        lenient = compile_invoice_query(QueryDict('order=description&paid=maybe&client=3'), strict=False)
+        self.assertEqual(lenient.ordering, ('-date', '-id'))
+        self.assertTrue(lenient.filtered)
+
+    def test_compiled_specs_are_reused(self):
+        params = QueryDict('paid=0&date_from=2024-01-01&order=-amount')
+        first = compile_invoice_query(params)
+        hits = _compile.cache_info().hits
+        again = compile_invoice_query(QueryDict('order=-amount&date_from=2024-01-01&paid=0&page=7'))
+        self.assertIs(again, first)
+        self.assertEqual(_compile.cache_info().hits, hits + 1)
+        # текст поиска в кэш не попадает, но фильтры переиспользуются
+        searched = compile_invoice_query(QueryDict('paid=0&date_from=2024-01-01&order=-amount&q=acme'))
+        self.assertEqual(searched.filters, first.filters)
+        self.assertEqual(searched.search, 'acme')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class InvoiceListFiltersTest(TestCase):
+    def setUp(self):
+        self.u = User.objects.create_user(username='flt', password='pass')
+        client = Client.objects.create(owner=self.u, name='ACME')
+        project = Project.objects.create(owner=self.u, client=client, title='Site')
+        self.category = Category.objects.create(owner=self.u, name='Dev')
+        for i in range(12):
+            Invoice.objects.create(owner=self.u, project=project, category=self.category if i % 2 else None,
+                                   date=date(2024, 1, 1 + i), amount=[5, 1, 9, 1][i % 4] * 10, paid=i % 3 == 0)
+        self.client.force_login(self.u)
+
+    def test_api_and_list_share_filters(self):
+        params = {'category': self.category.pk, 'paid': 'false', 'order': '-amount'}
+        expected = list(
+            Invoice.objects.filter(owner=self.u, category=self.category, paid=False)
+            .order_by('-amount', '-id').values_list('id', flat=True)
+        )
+        data = self.client.get(reverse('core:api_invoices'), params).json()
+        self.assertEqual([i['id'] for i in data['invoices']], expected)
+        response = self.client.get(reverse('core:invoice_list'), params)
+        self.assertEqual([inv.id for inv in response.context['object_list']], expected)
+
+    def test_amount_keyset_walk(self):
+        expected = list(Invoice.objects.filter(owner=self.u).order_by('amount', 'id').values_list('id', flat=True))
+        url = reverse('core:api_invoices')
+        ids, params = [], {'order': 'amount', 'limit': 5}
+        while True:
+            data = self.client.get(url, params).json()
+            ids += [i['id'] for i in data['invoices']]
+            if not data['next']:
+                break
+            params['cursor'] = data['next']
+        self.assertEqual(ids, expected)
+
+    def test_bad_parameters(self):
+        response = self.client.get(reverse('core:api_invoices'), {'order': 'description'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unknown order', response.json()['error'])
+        response = self.client.get(reverse('core:invoice_list'), {'order': 'description', 'client': 'x'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['object_list']), 12)
@@ -1,8 +1,21 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
-from core.utils.forecast import forecast_monthly
-from core.models import Invoice
-from datetime import date
+from django.core.cache import cache
+from django.core.management import call_command
+from core.utils.cache import get_cached_forecast, get_data_version
+from core.utils import jobs, metrics
+from core.utils.forecast import (
+    DEFAULT_MODEL, MODEL_CANDIDATES, PHI_BOUNDS, backtest_model, fit_hw_params, forecast_for_owner,
+    forecast_from_points, forecast_monthly, hw_filter, hw_initial_state, hw_rmse_grid, save_forecast_state,
+    select_model, triple_exponential_smoothing, triple_exponential_smoothing_np,
+)
+from core.utils.importer import import_invoices_from_file
+from core.models import Invoice, ForecastState
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+import numpy as np
 
 User = get_user_model()
 
@@ -25,3 +38,316 @@ class ForecastTest(TestCase):
         forecast = res['forecast']
         self.assertFalse(historic.empty)
         self.assertEqual(len(forecast), 3)
+
+    def test_array_engine_matches_reference(self):
+        rng = np.random.default_rng(0)
+        for n, slen in ((6, 3), (13, 3), (48, 12), (100, 6)):
+            series = rng.uniform(50, 5000, n)
+            for a, b, g in ((0.1, 0.1, 0.1), (0.9, 0.0, 1.0), (0.35, 0.7, 0.05)):
+                expected = triple_exponential_smoothing(series, slen, 6, a, b, g)
+                got = triple_exponential_smoothing_np(series, slen, 6, a, b, g)
+                np.testing.assert_allclose(got, expected, rtol=1e-12, atol=1e-9)
+
+    def test_short_history_returns_empty(self):
+        Invoice.objects.filter(owner=self.u, date__gte=date(2024, 5, 1)).delete()
+        res = forecast_monthly(Invoice.objects.filter(owner=self.u), months_ahead=3)
+        self.assertEqual(res['forecast'], [])
+
+
+# выбор модели без пула и без бюджета, чтобы переподбор давал тот же прогноз
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   FORECAST_SELECTION_WORKERS=0, FORECAST_SELECTION_BUDGET_MS=None)
+class ForecastCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.u = User.objects.create_user(username='cacheuser', password='pass')
+        with self.captureOnCommitCallbacks(execute=True):
+            for m in range(1, 8):
+                Invoice.objects.create(owner=self.u, date=date(2024, m, 1), amount=100 * m)
+
+    def test_second_call_is_served_from_cache(self):
+        first = get_cached_forecast(self.u, months_ahead=3)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cached_forecast(self.u, months_ahead=3), first)
+
+    def test_invoice_write_invalidates(self):
+        first = get_cached_forecast(self.u, months_ahead=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            Invoice.objects.create(owner=self.u, date=date(2024, 8, 1), amount=5000)
+        second = get_cached_forecast(self.u, months_ahead=3)
+        self.assertEqual(len(second['historic']), len(first['historic']) + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Invoice.objects.filter(owner=self.u, date=date(2024, 8, 1)).get().delete()
+        self.assertEqual(get_cached_forecast(self.u, months_ahead=3), first)
+
+    def test_import_invalidates(self):
+        first = get_cached_forecast(self.u, months_ahead=3)
+        csv_content = b"date,amount,client,project,category,paid,external_id,description\n2024-09-01,900,A,P,C,True,,\n"
+        with self.captureOnCommitCallbacks(execute=True):
+            import_invoices_from_file(BytesIO(csv_content), owner=self.u)
+        self.assertNotEqual(get_cached_forecast(self.u, months_ahead=3), first)
+
+
+class IncrementalForecastTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.points = [(date(2022 + m // 12, m % 12 + 1, 1), float(v))
+                       for m, v in enumerate(rng.uniform(500, 3000, 20))]
+
+    def test_appended_month_continues_without_refit(self):
+        _, state = forecast_from_points(self.points[:-1], months_ahead=3, model=DEFAULT_MODEL)
+        with mock.patch('core.utils.forecast.fit_hw_params') as fit:
+            result, new_state = forecast_from_points(self.points, months_ahead=3, state=state)
+        fit.assert_not_called()
+        self.assertEqual(new_state['state_len'], len(self.points) - 1)
+
+        series = np.array([p[1] for p in self.points])
+        expected = triple_exponential_smoothing_np(series, 3, 3, *state['params'])
+        self.assertEqual([f['value'] for f in result['forecast']],
+                         [round(max(0, v), 2) for v in expected[-3:]])
+
+    def test_current_month_change_continues_without_refit(self):
+        _, state = forecast_from_points(self.points, months_ahead=3)
+        changed = self.points[:-1] + [(self.points[-1][0], self.points[-1][1] + 100)]
+        with mock.patch('core.utils.forecast.fit_hw_params') as fit:
+            forecast_from_points(changed, months_ahead=3, state=state)
+        fit.assert_not_called()
+
+    def test_history_change_or_stale_state_refits(self):
+        _, state = forecast_from_points(self.points, months_ahead=3, model=DEFAULT_MODEL)
+        changed = [(self.points[0][0], self.points[0][1] + 1)] + self.points[1:]
+        with mock.patch('core.utils.forecast.fit_hw_params', wraps=fit_hw_params) as fit:
+            _, refitted = forecast_from_points(changed, months_ahead=3, state=state, model=DEFAULT_MODEL)
+        fit.assert_called_once()
+        self.assertEqual(refitted['values'][0], round(changed[0][1], 2))
+
+        later = datetime.fromisoformat(state['fitted_at']) + timedelta(days=31)
+        with mock.patch('core.utils.forecast.fit_hw_params', wraps=fit_hw_params) as fit:
+            forecast_from_points(self.points, months_ahead=3, state=state, now=later, model=DEFAULT_MODEL)
+        fit.assert_called_once()
+        self.assertEqual(list(fit.call_args.kwargs['x0']), state['params'])
+
+    def test_state_is_persisted_per_owner(self):
+        u = User.objects.create_user(username='stateuser', password='pass')
+        for d, v in self.points:
+            Invoice.objects.create(owner=u, date=d, amount=round(v, 2))
+        first = forecast_for_owner(u, months_ahead=3)
+        saved = ForecastState.objects.get(owner=u)
+        self.assertEqual(len(saved.months), len(self.points) - 1)
+        with mock.patch('core.utils.forecast.fit_hw_params') as fit:
+            self.assertEqual(forecast_for_owner(u, months_ahead=3), first)
+        fit.assert_not_called()
+
+    def test_concurrent_first_save_updates_existing_row(self):
+        u = User.objects.create_user(username='raceuser', password='pass')
+        for d, v in self.points:
+            Invoice.objects.create(owner=u, date=d, amount=round(v, 2))
+        stale = ForecastState.objects.filter(owner=u).first()
+        self.assertIsNone(stale)
+        # параллельный запрос создал строку между чтением и сохранением
+        _, other = forecast_from_points(self.points[:-2], months_ahead=3, model=DEFAULT_MODEL)
+        save_forecast_state(u.pk, None, other)
+        result, state = forecast_from_points(self.points, months_ahead=3, model=DEFAULT_MODEL)
+        saved = save_forecast_state(u.pk, stale, state, result, 3, 'v1')
+        self.assertEqual(ForecastState.objects.filter(owner=u).count(), 1)
+        row = ForecastState.objects.get(owner=u)
+        self.assertEqual(row.pk, saved.pk)
+        self.assertEqual(row.months, state['months'])
+        self.assertTrue(row.has_result(3, 'v1'))
+
+
+class ModelSelectionTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        m = np.arange(48)
+        # годовой сезон с ростом
+        self.series = 2000 + 15 * m + 800 * np.sin(2 * np.pi * m / 12) + rng.normal(0, 50, 48)
+        self.points = [(date(2022 + i // 12, i % 12 + 1, 1), float(v)) for i, v in enumerate(self.series)]
+
+    def test_yearly_season_is_chosen(self):
+        model, error, params = select_model(self.series)
+        self.assertEqual(model[0], 12)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            self.assertEqual(select_model(self.series, executor=pool), (model, error, params))
+
+        result, state = forecast_from_points(self.points, months_ahead=6)
+        self.assertTrue(result['model'].startswith('hw12'))
+        self.assertEqual(result['backtest_rmse'], round(error, 2))
+        self.assertEqual((state['slen'], state['damped']), model)
+        self.assertEqual(len(result['forecast']), 6)
+
+    def test_damped_trend_fit(self):
+        params, _ = fit_hw_params(self.series, 12, damped=True)
+        self.assertEqual(len(params), 4)
+        self.assertTrue(PHI_BOUNDS[0] <= params[3] <= PHI_BOUNDS[1])
+        # без сезонности gamma не подбирается
+        params, _ = fit_hw_params(self.series, 1, x0=(0.3, 0.3, 0.3))
+        self.assertEqual(params[2], 0)
+
+        level, trend, seasonals = hw_initial_state(self.series, 12)
+        plain = hw_filter(self.series, 12, 0.3, 0.1, 0.2, level, trend, seasonals)[0]
+        damped = hw_filter(self.series, 12, 0.3, 0.1, 0.2, level, trend, seasonals, phi=0.9)[0]
+        np.testing.assert_array_equal(hw_filter(self.series, 12, 0.3, 0.1, 0.2, level, trend, seasonals, phi=1.0)[0],
+                                      plain)
+        self.assertFalse(np.allclose(plain, damped))
+
+    def test_budget_falls_back_to_previous_model(self):
+        metrics.reset()
+        result, state = forecast_from_points(self.points, months_ahead=6, budget_ms=0)
+        self.assertEqual(result['model'], 'hw3')
+        self.assertIsNone(result['backtest_rmse'])
+        self.assertTrue(result['provisional'])
+        self.assertIn('forecast_selection_timeouts_total 1', metrics.render())
+        # с запасной модели не продолжаем: следующий вызов выбирает заново
+        result, _ = forecast_from_points(self.points, months_ahead=6, state=state)
+        self.assertFalse(result['provisional'])
+        self.assertTrue(result['model'].startswith('hw12'))
+
+        _, state = forecast_from_points(self.points, months_ahead=6, model=(1, True))
+        changed = [(self.points[0][0], self.points[0][1] + 1)] + self.points[1:]
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            result, _ = forecast_from_points(changed, months_ahead=6, state=state, budget_ms=0, executor=pool)
+        self.assertEqual(result['model'], 'holt-damped')
+
+    @override_settings(FORECAST_SELECTION_WORKERS=2)
+    def test_process_pool_selection(self):
+        self.addCleanup(setattr, jobs, '_process_executor', None)
+        pool = jobs.get_process_executor()
+        self.addCleanup(pool.shutdown)
+        # бюджет с запасом на запуск процессов пула
+        self.assertEqual(select_model(self.series, budget_ms=60000, executor=pool), select_model(self.series))
+
+    @override_settings(FORECAST_SELECTION_WORKERS=1)
+    def test_cold_or_busy_pool_is_not_used(self):
+        # пул, оставшийся от других тестов, уже прогрет
+        patcher = mock.patch.object(jobs, '_process_executor', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pool = jobs.get_process_executor()
+        self.addCleanup(pool.shutdown)
+        # процессы ещё запускаются
+        self.assertIsNone(jobs.get_process_executor(ready_only=True))
+        pool.submit(int).result(timeout=60)
+        self.assertIs(jobs.get_process_executor(ready_only=True), pool)
+
+    @override_settings(FORECAST_SELECTION_WORKERS=0, FORECAST_SELECTION_BUDGET_MS=0,
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_provisional_forecast_is_not_stored(self):
+        cache.clear()
+        u = User.objects.create_user(username='budgetuser', password='pass')
+        for d, v in self.points:
+            Invoice.objects.create(owner=u, date=d, amount=round(v, 2))
+        self.assertTrue(get_cached_forecast(u, months_ahead=6)['provisional'])
+        self.assertFalse(ForecastState.objects.filter(owner=u).exists())
+        with override_settings(FORECAST_SELECTION_BUDGET_MS=None):
+            result = get_cached_forecast(u, months_ahead=6)
+        self.assertFalse(result['provisional'])
+        self.assertIsNotNone(ForecastState.objects.get(owner=u).backtest_rmse)
+
+    def test_failed_backtest_is_skipped(self):
+        real = backtest_model
+
+        def flaky(series, slen, damped, origins, fitter):
+            if (slen, damped) == (12, False):
+                raise RuntimeError('worker died')
+            return real(series, slen, damped, origins, fitter)
+
+        expected = select_model(self.series, candidates=[c for c in MODEL_CANDIDATES if c != (12, False)])
+        metrics.reset()
+        with mock.patch('core.utils.forecast.backtest_model', side_effect=flaky), \
+                self.assertLogs('core.utils.forecast', 'ERROR'):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                # остальные кандидаты учитываются, сколько бы их ни досчиталось после упавшего
+                self.assertEqual(select_model(self.series, executor=pool), expected)
+        # ошибка -- не таймаут
+        text = metrics.render()
+        self.assertIn('forecast_backtest_failures_total 1', text)
+        self.assertNotIn('forecast_selection_timeouts_total', text)
+
+    @override_settings(FORECAST_SELECTION_WORKERS=0, FORECAST_SELECTION_BUDGET_MS=None)
+    def test_chosen_model_is_persisted(self):
+        u = User.objects.create_user(username='selectuser', password='pass')
+        for d, v in self.points:
+            Invoice.objects.create(owner=u, date=d, amount=round(v, 2))
+        first = forecast_for_owner(u, months_ahead=6)
+        saved = ForecastState.objects.get(owner=u)
+        self.assertEqual(saved.slen, 12)
+        self.assertEqual(round(saved.backtest_rmse, 2), first['backtest_rmse'])
+        # пока история не менялась, модель заново не выбирается
+        with mock.patch('core.utils.forecast.select_model') as select:
+            self.assertEqual(forecast_for_owner(u, months_ahead=6), first)
+        select.assert_not_called()
+
+
+class GridFitterTest(TestCase):
+    def test_grid_rmse_matches_filter(self):
+        rng = np.random.default_rng(7)
+        for n, slen in ((6, 3), (30, 1), (48, 12)):
+            series = rng.uniform(100, 3000, n)
+            level, trend, seasonals = hw_initial_state(series, slen)
+            params = rng.uniform(0, 1, (20, 4))
+            params[:, 3] = rng.uniform(*PHI_BOUNDS, 20)
+            params[:5, 3] = 1.0
+            expected = []
+            for a, b, g, phi in params:
+                fitted = hw_filter(series, slen, a, b, g, level, trend, seasonals, start=1, phi=phi)[0]
+                fitted[0] = series[0]
+                expected.append(np.sqrt(np.mean((series - fitted) ** 2)))
+            np.testing.assert_allclose(hw_rmse_grid(series, slen, params, level, trend, seasonals), expected,
+                                       rtol=1e-10)
+
+    def test_fitters(self):
+        rng = np.random.default_rng(11)
+        m = np.arange(24)
+        series = 1000 + 300 * np.sin(2 * np.pi * m / 3) + rng.normal(0, 80, 24)
+        (a, b, g), grid_rmse = fit_hw_params(series, 3, fitter='grid')
+        # точка сетки с шагом 0.1
+        np.testing.assert_allclose(np.array([a, b, g]) * 10, np.round(np.array([a, b, g]) * 10), atol=1e-9)
+        _, refined_rmse = fit_hw_params(series, 3, fitter='grid-refine')
+        _, minimize_rmse = fit_hw_params(series, 3)
+        self.assertLessEqual(refined_rmse, grid_rmse)
+        self.assertLessEqual(refined_rmse, minimize_rmse + 1e-6)
+        params, _ = fit_hw_params(series, 3, damped=True, fitter='grid')
+        self.assertEqual(len(params), 4)
+        with self.assertRaises(ValueError):
+            fit_hw_params(series, 3, fitter='newton')
+
+        points = [(date(2022 + i // 12, i % 12 + 1, 1), float(v)) for i, v in enumerate(series)]
+        with mock.patch('core.utils.forecast.fit_hw_params', wraps=fit_hw_params) as fit:
+            result, _ = forecast_from_points(points, months_ahead=3, fitter='grid')
+        self.assertEqual(len(result['forecast']), 3)
+        self.assertEqual({call.kwargs['fitter'] for call in fit.call_args_list}, {'grid'})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PrecomputeForecastsTest(TestCase):
+    def test_dashboard_serves_precomputed_forecast(self):
+        cache.clear()
+        users = [User.objects.create_user(username=f'p{i}', password='pass') for i in range(3)]
+        for i, u in enumerate(users):
+            for m in range(1, 4 + 3 * i):
+                Invoice.objects.create(owner=u, date=date(2024, m, 1), amount=100 * m + i)
+
+        out = StringIO()
+        call_command('precompute_forecasts', '--workers', '2', '--months-ahead', '3', stdout=out)
+        self.assertIn('Forecasts stored: 2, too short history: 1', out.getvalue())
+        self.assertEqual(ForecastState.objects.filter(result__isnull=False).count(), 2)
+
+        # убираем готовый прогноз из кэша -- должен остаться результат в ForecastState
+        cache.delete(f'forecast:{users[2].pk}:3:{get_data_version(users[2].pk)}')
+        with mock.patch('core.utils.forecast.forecast_from_points') as compute:
+            res = get_cached_forecast(users[2], months_ahead=3)
+        compute.assert_not_called()
+        self.assertEqual(len(res['forecast']), 3)
+
+        out = StringIO()
+        call_command('precompute_forecasts', '--months-ahead', '3', stdout=out)
+        self.assertIn('Forecasts stored: 0', out.getvalue())
+
+        # состояние запасной модели без бэктеста выбирается заново, даже с готовым результатом
+        ForecastState.objects.filter(owner=users[2]).update(backtest_rmse=None, slen=3)
+        out = StringIO()
+        call_command('precompute_forecasts', '--months-ahead', '3', stdout=out)
+        self.assertIn('Forecasts stored: 1', out.getvalue())
+        self.assertIsNotNone(ForecastState.objects.get(owner=users[2]).backtest_rmse)
@@ -1,7 +1,17 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
-from core.utils.importer import import_invoices_from_file
-from io import BytesIO
+from core.models import ImportJob, Invoice
+from core.utils.importer import (
+    csv_ranges, import_invoices_from_file, iter_import_chunks, import_invoice_files, run_import_job,
+)
+from core.utils.parsing import PARSED_FIELDS, parse_csv_range
+from datetime import date
+from io import BytesIO, StringIO
+import csv
+import os
+import tempfile
 
 User = get_user_model()
 
@@ -15,3 +25,293 @@ class ImporterTest(TestCase):
         res = import_invoices_from_file(f, owner=self.u)
         self.assertEqual(res['created'], 1)
         self.assertEqual(res['skipped'], 0)
+
+    def test_import_reuses_lookups_and_skips_duplicates(self):
+        csv_content = (
+            b"date,amount,client,project,category,paid,external_id,description\n"
+            b"2025-01-01,100,Client A,Proj,Cat,True,ID1,\n"
+            b"2025-01-02,200,Client A,Proj,Cat,False,ID2,\n"
+            b"2025-01-03,300,Client B,Proj,Cat,yes,ID2,\n"
+            b"bad-date,300,Client B,Proj,Cat,yes,ID3,\n"
+        )
+        res = import_invoices_from_file(BytesIO(csv_content), owner=self.u, batch_size=2)
+        self.assertEqual(res['created'], 2)
+        self.assertEqual(res['skipped'], 1)
+        self.assertEqual(len(res['errors']), 1)
+        self.assertTrue(res['errors'][0].startswith('Line 4:'))
+        self.assertEqual(self.u.clients.count(), 1)
+        self.assertEqual(self.u.projects.count(), 1)
+        self.assertEqual(self.u.categories.count(), 1)
+
+        again = import_invoices_from_file(BytesIO(csv_content), owner=self.u)
+        self.assertEqual(again['created'], 0)
+        self.assertEqual(again['skipped'], 3)
+
+    def test_import_query_count_does_not_grow_with_rows(self):
+        header = b"date,amount,client,project,category,paid,external_id,description\n"
+        rows = b"".join(b"2025-01-%02d,10,C%d,P,Cat,True,X%d,\n" % (i % 28 + 1, i % 3, i) for i in range(100))
+        # savepoint pair + 4 lookup loads + 3 lookup inserts + 1 invoice insert
+        # + rollup: savepoint pair, one UPDATE per (month, client, category, paid) key, one INSERT
+        with self.assertNumQueries(16):
+            res = import_invoices_from_file(BytesIO(header + rows), owner=self.u)
+        self.assertEqual(res['created'], 100)
+
+    def test_duplicate_external_id_mid_file(self):
+        from unittest import mock
+        from core.utils import importer
+        csv_content = (
+            b"date,amount,client,project,category,paid,external_id,description\n"
+            b"2025-01-01,100,A,P,C,True,D1,\n"
+            b"2025-01-02,200,A,P,C,True,D2,\n"
+            b"2025-01-03,300,B,P,C,True,D3,\n"
+            b"2025-01-04,400,B,P,C,True,D1,\n"
+            b"2025-01-05,500,B,P,C,True,D5,\n"
+        )
+        write = importer.write_invoice_batch
+        calls = []
+
+        def racing_write(rows, lookups, result, batch_size):
+            calls.append([r['external_id'] for r in rows])
+            created = write(rows, lookups, result, batch_size)
+            if len(calls) == 1:
+                # другой импорт записал D3 после того, как справочники были прочитаны
+                Invoice.objects.create(owner=self.u, date=date(2025, 1, 3), amount=1, external_id='D3')
+            return created
+
+        with mock.patch.object(importer, 'write_invoice_batch', racing_write):
+            res = import_invoices_from_file(BytesIO(csv_content), owner=self.u, batch_size=2)
+        self.assertEqual(res['errors'], [])
+        self.assertEqual(res['created'], 3)
+        self.assertEqual(res['skipped'], 2)
+        # вторая пачка откатилась целиком и прошла повтором без D3
+        self.assertEqual(calls, [['D1', 'D2'], ['D3', 'D1'], ['D3', 'D1'], ['D5']])
+        self.assertEqual(sorted(Invoice.objects.filter(owner=self.u).values_list('external_id', flat=True)),
+                         ['D1', 'D2', 'D3', 'D5'])
+        # клиент B из откатившейся попытки создан заново ровно один раз
+        self.assertEqual(sorted(self.u.clients.values_list('name', flat=True)), ['A', 'B'])
+
+    def test_failed_batch_keeps_committed_ones(self):
+        from unittest import mock
+        from django.db import IntegrityError
+        from core.utils import importer
+        csv_content = (
+            b"date,amount,client,project,category,paid,external_id,description\n"
+            b"2025-01-01,100,A,P,C,True,F1,\n"
+            b"2025-01-02,200,B,P,C,True,F2,\n"
+            b"2025-01-03,300,B,P,C,True,F3,\n"
+        )
+        write = importer.write_invoice_batch
+
+        def failing_write(rows, lookups, result, batch_size):
+            created = write(rows, lookups, result, batch_size)
+            if rows[0]['external_id'] == 'F2':
+                raise IntegrityError('UNIQUE constraint failed')
+            return created
+
+        with mock.patch.object(importer, 'write_invoice_batch', failing_write):
+            res = import_invoices_from_file(BytesIO(csv_content), owner=self.u, batch_size=1)
+        self.assertEqual(res['created'], 2)
+        self.assertEqual(res['errors'], ['Lines 2-2: UNIQUE constraint failed'])
+        self.assertEqual(sorted(Invoice.objects.filter(owner=self.u).values_list('external_id', flat=True)),
+                         ['F1', 'F3'])
+        # клиент B из откатившейся пачки создан заново, а не взят из устаревших справочников
+        self.assertEqual(Invoice.objects.select_related('project__client').get(external_id='F3').project.client.name, 'B')
+
+    def test_streaming_import_commits_chunks_and_resumes(self):
+        csv_content = (
+            b"date,amount,client,project,category,paid,external_id,description\n"
+            b"2025-01-01,100,A,P,C,True,S1,\n"
+            b"2025-01-02,-5,A,P,C,True,S2,\n"
+            b"2025-01-03,300,A,P,C,True,S3,\n"
+            b"2025-01-04,400,A,P,C,True,S4,\n"
+            b"2025-01-05,500,A,P,C,True,S5,\n"
+        )
+        rejected = []
+        chunks = list(iter_import_chunks(BytesIO(csv_content), self.u, chunk_size=2,
+                                         on_error=lambda line, row, msg: rejected.append(line)))
+        self.assertEqual([c['line'] for c in chunks], [2, 4, 5])
+        self.assertEqual(chunks[-1]['created'], 4)
+        self.assertEqual(rejected, [2])
+
+        resumed = list(iter_import_chunks(BytesIO(csv_content), self.u, chunk_size=10, start_line=4))
+        self.assertEqual(resumed[-1]['rows'], 2)
+        self.assertEqual(resumed[-1]['skipped'], 2)
+        self.assertEqual(resumed[-1]['created'], 0)
+
+        # по смещению закоммиченные строки не читаются вовсе
+        header_and_two = len(b"".join(csv_content.splitlines(keepends=True)[:3]))
+        self.assertEqual(chunks[0]['offset'], header_and_two)
+        self.assertEqual(chunks[-1]['offset'], len(csv_content))
+
+        class CountingIO(BytesIO):
+            lines = 0
+
+            def __next__(self):
+                CountingIO.lines += 1
+                return super().__next__()
+
+        f = CountingIO(csv_content)
+        resumed = list(iter_import_chunks(f, self.u, chunk_size=10, start_line=3, start_offset=chunks[0]['offset']))
+        self.assertEqual(CountingIO.lines, 1 + 3 + 1)
+        self.assertEqual((resumed[-1]['line'], resumed[-1]['rows'], resumed[-1]['skipped']), (5, 3, 3))
+        self.assertEqual(resumed[-1]['offset'], len(csv_content))
+        with self.assertRaises(ValueError):
+            list(iter_import_chunks(BytesIO(csv_content), self.u, start_line=3, start_offset=chunks[0]['offset'] + 1))
+
+    def test_streaming_import_rejects_chunk_that_cannot_be_stored(self):
+        from unittest import mock
+        from django.core.management import call_command
+        from django.db import IntegrityError
+        from core.utils import importer
+        content = b"date,amount,client,project,category,paid,external_id,description\n" + \
+                  b"".join(b"2025-01-0%d,%d,C,P,Cat,1,K%d,\n" % (i, i, i) for i in range(1, 6))
+        commit = importer.commit_invoice_batch
+
+        def failing_commit(rows, lookups, batch_size=importer.BATCH_SIZE):
+            if rows[0]['external_id'] == 'K3':
+                raise IntegrityError('UNIQUE constraint failed')
+            return commit(rows, lookups, batch_size)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'k.csv')
+            with open(path, 'wb') as f:
+                f.write(content)
+            out = StringIO()
+            with mock.patch.object(importer, 'commit_invoice_batch', failing_commit):
+                call_command('import_invoices', path, '--username', 't', '--chunk-size', '2', stdout=out)
+            with open(f'{path}.rejects.csv', newline='', encoding='utf-8') as f:
+                rejects = list(csv.DictReader(f))
+        self.assertEqual([(r['line'], r['external_id']) for r in rejects], [('3', 'K3'), ('4', 'K4')])
+        self.assertTrue(rejects[0]['error'].startswith('Not stored: UNIQUE'))
+        self.assertEqual(sorted(self.u.invoices.values_list('external_id', flat=True)), ['K1', 'K2', 'K5'])
+        self.assertIn(f'use --resume-from-line 6 --resume-offset {len(content)} to continue', out.getvalue())
+
+    def test_import_files_in_process_pool(self):
+        other = User.objects.create_user('o', 'o@o.com', 'pass')
+        header = "date,amount,client,project,category,paid,external_id,description\n"
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for n, body in enumerate([
+                "2025-01-01,100,A,P,C,True,F1,\n2025-01-02,oops,A,P,C,True,F2,\n",
+                "2025-02-01,200,A,P,C,True,F1,\n2025-02-02,300,B,P,C,False,F3,\n",
+            ]):
+                path = os.path.join(tmp, f'm{n}.csv')
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(header + body)
+                paths.append(path)
+
+            rejected = []
+            progress = dict(import_invoice_files(
+                [(paths[0], self.u), (paths[1], self.u), (paths[1], other)], workers=2, chunk_size=1,
+                on_error=lambda path, line, row, msg: rejected.append((path, line)),
+            ))
+
+        self.assertEqual(rejected, [(paths[0], 2)])
+        self.assertEqual(progress[paths[0]]['created'], 1)
+        self.assertEqual(self.u.invoices.count(), 2)
+        self.assertEqual(other.invoices.count(), 2)
+
+    def test_byte_ranges_match_csv_records(self):
+        content = (
+            'date,amount,client,project,category,paid,external_id,description\r\n'
+            '2025-01-01,100,A,P,C,True,R1,"two\r\nlines"\r\n'
+            '\r\n'
+            '2025-01-02,200,"B, ""quoted""",P,C,True,R2,\r\n'
+            '2025-01-03,bad,A,P,C,True,R3,"x\n\ny"\r\n'
+            '2025-01-04,400,Ä,P,C,True,R4,ünïcode\r\n'
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'r.csv')
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.write(content)
+            with open(path, newline='', encoding='utf-8') as f:
+                expected = list(csv.DictReader(f))
+            fieldnames, ranges = csv_ranges(path, 2)
+            self.assertEqual([(first, n) for _, _, first, n in ranges], [(1, 2), (3, 2)])
+            rows, errors = [], []
+            for start, end, first, _ in ranges:
+                parsed, bad = parse_csv_range(path, start, end, fieldnames, first)
+                rows += parsed
+                errors += bad
+        # номера строк те же, что у csv.DictReader по всему файлу
+        self.assertEqual([(line, row) for line, row, _ in errors], [(3, expected[2])])
+        self.assertEqual([r[PARSED_FIELDS.index('description')] for r in rows], ['two\r\nlines', '', 'ünïcode'])
+        self.assertEqual(rows[1][PARSED_FIELDS.index('client')], 'B, "quoted"')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   BACKGROUND_JOBS='command')
+class ImportJobTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        override = override_settings(UPLOAD_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.u = User.objects.create_user('job', 'job@t.com', 'pass')
+        self.client.force_login(self.u)
+
+    def upload(self, content):
+        return self.client.post(reverse('core:invoice_upload'),
+                                {'file': SimpleUploadedFile('big.csv', content, 'text/csv')})
+
+    def test_upload_runs_in_background_with_progress(self):
+        lines = [b"date,amount,client,project,category,paid,external_id,description"]
+        for i in range(1, 251):
+            lines.append(b"2025-01-01,bad,C,P,Cat,1,E%d," % i if i % 50 == 0 else b"2025-01-01,%d,C,P,Cat,1,E%d," % (i, i))
+        response = self.upload(b"\n".join(lines) + b"\n")
+        # запрос не ждёт импорта
+        job = ImportJob.objects.get(owner=self.u)
+        self.assertRedirects(response, f"{reverse('core:invoice_upload')}?job={job.pk}")
+        self.assertEqual(Invoice.objects.filter(owner=self.u).count(), 0)
+        status_url = reverse('core:import_job_status', args=[job.pk])
+        self.assertEqual(self.client.get(status_url).json()['status'], 'pending')
+
+        self.assertTrue(run_import_job(job.pk, chunk_size=100))
+        self.assertFalse(run_import_job(job.pk))
+        status = self.client.get(status_url).json()
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual((status['rows'], status['created'], status['errors']), (250, 245, 5))
+        self.assertEqual(status['percent'], 100.0)
+        self.assertEqual(len(status['error_lines']), 5)
+        self.assertIn('Line 50', status['error_lines'][0])
+        self.assertGreaterEqual(status['rows_per_sec'], 0)
+        self.assertFalse(os.path.exists(job.path))
+
+        page = self.client.get(reverse('core:invoice_upload'), {'job': job.pk})
+        self.assertEqual(page.context['import_job'], job)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_upload_over_memory_limit(self):
+        # такой файл Django пишет во временный файл на диске (TemporaryUploadedFile)
+        content = b"date,amount,client,project,category,paid,external_id,description\n" + \
+                  b"".join(b"2025-02-01,%d,C,P,Cat,1,T%d,some description\n" % (i, i) for i in range(1, 201))
+        self.assertGreater(len(content), 1024)
+        response = self.upload(content)
+        job = ImportJob.objects.get(owner=self.u)
+        self.assertRedirects(response, f"{reverse('core:invoice_upload')}?job={job.pk}")
+        self.assertTrue(run_import_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows, job.created), ('done', 200, 200))
+
+    def test_resume_and_bad_header(self):
+        content = b"date,amount,client,project,category,paid,external_id,description\n" + \
+                  b"".join(b"2025-01-01,%d,C,P,Cat,1,R%d,\n" % (i, i) for i in range(1, 11))
+        self.upload(content)
+        job = ImportJob.objects.get(owner=self.u)
+        # как будто воркер упал после первых 4 строк
+        offset = len(b"".join(content.splitlines(keepends=True)[:5]))
+        ImportJob.objects.filter(pk=job.pk).update(line=4, rows=4, position=offset)
+        run_import_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows, job.created), ('done', 10, 6))
+
+        self.upload(b"foo,bar\n1,2\n")
+        failed = ImportJob.objects.filter(owner=self.u).latest('pk')
+        run_import_job(failed.pk)
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, 'failed')
+        self.assertIn('CSV must contain columns', failed.error)
+
+        other = User.objects.create_user('other', 'o@t.com', 'pass')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('core:import_job_status', args=[job.pk])).status_code, 404)
@@ -0,0 +1,74 @@
+import re
+import unittest
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.urls import reverse
+from core.models import Client, Project, Invoice
+from core.utils.importer import import_invoices_from_file
+from datetime import date
+from io import BytesIO, StringIO
+
+User = get_user_model()
+
+FULL_SCAN = re.compile(r'\bSCAN core_invoice\b(?! USING)')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class InvoiceIndexUsageTest(TestCase):
+    """Every query the hot paths run against core_invoice must be an index search, not a table scan."""
+
+    def setUp(self):
+        self.u = User.objects.create_user(username='idx', password='pass')
+        client = Client.objects.create(owner=self.u, name='ACME')
+        self.project = Project.objects.create(owner=self.u, client=client, title='Site')
+        for m in range(1, 10):
+            Invoice.objects.create(owner=self.u, project=self.project, date=date(2024, m, 1), amount=10 * m,
+                                   paid=m % 2 == 0, external_id=f'E{m}')
+        self.client.force_login(self.u)
+
+    def assertInvoiceQueriesUseIndexes(self, captured):
+        checked = 0
+        with connection.cursor() as cursor:
+            for query in captured:
+                sql = query['sql']
+                if 'core_invoice' not in sql or not sql.lstrip().upper().startswith(('SELECT', 'UPDATE')):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+                self.assertNotRegex(plan, FULL_SCAN, f'full scan of core_invoice for:\n{sql}\n{plan}')
+                checked += 1
+        self.assertGreater(checked, 0)
+
+    def capture(self, fn):
+        with CaptureQueriesContext(connection) as ctx:
+            fn()
+        return ctx.captured_queries
+
+    def test_invoice_list_queries(self):
+        url = reverse('core:invoice_list')
+        for params in ({}, {'paid': '0'}, {'client': self.project.client_id}, {'project': self.project.pk},
+                       {'date_from': '2024-03-01', 'date_to': '2024-06-30'}, {'q': 'site'}, {'q': 'e', 'order': '-date'},
+                       {'order': '-amount'}, {'order': 'amount', 'paid': '1'}):
+            self.assertInvoiceQueriesUseIndexes(self.capture(lambda: self.client.get(url, params)))
+
+    def test_keyset_page_queries(self):
+        url = reverse('core:api_invoices')
+        data = self.client.get(url, {'limit': 3}).json()
+        self.assertInvoiceQueriesUseIndexes(
+            self.capture(lambda: self.client.get(url, {'limit': 3, 'cursor': data['next']})))
+
+    def test_dashboard_queries(self):
+        self.assertInvoiceQueriesUseIndexes(self.capture(lambda: self.client.get(reverse('core:dashboard'))))
+
+    def test_importer_dedup_query(self):
+        csv_content = b"date,amount,client,project,category,paid,external_id,description\n2025-01-01,5,A,P,C,1,E1,\n"
+        self.assertInvoiceQueriesUseIndexes(
+            self.capture(lambda: import_invoices_from_file(BytesIO(csv_content), owner=self.u)))
+
+    def test_update_statuses_query(self):
+        self.assertInvoiceQueriesUseIndexes(
+            self.capture(lambda: call_command('update_invoice_statuses', stdout=StringIO())))
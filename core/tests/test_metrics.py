@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from datetime import date
+from unittest import skipIf
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from core.models import Invoice
+from core.utils import metrics
+
+User = get_user_model()
+
+
+def sample(text, name, **labels):
+    """Value of one series in Prometheus text output, or None."""
+    # метки по алфавиту, le у бакетов последней
+    label_text = ','.join(f'{k}="{v}"' for k, v in sorted(labels.items(), key=lambda kv: (kv[0] == 'le', kv[0])))
+    match = re.search(rf'^{re.escape(name)}{re.escape("{" + label_text + "}" if labels else "")} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else None
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   METRICS_DIR=None, SLOW_REQUEST_SECONDS=None)
+class MetricsTest(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.u = User.objects.create_user(username='m', password='pass')
+        for m in range(1, 4):
+            Invoice.objects.create(owner=self.u, date=date(2025, m, 1), amount=10 * m, paid=True)
+        self.client.force_login(self.u)
+
+    def test_request_metrics(self):
+        self.client.get(reverse('core:invoice_list'))
+        self.client.get(reverse('core:invoice_list'))
+        response = self.client.get(reverse('core:api_invoices'), {'format': 'ndjson'})
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+
+        self.u.is_staff = True
+        self.u.save()
+        text = self.client.get(reverse('core:metrics')).content.decode()
+        self.assertEqual(sample(text, 'http_requests_total', method='GET', status='200', view='core:invoice_list'), 2)
+        self.assertEqual(sample(text, 'http_request_duration_seconds_count', view='core:invoice_list'), 2)
+        self.assertGreater(sample(text, 'http_request_db_queries_sum', view='core:invoice_list'), 0)
+        self.assertEqual(sample(text, 'http_request_db_queries_bucket', le='+Inf', view='core:invoice_list'), 2)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        # стриминговый ответ учтён после отдачи: SQL шёл во время итерации
+        self.assertGreater(sample(text, 'http_request_db_queries_sum', view='core:api_invoices'), 0)
+
+    def test_metrics_access(self):
+        self.assertEqual(self.client.get(reverse('core:metrics')).status_code, 403)
+        self.u.is_staff = True
+        self.u.save()
+        self.assertEqual(self.client.get(reverse('core:metrics')).status_code, 200)
+
+        self.client.logout()
+        url = reverse('core:metrics')
+        # по умолчанию -- только staff, даже с localhost (за прокси там все запросы)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=['10.0.0.5']):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.5').status_code, 200)
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_histogram_and_process_snapshots(self):
+        metrics.observe('forecast_fit_seconds', 0.02)
+        metrics.observe('forecast_fit_seconds', 3)
+        metrics.inc('import_rows_total', 5, result='created')
+        with tempfile.TemporaryDirectory() as root:
+            # снимок другого процесса складывается с текущим
+            with open(os.path.join(root, '999999.json'), 'w') as f:
+                json.dump([['import_rows_total', [['result', 'created']], 7]], f)
+            with override_settings(METRICS_DIR=root):
+                metrics.flush(force=True)
+                self.assertTrue(os.path.exists(os.path.join(root, f'{os.getpid()}.json')))
+                text = metrics.render()
+        self.assertEqual(sample(text, 'forecast_fit_seconds_bucket', le='0.025'), 1)
+        self.assertEqual(sample(text, 'forecast_fit_seconds_bucket', le='5'), 2)
+        self.assertEqual(sample(text, 'forecast_fit_seconds_sum'), 3.02)
+        self.assertEqual(sample(text, 'import_rows_total', result='created'), 12)
+
+    @skipIf(metrics.fcntl is None, 'needs flock')
+    def test_snapshots_of_finished_processes_are_retired(self):
+        metrics.inc('import_rows_total', 5, result='created')
+        finished = subprocess.Popen([sys.executable, '-c', 'pass'])
+        finished.wait()
+        with tempfile.TemporaryDirectory() as root:
+            write = lambda name, value: metrics._write(
+                os.path.join(root, name), [['import_rows_total', [['result', 'created']], value]])
+            write(metrics.RETIRED, 3)
+            write(f'{finished.pid}.json', 7)
+            write(f'{os.getppid()}.json', 11)
+            with override_settings(METRICS_DIR=root):
+                metrics.flush(force=True)
+                self.assertEqual(sample(metrics.render(), 'import_rows_total', result='created'), 26)
+                # снимок завершившегося процесса свёрнут и удалён, живой процесс не тронут
+                self.assertEqual(sorted(n for n in os.listdir(root) if n.endswith('.json')),
+                                 sorted([metrics.RETIRED, f'{os.getppid()}.json', f'{os.getpid()}.json']))
+                self.assertEqual(sample(metrics.render(), 'import_rows_total', result='created'), 26)
+
+                # при выходе процесс сворачивает свой снимок сам
+                metrics.retire_own()
+                self.assertFalse(os.path.exists(os.path.join(root, f'{os.getpid()}.json')))
+                metrics.reset()
+                self.assertEqual(sample(metrics.render(), 'import_rows_total', result='created'), 26)
+            metrics._flushed_roots.discard(root)
+
+    @override_settings(SLOW_REQUEST_SECONDS=0)
+    def test_slow_request_log(self):
+        with self.assertLogs('core.slow_requests', logging.WARNING) as logs:
+            self.client.get(reverse('core:invoice_list'))
+        self.assertIn('core:invoice_list', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+        self.assertEqual(sample(metrics.render(), 'http_slow_requests_total', view='core:invoice_list'), 1)
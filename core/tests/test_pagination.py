@@ -0,0 +1,102 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from core.models import Client, Project, Invoice
+from core.utils.pagination import InvalidCursor, encode_cursor, keyset_page
+from datetime import date
+
+User = get_user_model()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.u = User.objects.create_user(username='pg', password='pass')
+        client = Client.objects.create(owner=self.u, name='ACME')
+        project = Project.objects.create(owner=self.u, client=client, title='Site')
+        # по три инвойса на дату -- порядок внутри даты решает id
+        for d in range(1, 9):
+            for _ in range(3):
+                Invoice.objects.create(owner=self.u, project=project, date=date(2024, 1, d), amount=d)
+        self.expected = list(Invoice.objects.filter(owner=self.u).order_by('-date', '-id').values_list('id', flat=True))
+        self.client.force_login(self.u)
+
+    def test_walk_forward_and_back(self):
+        qs = Invoice.objects.filter(owner=self.u)
+        pages, cursor = [], None
+        while True:
+            page = keyset_page(qs, ('-date', '-id'), cursor, page_size=5)
+            pages.append(page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual([inv.id for p in pages for inv in p.items], self.expected)
+        self.assertFalse(pages[0].has_previous)
+        self.assertEqual(len(pages), 5)
+
+        back = keyset_page(qs, ('-date', '-id'), pages[2].prev_cursor, page_size=5)
+        self.assertEqual([inv.id for inv in back.items], [inv.id for inv in pages[1].items])
+        first = keyset_page(qs, ('-date', '-id'), back.prev_cursor, page_size=5)
+        self.assertEqual([inv.id for inv in first.items], self.expected[:5])
+        self.assertFalse(first.has_previous)
+        self.assertTrue(first.has_next)
+
+    def test_bad_cursors(self):
+        qs = Invoice.objects.filter(owner=self.u)
+        with self.assertRaises(InvalidCursor):
+            keyset_page(qs, ('-date', '-id'), 'not-a-cursor')
+        other = encode_cursor(('date', 'id'), [date(2024, 1, 1), 1], 'n')
+        with self.assertRaises(InvalidCursor):
+            keyset_page(qs, ('-date', '-id'), other)
+
+    def test_deep_page_costs_the_same(self):
+        url = reverse('core:api_invoices')
+        # сессия + пользователь + страница + сумма count из сводки
+        with self.assertNumQueries(4):
+            data = self.client.get(url, {'limit': 2}).json()
+        for _ in range(5):
+            with self.assertNumQueries(4):
+                data = self.client.get(url, {'limit': 2, 'cursor': data['next']}).json()
+        self.assertEqual([i['id'] for i in data['invoices']], self.expected[10:12])
+        self.assertEqual(data['count'], 24)
+
+    def test_api_walks_full_dataset(self):
+        url = reverse('core:api_invoices')
+        ids, params = [], {'limit': 7}
+        while True:
+            data = self.client.get(url, params).json()
+            ids += [i['id'] for i in data['invoices']]
+            if not data['next']:
+                break
+            params['cursor'] = data['next']
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(self.client.get(url, {'cursor': 'garbage'}).status_code, 400)
+
+        data = self.client.get(url, {'q': 'ACME', 'limit': 5}).json()
+        self.assertIsNone(data['count'])
+        self.assertEqual(self.client.get(url, {'q': 'ACME', 'count': '1'}).json()['count'], 24)
+
+    def test_api_default_page_matches_old_limit(self):
+        project = Project.objects.get(owner=self.u)
+        Invoice.objects.bulk_create([Invoice(owner=self.u, project=project, date=date(2023, 1, 1), amount=1)
+                                     for _ in range(226)])
+        data = self.client.get(reverse('core:api_invoices')).json()
+        self.assertEqual(len(data['invoices']), 200)
+        self.assertIsNotNone(data['next'])
+
+    def test_list_view_pages(self):
+        url = reverse('core:invoice_list')
+        response = self.client.get(url, {'order': 'date', 'paid': '1'})
+        self.assertEqual([inv.id for inv in response.context['object_list']], sorted(self.expected)[:20])
+        self.assertIsNone(response.context['total'])
+        self.assertNotIn('prev_url', response.context)
+
+        response = self.client.get(url + response.context['next_url'])
+        self.assertEqual([inv.id for inv in response.context['object_list']], sorted(self.expected)[20:])
+        self.assertIn('paid=1', response.context['prev_url'])
+        self.assertNotIn('next_url', response.context)
+
+        # испорченный курсор -- первая страница, а не ошибка
+        response = self.client.get(url, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total'], 24)
@@ -0,0 +1,107 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from core.models import Category, Client, Invoice, MonthlyRollup, Project
+from core.utils.importer import import_invoices_from_file
+from core.utils.rollup import rebuild_rollups
+from datetime import date
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+User = get_user_model()
+
+
+def rollup_totals(owner):
+    return {
+        (r['month'], r['client_id'], r['category_id'], r['paid']): (r['t'], r['n'])
+        for r in MonthlyRollup.objects.filter(owner=owner)
+        .values('month', 'client_id', 'category_id', 'paid').annotate(t=Sum('total'), n=Sum('count'))
+        if r['n']
+    }
+
+
+def invoice_totals(owner):
+    return {
+        (r['month'], r['project__client_id'], r['category_id'], r['paid']): (r['t'], r['n'])
+        for r in Invoice.objects.filter(owner=owner).annotate(month=TruncMonth('date'))
+        .values('month', 'project__client_id', 'category_id', 'paid').annotate(t=Sum('amount'), n=Count('id'))
+        .order_by()
+    }
+
+
+class RollupTest(TestCase):
+    def setUp(self):
+        self.u = User.objects.create_user(username='roll', password='pass')
+        self.acme = Client.objects.create(owner=self.u, name='ACME')
+        self.other = Client.objects.create(owner=self.u, name='Other')
+        self.project = Project.objects.create(owner=self.u, client=self.acme, title='Site')
+        self.cat = Category.objects.create(owner=self.u, name='Dev')
+
+    def test_invoice_writes_keep_rollup_in_sync(self):
+        inv = Invoice.objects.create(owner=self.u, project=self.project, category=self.cat,
+                                     date=date(2024, 1, 5), amount=Decimal('100'), paid=False)
+        Invoice.objects.create(owner=self.u, project=self.project, date=date(2024, 1, 20), amount=Decimal('50'))
+        self.assertEqual(rollup_totals(self.u), invoice_totals(self.u))
+
+        inv.paid = True
+        inv.amount = Decimal('120')
+        inv.date = date(2024, 2, 1)
+        inv.save()
+        self.assertEqual(rollup_totals(self.u), invoice_totals(self.u))
+
+        self.project.client = self.other
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.save()
+        self.assertEqual(rollup_totals(self.u), invoice_totals(self.u))
+
+        inv.delete()
+        self.assertEqual(rollup_totals(self.u), invoice_totals(self.u))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.delete()
+        self.assertEqual(rollup_totals(self.u), invoice_totals(self.u))
+
+    def test_import_and_rebuild(self):
+        csv_content = (
+            b"date,amount,client,project,category,paid,external_id,description\n"
+            b"2025-01-01,100,ACME,Site,Dev,True,R1,\n"
+            b"2025-01-15,200,ACME,Site,Dev,True,R2,\n"
+            b"2025-02-01,300,New,Other,Ops,False,R3,\n"
+        )
+        import_invoices_from_file(BytesIO(csv_content), owner=self.u)
+        expected = invoice_totals(self.u)
+        self.assertEqual(rollup_totals(self.u), expected)
+
+        MonthlyRollup.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_rollups', '--username', 'roll', stdout=out)
+        self.assertIn('Rollup rows written: 2', out.getvalue())
+        self.assertEqual(rollup_totals(self.u), expected)
+        self.assertEqual(rebuild_rollups(), 2)
+
+    def test_category_delete_then_edit(self):
+        Invoice.objects.create(owner=self.u, project=self.project, date=date(2024, 1, 5), amount=Decimal('100'))
+        inv = Invoice.objects.create(owner=self.u, project=self.project, category=self.cat,
+                                     date=date(2024, 1, 6), amount=Decimal('10'))
+        # без on_commit сводка не пересобрана: у ключа без категории теперь две строки
+        self.cat.delete()
+        self.assertEqual(MonthlyRollup.objects.filter(owner=self.u, category=None).count(), 2)
+        inv.refresh_from_db()
+        inv.amount = Decimal('11')
+        inv.save()
+        self.assertEqual(rollup_totals(self.u), invoice_totals(self.u))
+
+        other = Category.objects.create(owner=self.u, name='Ops')
+        Invoice.objects.create(owner=self.u, project=self.project, category=other,
+                               date=date(2024, 1, 7), amount=Decimal('5'))
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(MonthlyRollup.objects.filter(owner=self.u, category=None).count(), 1)
+        self.assertEqual(rollup_totals(self.u), invoice_totals(self.u))
+
+    def test_user_delete_cascades(self):
+        Invoice.objects.create(owner=self.u, project=self.project, date=date(2024, 1, 5), amount=Decimal('100'))
+        self.u.delete()
+        self.assertFalse(MonthlyRollup.objects.exists())
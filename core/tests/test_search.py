@@ -0,0 +1,161 @@
+import unittest
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.urls import reverse
+from core.models import Client, Project, Invoice
+from core.utils.importer import import_invoices_from_file
+from core.utils.search import SQLITE_TABLE, SQLITE_TRIGGERS, search_backend, search_invoices
+from django.core.management.sql import emit_post_migrate_signal
+from datetime import date
+from io import BytesIO
+
+User = get_user_model()
+
+
+@unittest.skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'no full-text backend for this database')
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class InvoiceSearchTest(TestCase):
+    def setUp(self):
+        self.u = User.objects.create_user(username='srch', password='pass')
+        self.acme = Client.objects.create(owner=self.u, name='ACME Corporation')
+        self.site = Project.objects.create(owner=self.u, client=self.acme, title='Website redesign')
+        beta = Client.objects.create(owner=self.u, name='Beta')
+        self.app = Project.objects.create(owner=self.u, client=beta, title='Mobile app')
+        self.i1 = Invoice.objects.create(owner=self.u, project=self.site, date=date(2024, 1, 1), amount=1,
+                                         external_id='INV-1001', description='Landing page')
+        self.i2 = Invoice.objects.create(owner=self.u, project=self.app, date=date(2024, 1, 2), amount=2,
+                                         external_id='INV-1002', description='Website for the ACME team')
+        self.i3 = Invoice.objects.create(owner=self.u, project=self.app, date=date(2024, 1, 3), amount=3,
+                                         description='Push notifications')
+        other = User.objects.create_user(username='other', password='pass')
+        Invoice.objects.create(owner=other, date=date(2024, 1, 1), amount=1, description='Website')
+
+    def search(self, text):
+        qs = search_invoices(Invoice.objects.filter(owner=self.u), text, self.u.pk)
+        return list(qs.order_by('-search_rank', '-id').values_list('id', flat=True))
+
+    def test_backend_installed(self):
+        self.assertEqual(search_backend(), connection.vendor)
+
+    def test_prefix_and_all_words(self):
+        self.assertEqual(set(self.search('webs')), {self.i1.pk, self.i2.pk})
+        self.assertEqual(self.search('acm land'), [self.i1.pk])
+        self.assertEqual(self.search('inv-1002'), [self.i2.pk])
+        self.assertEqual(self.search('nothing here'), [])
+
+    def test_ranking_prefers_title_over_description(self):
+        # "website" в названии проекта весит больше, чем в описании
+        self.assertEqual(self.search('website'), [self.i1.pk, self.i2.pk])
+
+    def test_index_follows_writes(self):
+        self.site.title = 'Shop'
+        self.site.save()
+        self.assertEqual(self.search('shop'), [self.i1.pk])
+        self.assertEqual(self.search('redesign'), [])
+
+        self.acme.name = 'Gamma'
+        self.acme.save()
+        self.assertEqual(self.search('gamma'), [self.i1.pk])
+
+        Invoice.objects.filter(pk=self.i3.pk).update(description='Analytics')
+        self.assertEqual(self.search('analytics'), [self.i3.pk])
+
+        self.i1.delete()
+        self.assertEqual(self.search('shop'), [])
+
+        self.app.delete()  # инвойсы остаются без проекта
+        self.assertEqual(self.search('mobile'), [])
+        self.assertEqual(self.search('analytics'), [self.i3.pk])
+
+    def test_import_is_indexed(self):
+        csv_content = b"date,amount,client,project,category,paid,external_id,description\n" \
+                      b"2025-01-01,5,Delta,Kiosk,Dev,1,K1,Touch screen\n"
+        import_invoices_from_file(BytesIO(csv_content), owner=self.u)
+        imported = Invoice.objects.get(owner=self.u, external_id='K1')
+        self.assertEqual(self.search('kios'), [imported.pk])
+        self.assertEqual(self.search('delta touch'), [imported.pk])
+
+    def test_api_orders_by_relevance(self):
+        self.client.force_login(self.u)
+        url = reverse('core:api_invoices')
+        data = self.client.get(url, {'q': 'website'}).json()
+        self.assertEqual([i['id'] for i in data['invoices']], [self.i1.pk, self.i2.pk])
+        data = self.client.get(url, {'q': 'website', 'order': '-date'}).json()
+        self.assertEqual([i['id'] for i in data['invoices']], [self.i2.pk, self.i1.pk])
+
+        # курсор по релевантности
+        data = self.client.get(url, {'q': 'website', 'limit': 1}).json()
+        data = self.client.get(url, {'q': 'website', 'limit': 1, 'cursor': data['next']}).json()
+        self.assertEqual([i['id'] for i in data['invoices']], [self.i2.pk])
+        self.assertIsNone(data['next'])
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 only')
+    def test_match_runs_once_per_query(self):
+        # поисковая таблица -- внешний цикл, инвойсы ищутся по первичному ключу;
+        # наоборот MATCH выполнялся бы заново для каждого инвойса
+        qs = search_invoices(Invoice.objects.filter(owner=self.u), 'website', self.u.pk)
+        for query in (qs.order_by('-search_rank', '-id'), qs.filter(paid=True).values('id'), qs.values('amount')):
+            plan = query.explain().splitlines()
+            self.assertIn(f'SCAN {SQLITE_TABLE}', plan[0], plan)
+            self.assertIn('core_invoice USING INTEGER PRIMARY KEY', '\n'.join(plan))
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite FTS5 only')
+    def test_migrate_restores_lost_triggers(self):
+        def triggers():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+                return {row[0] for row in cursor.fetchall()}
+
+        self.assertLessEqual(set(SQLITE_TRIGGERS), triggers())
+        # так бывает после миграции, пересоздавшей core_invoice
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {SQLITE_TABLE}_ai')
+        lost = Invoice.objects.create(owner=self.u, date=date(2024, 2, 1), amount=4, description='Orphaned')
+        self.assertEqual(self.search('orphaned'), [])
+
+        emit_post_migrate_signal(verbosity=0, interactive=False, db='default')
+        self.assertLessEqual(set(SQLITE_TRIGGERS), triggers())
+        self.assertEqual(self.search('orphaned'), [lost.pk])
+        added = Invoice.objects.create(owner=self.u, date=date(2024, 2, 2), amount=5, description='Fresh')
+        self.assertEqual(self.search('fresh'), [added.pk])
+
+    def test_fallback_without_index(self):
+        with mock.patch('core.utils.search.search_backend', return_value=None):
+            self.assertEqual(set(self.search('ebsit')), {self.i1.pk, self.i2.pk})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class LiveSearchFragmentTest(TestCase):
+    def setUp(self):
+        self.u = User.objects.create_user(username='live', password='pass')
+        client = Client.objects.create(owner=self.u, name='ACME')
+        self.project = Project.objects.create(owner=self.u, client=client, title='Website')
+        Invoice.objects.create(owner=self.u, project=self.project, date=date(2024, 1, 1), amount=1)
+        self.client.force_login(self.u)
+        self.url = reverse('core:invoice_list')
+
+    def fragment(self, q):
+        return self.client.get(self.url, {'q': q}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_fragment_has_only_results(self):
+        page = self.client.get(self.url, {'q': 'web'})
+        response = self.fragment('web')
+        body = response.content.decode()
+        self.assertIn('Website', body)
+        self.assertNotIn('<html', body)
+        self.assertNotIn('navbar', body)
+        self.assertLess(len(response.content), len(page.content) / 2)
+        self.assertIn('X-Requested-With', response['Vary'])
+        self.assertIn('X-Requested-With', page['Vary'])
+
+    def test_fragment_cache(self):
+        first = self.fragment('web ').content
+        # тот же запрос (пробелы не в счёт): только сессия и пользователь, без запросов к инвойсам
+        with self.assertNumQueries(2):
+            self.assertEqual(self.fragment('web').content, first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Invoice.objects.create(owner=self.u, project=self.project, date=date(2024, 2, 1), amount=77)
+        self.assertIn('77', self.fragment('web').content.decode())
@@ -0,0 +1,78 @@
+from datetime import date, timedelta
+from io import StringIO
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from core.models import Invoice, InvoiceStatusWatermark
+from core.utils.statuses import update_invoice_statuses
+
+User = get_user_model()
+
+TODAY = date(2025, 6, 15)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class InvoiceStatusTest(TestCase):
+    def setUp(self):
+        self.u = User.objects.create_user(username='st', password='pass')
+
+    def invoice(self, days, paid, status='sent'):
+        return Invoice.objects.create(owner=self.u, date=TODAY + timedelta(days=days), amount=10,
+                                      paid=paid, status=status)
+
+    def status(self, invoice):
+        return Invoice.objects.values_list('status', flat=True).get(pk=invoice.pk)
+
+    def test_reconciles_in_both_directions(self):
+        due = self.invoice(-5, paid=False)
+        paid_late = self.invoice(-5, paid=True, status='overdue')
+        moved = self.invoice(10, paid=False, status='overdue')
+        unpaid_again = self.invoice(-1, paid=False, status='paid')
+        future = self.invoice(3, paid=False)
+
+        batches = []
+        totals = update_invoice_statuses(today=TODAY, batch_size=1, on_batch=lambda *args: batches.append(args))
+
+        self.assertEqual(self.status(due), 'overdue')
+        self.assertEqual(self.status(paid_late), 'paid')
+        self.assertEqual(self.status(moved), 'sent')
+        self.assertEqual(self.status(unpaid_again), 'overdue')
+        self.assertEqual(self.status(future), 'sent')
+        self.assertEqual(totals, {'overdue': 2, 'paid': 1, 'not due': 1})
+        # batch_size=1: каждая строка -- отдельная пачка
+        self.assertEqual([(b[0], b[1], b[2]) for b in batches],
+                         [('overdue', 1, 1), ('overdue', 2, 1), ('paid', 1, 1), ('not due', 1, 1)])
+
+        # второй запуск ничего не меняет
+        self.assertEqual(sum(update_invoice_statuses(today=TODAY).values()), 0)
+
+    def test_watermark_limits_overdue_pass(self):
+        update_invoice_statuses(today=TODAY)
+        watermark = InvoiceStatusWatermark.objects.get()
+        self.assertEqual(watermark.date, TODAY)
+
+        # отредактированный задним числом старый инвойс ловит только --full
+        old = self.invoice(-30, paid=False)
+        Invoice.objects.filter(pk=old.pk).update(status='sent')
+        InvoiceStatusWatermark.objects.update(last_invoice_id=old.pk)
+        newly_due = self.invoice(0, paid=False)
+        backdated = self.invoice(-100, paid=False)
+
+        tomorrow = TODAY + timedelta(days=1)
+        totals = update_invoice_statuses(today=tomorrow)
+        self.assertEqual((totals['overdue'], totals['overdue (new)']), (1, 1))
+        self.assertEqual(self.status(newly_due), 'overdue')
+        self.assertEqual(self.status(backdated), 'overdue')
+        self.assertEqual(self.status(old), 'sent')
+
+        self.assertEqual(update_invoice_statuses(today=tomorrow, full=True)['overdue'], 1)
+        self.assertEqual(self.status(old), 'overdue')
+
+    def test_command_reports_batches(self):
+        for i in range(5):
+            self.invoice(-i - 1, paid=False)
+        out = StringIO()
+        call_command('update_invoice_statuses', '--batch-size', '2', '--full', stdout=out)
+        output = out.getvalue()
+        self.assertIn('overdue: batch 3 updated 1 in', output)
+        self.assertIn('Updated 5 invoices (overdue: 5, paid: 0, not due: 0)', output)
@@ -0,0 +1,99 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.urls import reverse
+from core.models import ImportJob, Invoice
+from core.utils.importer import run_import_job
+from core.utils.uploads import cleanup_uploads, preview_csv, spool_upload, spooled_path
+import os
+import shutil
+import tempfile
+
+User = get_user_model()
+
+HEADER = "date,amount,client,project,category,paid,external_id,description\n"
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   BACKGROUND_JOBS='command')
+class UploadPreviewTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(UPLOAD_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.u = User.objects.create_user(username='up', password='pass')
+        self.client.force_login(self.u)
+
+    def upload(self, content, name='inv.csv'):
+        return self.client.post(reverse('core:invoice_upload_preview'),
+                                {'file': SimpleUploadedFile(name, content.encode('utf-8'), 'text/csv')})
+
+    def test_preview_reads_only_the_head(self):
+        path = os.path.join(self.root, 'big.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(HEADER)
+            for i in range(5000):
+                f.write(f"2024-01-01,{i},C,P,Cat,1,X{i},\n")
+            # дальше мусор, до которого превью не должно дочитать
+            f.write('"unterminated\n' * 10)
+        preview = preview_csv(path, max_rows=10)
+        self.assertEqual(len(preview['rows']), 10)
+        self.assertTrue(preview['has_more'])
+        self.assertEqual(preview['missing'], [])
+        self.assertIsNone(preview['error'])
+
+    def test_preview_then_confirm(self):
+        rows = ''.join(f"2024-01-{d:02d},{d},ACME,Site,Dev,1,E{d},\n" for d in range(1, 21))
+        response = self.upload(HEADER + rows)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('csv_preview', self.client.session)
+        token = response.context['token']
+        self.assertEqual(len(response.context['preview']['rows']), 20)
+        self.assertTrue(spooled_path(self.u.pk, token))
+
+        # чужой пользователь токеном не воспользуется
+        other = User.objects.create_user(username='other', password='pass')
+        self.assertIsNone(spooled_path(other.pk, token))
+
+        response = self.client.post(reverse('core:invoice_upload_confirm'), {'token': token, 'filename': 'inv.csv'})
+        job = ImportJob.objects.get(owner=self.u)
+        self.assertRedirects(response, f"{reverse('core:invoice_upload')}?job={job.pk}", fetch_redirect_response=False)
+        self.assertEqual(job.filename, 'inv.csv')
+        # файл подтверждённого импорта не считается брошенным
+        self.assertEqual(cleanup_uploads(max_age=-1), 0)
+
+        run_import_job(job.pk)
+        self.assertEqual(Invoice.objects.filter(owner=self.u).count(), 20)
+        self.assertIsNone(spooled_path(self.u.pk, token))
+
+    def test_missing_columns_cancel_and_expired_token(self):
+        response = self.upload("date,amount\n2024-01-01,5\n")
+        self.assertEqual(response.context['preview']['missing'],
+                         ['category', 'client', 'external_id', 'paid', 'project'])
+        token = response.context['token']
+        self.client.post(reverse('core:invoice_upload_confirm'), {'token': token, 'cancel': '1'})
+        self.assertIsNone(spooled_path(self.u.pk, token))
+
+        self.client.post(reverse('core:invoice_upload_confirm'), {'token': token})
+        result = self.client.get(reverse('core:invoice_upload')).context['import_result']
+        self.assertIn('expired', result['errors'][0])
+        self.assertIsNone(spooled_path(self.u.pk, '../../etc/passwd'))
+
+    def test_cleanup_abandoned(self):
+        token = self.upload(HEADER).context['token']
+        self.assertEqual(cleanup_uploads(max_age=3600), 0)
+        self.assertEqual(cleanup_uploads(max_age=-1), 1)
+        self.assertIsNone(spooled_path(self.u.pk, token))
+
+    def test_spool_temporary_file_is_moved(self):
+        # файлы больше FILE_UPLOAD_MAX_MEMORY_SIZE Django отдаёт как TemporaryUploadedFile
+        upload = TemporaryUploadedFile('big.csv', 'text/csv', 0, 'utf-8')
+        upload.write(HEADER.encode('utf-8'))
+        upload.seek(0)
+        temp_path = upload.temporary_file_path()
+        token = spool_upload(upload, self.u.pk)
+        self.assertFalse(os.path.exists(temp_path))
+        with open(spooled_path(self.u.pk, token), encoding='utf-8') as f:
+            self.assertEqual(f.read(), HEADER)
@@ -1,5 +1,13 @@
+from django.conf import settings
 from django.urls import path
-from .views import InvoiceListView, InvoiceCreateView, DashboardView, SignUpView, CSVUploadView, ExportInvoicesCSVView, InvoiceListApiView
+from .views import (InvoiceListView, InvoiceCreateView, DashboardView, SignUpView, CSVUploadView, ExportInvoicesCSVView,
+                    InvoiceListApiView, ExportJobCreateView, ExportJobStatusView, ExportJobDownloadView,
+                    CSVPreviewView, CSVConfirmImportView, ImportJobStatusView, MetricsView,
+                    AsyncDashboardView, AsyncInvoiceListApiView)
+
+# под ASGI дашборд и API обслуживаются асинхронными вариантами по тем же адресам
+if getattr(settings, 'ASYNC_VIEWS', False):
+    DashboardView, InvoiceListApiView = AsyncDashboardView, AsyncInvoiceListApiView
 
 
 app_name = 'core'
@@ -10,9 +18,16 @@ urlpatterns = [
     path('invoices/', InvoiceListView.as_view(), name='invoice_list'),
     path('invoices/new/', InvoiceCreateView.as_view(), name='invoice_create'),
     path('invoices/upload/', CSVUploadView.as_view(), name='invoice_upload'),
+    path('invoices/upload/preview/', CSVPreviewView.as_view(), name='invoice_upload_preview'),
+    path('invoices/upload/confirm/', CSVConfirmImportView.as_view(), name='invoice_upload_confirm'),
+    path('invoices/upload/jobs/<int:pk>/', ImportJobStatusView.as_view(), name='import_job_status'),
     path('invoices/export/', ExportInvoicesCSVView.as_view(), name='invoice_export'),
+    path('invoices/export/jobs/', ExportJobCreateView.as_view(), name='export_job_create'),
+    path('invoices/export/jobs/<int:pk>/', ExportJobStatusView.as_view(), name='export_job_status'),
+    path('invoices/export/jobs/<int:pk>/download/', ExportJobDownloadView.as_view(), name='export_job_download'),
     path('dashboard/', DashboardView.as_view(), name='dashboard'),
     path('signup/', SignUpView.as_view(), name='signup'),
     path('api/invoices/', InvoiceListApiView.as_view(), name='api_invoices'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 
 ]
\ No newline at end of file
@@ -0,0 +1,93 @@
+# core/utils/api.py
+# Быстрая сериализация инвойсов для API: только нужные колонки через values_list
+# (имена клиента/проекта/категории -- прямо в SQL), orjson если установлен.
+import itertools
+import json
+from asgiref.sync import sync_to_async
+from decimal import Decimal
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:  # без orjson -- стандартный json, формат ответа тот же
+    orjson = None
+
+INVOICE_API_KEYS = ('id', 'date', 'project', 'client', 'category', 'amount', 'paid', 'external_id', 'description')
+
+# сколько строк NDJSON склеиваем в один кусок ответа
+NDJSON_BATCH = 500
+
+
+def invoice_api_rows(qs, extra=()):
+    """Tuples in INVOICE_API_KEYS order followed by the ``extra`` columns (e.g. keyset keys)."""
+    return qs.values_list(
+        'id',
+        'date',
+        Coalesce('project__title', Value('')),
+        Coalesce('project__client__name', Value('')),
+        Coalesce('category__name', Value('')),
+        'amount',
+        'paid',
+        'external_id',
+        'description',
+        *extra,
+    )
+
+
+def row_key(ordering):
+    """(extra columns, key function) that let keyset_page read ``ordering`` values from invoice_api_rows tuples."""
+    names = [term.lstrip('-') for term in ordering]
+    extra = tuple(n for n in names if n not in INVOICE_API_KEYS)
+    positions = [
+        INVOICE_API_KEYS.index(n) if n in INVOICE_API_KEYS else len(INVOICE_API_KEYS) + extra.index(n)
+        for n in names
+    ]
+    return extra, lambda row: [row[i] for i in positions]
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError
+
+
+if orjson is not None:
+    def dumps(obj, newline=False):
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_APPEND_NEWLINE if newline else 0)
+else:
+    def dumps(obj, newline=False):
+        data = json.dumps(obj, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+        return (data + '\n' if newline else data).encode('utf-8')
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+def iter_ndjson(rows):
+    """One JSON object per invoice row and line, in batches of NDJSON_BATCH lines."""
+    batch = []
+    for row in rows:
+        batch.append(dumps(dict(zip(INVOICE_API_KEYS, row)), newline=True))
+        if len(batch) >= NDJSON_BATCH:
+            yield b''.join(batch)
+            batch = []
+    if batch:
+        yield b''.join(batch)
+
+
+async def aiter_ndjson(rows, chunk_size=2000):
+    """
+    iter_ndjson for async views, ``rows`` being an invoice_api_rows queryset. It is
+    read with iterator() in chunks through sync_to_async: values_list().aiterator()
+    starts its query on the event loop thread and fails.
+    """
+    iterator = await sync_to_async(lambda: iter(rows.iterator(chunk_size=chunk_size)))()
+    while True:
+        chunk = await sync_to_async(lambda: list(itertools.islice(iterator, NDJSON_BATCH)))()
+        if not chunk:
+            return
+        yield b''.join(dumps(dict(zip(INVOICE_API_KEYS, row)), newline=True) for row in chunk)
@@ -0,0 +1,98 @@
+# core/utils/cache.py
+import hashlib
+import time
+from django.core.cache import cache
+from django.db import transaction
+
+from core.utils.forecast import forecast_for_owner
+from core.utils.jobs import run_blocking
+
+# прогноз не меняется, пока не изменились инвойсы, поэтому срок жизни большой
+FORECAST_TIMEOUT = 24 * 60 * 60
+
+# результаты живого поиска: при наборе одни и те же запросы повторяются в пределах секунд
+SEARCH_TIMEOUT = 30
+
+
+def _version_key(owner_id):
+    return f'invoices:version:{owner_id}'
+
+
+def get_data_version(owner_id):
+    """
+    Current version of the owner's invoice data. Versions are timestamps, so a
+    version lost from the cache is replaced by a new one and never matches old keys.
+    """
+    version = cache.get(_version_key(owner_id))
+    if version is None:
+        cache.add(_version_key(owner_id), time.time_ns(), None)
+        version = cache.get(_version_key(owner_id), time.time_ns())
+    return version
+
+
+async def aget_data_version(owner_id):
+    version = await cache.aget(_version_key(owner_id))
+    if version is None:
+        await cache.aadd(_version_key(owner_id), time.time_ns(), None)
+        version = await cache.aget(_version_key(owner_id), time.time_ns())
+    return version
+
+
+def get_data_versions(owner_ids):
+    """get_data_version for many owners with one cache round-trip for the known ones."""
+    keys = {_version_key(owner_id): owner_id for owner_id in owner_ids}
+    found = cache.get_many(list(keys))
+    versions = {keys[key]: version for key, version in found.items()}
+    for owner_id in owner_ids:
+        if owner_id not in versions:
+            versions[owner_id] = get_data_version(owner_id)
+    return versions
+
+
+def bump_data_version(owner_id):
+    """Invalidate everything cached for the owner once the current transaction commits."""
+    transaction.on_commit(lambda: cache.set(_version_key(owner_id), time.time_ns(), None))
+
+
+def _forecast_key(owner_id, months_ahead, version):
+    return f'forecast:{owner_id}:{months_ahead}:{version}'
+
+
+def set_cached_forecast(owner_id, months_ahead, version, result):
+    cache.set(_forecast_key(owner_id, months_ahead, version), result, FORECAST_TIMEOUT)
+
+
+def get_cached_forecast(owner, months_ahead=6, points=None):
+    version = get_data_version(owner.pk)
+    result = cache.get(_forecast_key(owner.pk, months_ahead, version))
+    if result is None:
+        result = forecast_for_owner(owner, months_ahead=months_ahead, version=version, points=points)
+        # прогноз запасной моделью не кэшируем: следующий запрос выберет модель заново
+        if not result.get('provisional'):
+            set_cached_forecast(owner.pk, months_ahead, version, result)
+    return result
+
+
+async def aget_cached_forecast(owner, months_ahead=6, points=None):
+    """get_cached_forecast for async views; on a cache miss the forecast is computed in the bounded CPU pool."""
+    version = await aget_data_version(owner.pk)
+    result = await cache.aget(_forecast_key(owner.pk, months_ahead, version))
+    if result is None:
+        result = await run_blocking(forecast_for_owner, owner, months_ahead, version, points)
+        if not result.get('provisional'):
+            await cache.aset(_forecast_key(owner.pk, months_ahead, version), result, FORECAST_TIMEOUT)
+    return result
+
+
+def _search_key(owner_id, params, version):
+    digest = hashlib.sha1(params.encode('utf-8')).hexdigest()
+    return f'search:{owner_id}:{version}:{digest}'
+
+
+def get_cached_search(owner_id, params):
+    """Cached live-search fragment for the owner's current data and the normalized query string."""
+    return cache.get(_search_key(owner_id, params, get_data_version(owner_id)))
+
+
+def set_cached_search(owner_id, params, content):
+    cache.set(_search_key(owner_id, params, get_data_version(owner_id)), content, SEARCH_TIMEOUT)
@@ -0,0 +1,243 @@
+# core/utils/export.py
+import csv
+import gzip
+import json
+import logging
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.models import ExportJob, Invoice
+from core.utils.cache import get_data_version
+from core.utils.jobs import submit_job
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ['date', 'amount', 'client', 'project', 'category', 'paid', 'external_id', 'description']
+
+# формат -> расширение файла
+EXPORT_FORMATS = {
+    'csv': 'csv.gz',
+    'jsonl': 'jsonl.gz',
+    'parquet': 'parquet',
+}
+
+# сколько строк parquet пишем одной row group
+PARQUET_BATCH = 50000
+
+
+class Echo:
+    """File-like object for csv.writer: write() just returns the line, so rows can be streamed."""
+
+    def write(self, value):
+        return value
+
+
+def iter_invoice_values(invoices, chunk_size=2000):
+    """Tuples in EXPORT_COLUMNS order for ``invoices``, fetched with a server-side iterator in chunks."""
+    return (
+        invoices
+        .order_by('-date', '-id')
+        .values_list('date', 'amount', 'project__client__name', 'project__title', 'category__name',
+                     'paid', 'external_id', 'description')
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def iter_invoice_csv_rows(invoices, chunk_size=2000):
+    """CSV lines for ``invoices`` (header first)."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for inv_date, amount, client, project, category, paid, external_id, description in iter_invoice_values(invoices, chunk_size):
+        yield writer.writerow([
+            inv_date.isoformat(),
+            f"{amount}",
+            client or '',
+            project or '',
+            category or '',
+            'True' if paid else 'False',
+            external_id,
+            description or '',
+        ])
+
+
+def iter_invoice_jsonl_rows(invoices, chunk_size=2000):
+    """One JSON object per line for ``invoices``; amounts stay strings to keep the cents exact."""
+    for inv_date, amount, client, project, category, paid, external_id, description in iter_invoice_values(invoices, chunk_size):
+        yield json.dumps({
+            'date': inv_date.isoformat(),
+            'amount': f"{amount}",
+            'client': client or '',
+            'project': project or '',
+            'category': category or '',
+            'paid': bool(paid),
+            'external_id': external_id,
+            'description': description or '',
+        }, ensure_ascii=False) + '\n'
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _write_parquet(invoices, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('date', pa.date32()),
+        ('amount', pa.decimal128(14, 2)),
+        ('client', pa.string()),
+        ('project', pa.string()),
+        ('category', pa.string()),
+        ('paid', pa.bool_()),
+        ('external_id', pa.string()),
+        ('description', pa.string()),
+    ])
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression='gzip') as writer:
+        batch = []
+        for values in iter_invoice_values(invoices):
+            batch.append(values)
+            if len(batch) >= PARQUET_BATCH:
+                writer.write_table(pa.Table.from_pylist([dict(zip(EXPORT_COLUMNS, v)) for v in batch], schema))
+                rows += len(batch)
+                batch = []
+        if batch or not rows:
+            writer.write_table(pa.Table.from_pylist([dict(zip(EXPORT_COLUMNS, v)) for v in batch], schema))
+            rows += len(batch)
+    return rows
+
+
+def export_root():
+    return getattr(settings, 'EXPORT_ROOT', os.path.join(settings.BASE_DIR, 'exports'))
+
+
+def request_export(owner, fmt='csv'):
+    """
+    Return an export job for the owner's current data: a finished or running job for
+    the same data version and format is reused, otherwise a new one is queued.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == 'parquet' and not parquet_available():
+        raise ValueError("Parquet export needs pyarrow installed")
+
+    version = str(get_data_version(owner.pk))
+    timeout = timedelta(seconds=getattr(settings, 'EXPORT_JOB_TIMEOUT', 60 * 60))
+    # зависшие pending/running (процесс умер) не переиспользуем
+    candidates = ExportJob.objects.filter(owner=owner, format=fmt, data_version=version).filter(
+        Q(status='done') | Q(status__in=['pending', 'running'], created_at__gte=timezone.now() - timeout)
+    )
+    for job in candidates:
+        if job.status != 'done' or os.path.exists(job.path):
+            return job
+
+    job = ExportJob.objects.create(owner=owner, format=fmt, data_version=version)
+    submit_job(run_export_job, job.pk)
+    return job
+
+
+def run_export_job(job_id):
+    """
+    Write the export file for a pending job. The job is claimed with a conditional
+    UPDATE, so the in-process executor and the run_jobs worker never both run it.
+    Returns False if someone else already took the job.
+    """
+    claimed = ExportJob.objects.filter(pk=job_id, status='pending').update(
+        status='running', started_at=timezone.now()
+    )
+    if not claimed:
+        return False
+
+    job = ExportJob.objects.select_related('owner').get(pk=job_id)
+    # версию берём перед чтением: изменения во время выгрузки её поднимут и файл не будет переиспользован
+    job.data_version = str(get_data_version(job.owner_id))
+    directory = os.path.join(export_root(), str(job.owner_id))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{job.pk}.{EXPORT_FORMATS[job.format]}")
+    tmp_path = path + '.part'
+    invoices = Invoice.objects.filter(owner_id=job.owner_id)
+    try:
+        if job.format == 'parquet':
+            rows = _write_parquet(invoices, tmp_path)
+        else:
+            lines = iter_invoice_csv_rows(invoices) if job.format == 'csv' else iter_invoice_jsonl_rows(invoices)
+            rows = 0
+            with gzip.open(tmp_path, 'wt', encoding='utf-8', newline='', compresslevel=6) as f:
+                for line in lines:
+                    f.write(line)
+                    rows += 1
+            if job.format == 'csv':
+                rows -= 1  # заголовок
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.exception('Export job %s failed', job.pk)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at', 'data_version'])
+        return True
+
+    job.status = 'done'
+    job.path = path
+    job.size = os.path.getsize(path)
+    job.rows = rows
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'path', 'size', 'rows', 'finished_at', 'data_version'])
+    evict_exports()
+    return True
+
+
+def _expire(job):
+    try:
+        os.remove(job.path)
+    except FileNotFoundError:
+        pass
+    freed = job.size
+    job.status = 'expired'
+    job.path = ''
+    job.size = 0
+    job.save(update_fields=['status', 'path', 'size'])
+    return freed
+
+
+def evict_exports(now=None):
+    """
+    Delete export files that are no longer worth keeping:
+    superseded by a newer file of the same owner and format, unused for
+    EXPORT_MAX_AGE seconds, or beyond EXPORT_MAX_TOTAL_BYTES (least recently used first).
+    Returns (files removed, bytes freed).
+    """
+    now = now or timezone.now()
+    max_age = timedelta(seconds=getattr(settings, 'EXPORT_MAX_AGE', 24 * 60 * 60))
+    max_bytes = getattr(settings, 'EXPORT_MAX_TOTAL_BYTES', 1024 ** 3)
+
+    done = list(
+        ExportJob.objects.filter(status='done')
+        .annotate(used_at=Coalesce('last_accessed_at', 'finished_at'))
+        .order_by('-used_at', '-id')
+    )
+    newest = {}
+    for job in done:
+        key = (job.owner_id, job.format)
+        newest[key] = max(newest.get(key, 0), job.pk)
+
+    removed = freed = total = 0
+    for job in done:
+        superseded = job.pk != newest[(job.owner_id, job.format)]
+        if superseded or job.used_at < now - max_age or total + job.size > max_bytes:
+            freed += _expire(job)
+            removed += 1
+        else:
+            total += job.size
+    return removed, freed
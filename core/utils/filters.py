@@ -0,0 +1,123 @@
+# core/utils/filters.py
+# Общая спецификация фильтров и сортировок списка инвойсов (HTML-список и API).
+# Сортировать можно только по ключам из INVOICE_SORTS: у каждого есть индекс
+# (owner, <поле>, id), а id в конце делает порядок однозначным для курсоров.
+from dataclasses import dataclass
+from functools import lru_cache
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+
+from core.utils.search import search_invoices
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+# ключ ?order= -> сортировка; комментарий -- индекс, который её обслуживает
+INVOICE_SORTS = {
+    '-date': ('-date', '-id'),      # invoice_owner_date
+    'date': ('date', 'id'),         # invoice_owner_date
+    '-amount': ('-amount', '-id'),  # invoice_owner_amount
+    'amount': ('amount', 'id'),     # invoice_owner_amount
+    # релевантность поиска, только вместе с ?q=
+    'rank': ('-search_rank', '-id'),
+}
+
+DEFAULT_SORT = '-date'
+
+
+def _parse_id(value):
+    if not value.isdigit():
+        raise ValueError('expected an id')
+    return int(value)
+
+
+def _parse_bool(value):
+    value = value.lower()
+    if value in ('1', 'true'):
+        return True
+    if value in ('0', 'false'):
+        return False
+    raise ValueError('expected 1/0 or true/false')
+
+
+def _parse_date(value):
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError('expected YYYY-MM-DD')
+    return parsed
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    param: str
+    lookup: str
+    parse: object
+
+
+INVOICE_FILTERS = (
+    FilterSpec('client', 'project__client_id', _parse_id),
+    FilterSpec('project', 'project_id', _parse_id),
+    FilterSpec('category', 'category_id', _parse_id),
+    FilterSpec('paid', 'paid', _parse_bool),
+    FilterSpec('date_from', 'date__gte', _parse_date),
+    FilterSpec('date_to', 'date__lte', _parse_date),
+)
+
+
+@dataclass(frozen=True)
+class CompiledQuery:
+    filters: Q
+    ordering: tuple
+    search: str = ''
+
+    @property
+    def filtered(self):
+        return bool(self.filters) or bool(self.search)
+
+    def apply(self, qs, owner_id):
+        """``qs`` (already limited to the owner) with the filters and search applied; ordering is left to the paginator."""
+        if self.filters:
+            qs = qs.filter(self.filters)
+        if self.search:
+            qs = search_invoices(qs, self.search, owner_id)
+        return qs
+
+
+@lru_cache(maxsize=512)
+def _compile(filter_values, order, searching, strict):
+    conditions = Q()
+    for spec, value in zip(INVOICE_FILTERS, filter_values):
+        if not value:
+            continue
+        try:
+            conditions &= Q(**{spec.lookup: spec.parse(value)})
+        except ValueError as e:
+            if strict:
+                raise InvalidQuery(f"Invalid {spec.param}={value!r}: {e}")
+
+    if not order:
+        order = 'rank' if searching else DEFAULT_SORT
+    if order not in INVOICE_SORTS:
+        if strict:
+            raise InvalidQuery(f"Unknown order {order!r}, use one of: {', '.join(INVOICE_SORTS)}")
+        order = DEFAULT_SORT
+    if order == 'rank' and not searching:
+        order = DEFAULT_SORT
+    return CompiledQuery(conditions, INVOICE_SORTS[order])
+
+
+def compile_invoice_query(params, strict=True):
+    """
+    Validate list parameters (a QueryDict or dict) into a CompiledQuery.
+    Unknown parameters are ignored. With ``strict`` a bad value or sort key raises
+    InvalidQuery, otherwise it is dropped. Compiled specs are cached, so repeated
+    parameter combinations skip parsing and Q building.
+    """
+    search = (params.get('q') or '').strip()
+    filter_values = tuple((params.get(spec.param) or '').strip() for spec in INVOICE_FILTERS)
+    compiled = _compile(filter_values, params.get('order') or '', bool(search), strict)
+    if search:
+        compiled = CompiledQuery(compiled.filters, compiled.ordering, search)
+    return compiled
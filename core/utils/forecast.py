@@ -1,9 +1,45 @@
+import logging
+import time
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
 import numpy as np
 from scipy.optimize import minimize
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
 from django.db.models.functions import TruncMonth
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.db.models import Sum
 
+from core.utils import metrics
+
+try:
+    from numba import njit
+except ImportError:  # numba не обязателен, без него работает обычный цикл
+    njit = None
+
+logger = logging.getLogger(__name__)
+
+# сколько живут подобранные alpha/beta/gamma до обязательного переподбора
+REFIT_MAX_AGE = timedelta(days=30)
+REFIT_EVERY_MONTHS = 3
+
+# меньше шести месяцев -- прогноз не строим
+MIN_POINTS = 6
+# кандидаты при выборе модели: (длина сезона, затухающий тренд); 1 -- без сезонности
+MODEL_CANDIDATES = ((3, False), (3, True), (1, False), (1, True), (6, False), (6, True), (12, False), (12, True))
+# модель, если выбрать не из чего (короткая история или не уложились в бюджет)
+DEFAULT_MODEL = (3, False)
+# бэктест: прогноз на BACKTEST_HORIZON месяцев с каждой из BACKTEST_FOLDS последних точек отсечения
+BACKTEST_HORIZON = 3
+BACKTEST_FOLDS = 3
+# границы коэффициента затухания тренда
+PHI_BOUNDS = (0.8, 0.98)
+# способы подбора параметров: L-BFGS-B, перебор по сетке, сетка и затем L-BFGS-B от лучшей точки
+FITTERS = ('minimize', 'grid', 'grid-refine')
+# узлов сетки на каждый из alpha/beta/gamma (0, 0.1, ..., 1) и на phi
+GRID_STEPS = 11
+GRID_PHI_STEPS = 4
+
 
 def _month_add(dt, months):
     y = dt.year + (dt.month - 1 + months) // 12
@@ -53,7 +89,248 @@ def triple_exponential_smoothing(series, slen, n_preds, alpha, beta, gamma):
     return result
 
 
-def forecast_monthly(invoices_qs, months_ahead=6):
+def hw_initial_state(series, slen):
+    """Initial (level, trend, seasonals) for the additive Holt-Winters recurrence."""
+    series = np.asarray(series, dtype=float)
+    n_seasons = len(series) // slen
+    seasons = series[:n_seasons * slen].reshape(n_seasons, slen)
+    seasonals = (seasons - seasons.sum(axis=1)[:, None] / slen).sum(axis=0) / n_seasons
+    trend = float((series[slen:2 * slen] - series[:slen]).sum()) / slen / slen
+    return float(series[0]), trend, seasonals
+
+
+def _hw_loop(values, seasonals, out, level, trend, alpha, beta, gamma, slen, start, offset, phi):
+    # values/seasonals/out -- списки или массивы, seasonals меняется на месте.
+    # offset -- абсолютный номер values[0] в ряду (нужен для индекса сезона),
+    # phi -- затухание тренда (1.0 -- обычный тренд)
+    for i in range(start, len(values)):
+        val = values[i]
+        k = (i + offset) % slen
+        s = seasonals[k]
+        last_level = level
+        level = alpha * (val - s) + (1 - alpha) * (level + phi * trend)
+        trend = beta * (level - last_level) + (1 - beta) * phi * trend
+        s = gamma * (val - level) + (1 - gamma) * s
+        seasonals[k] = s
+        out[i] = level + phi * trend + s
+    return level, trend
+
+
+_hw_loop_compiled = njit(cache=True)(_hw_loop) if njit else None
+HW_BACKEND = 'numba' if njit else 'numpy'
+
+
+def hw_filter(series, slen, alpha, beta, gamma, level, trend, seasonals, start=0, offset=0, phi=1.0):
+    """
+    Run the smoothing recurrence over ``series[start:]`` from the given state,
+    with the trend damped by ``phi``.
+    Returns (fitted, level, trend, seasonals); ``fitted[:start]`` is left as zeros.
+    """
+    series = np.asarray(series, dtype=float)
+    seasonals = np.array(seasonals, dtype=float)
+    alpha, beta, gamma, phi = float(alpha), float(beta), float(gamma), float(phi)
+    if _hw_loop_compiled is not None:
+        fitted = np.zeros(len(series))
+        level, trend = _hw_loop_compiled(series, seasonals, fitted, float(level), float(trend),
+                                         alpha, beta, gamma, slen, start, offset, phi)
+        return fitted, level, trend, seasonals
+
+    # на списках питоновских float цикл в разы быстрее, чем поэлементно по ndarray
+    seas = seasonals.tolist()
+    out = [0.0] * len(series)
+    level, trend = _hw_loop(series.tolist(), seas, out, float(level), float(trend),
+                            alpha, beta, gamma, slen, start, offset, phi)
+    return np.array(out), level, trend, np.array(seas)
+
+
+def hw_predict(level, trend, seasonals, n_preds, offset, phi=1.0):
+    """Forecast ``n_preds`` points after absolute position ``offset - 1`` of the series."""
+    steps = np.arange(1, n_preds + 1)
+    idx = (offset + steps - 1) % len(seasonals)
+    # при затухании h-й шаг добавляет phi + phi^2 + ... + phi^h тренда
+    damping = steps if phi == 1.0 else np.cumsum(float(phi) ** steps)
+    return level + damping * trend + np.asarray(seasonals)[idx]
+
+
+def triple_exponential_smoothing_np(series, slen, n_preds, alpha, beta, gamma):
+    """Array version of triple_exponential_smoothing with the same output (as ndarray)."""
+    series = np.asarray(series, dtype=float)
+    n = len(series)
+    level, trend, seasonals = hw_initial_state(series, slen)
+    fitted, level, trend, seasonals = hw_filter(series, slen, alpha, beta, gamma, level, trend, seasonals, start=1)
+    fitted[0] = series[0]
+    if not n_preds:
+        return fitted
+    return np.concatenate([fitted, hw_predict(level, trend, seasonals, n_preds, n)])
+
+
+def hw_rmse_grid(series, slen, params, level, trend, seasonals):
+    """
+    In-sample RMSE for every row (alpha, beta, gamma, phi) of ``params`` at once:
+    the recurrence steps over time with arrays of one value per candidate.
+    Matches hw_filter(..., start=1) with fitted[0] = series[0].
+    """
+    series = np.asarray(series, dtype=float)
+    alpha, beta, gamma, phi = np.asarray(params, dtype=float).T
+    n_cand = len(alpha)
+    level = np.full(n_cand, float(level))
+    trend = np.full(n_cand, float(trend))
+    # (slen, кандидаты): сезон k у всех кандидатов лежит подряд
+    seasonals = np.repeat(np.asarray(seasonals, dtype=float)[:, None], n_cand, axis=1)
+    sse = np.zeros(n_cand)
+    for i in range(1, len(series)):
+        val = series[i]
+        k = i % slen
+        s = seasonals[k]
+        last_level = level
+        level = alpha * (val - s) + (1 - alpha) * (level + phi * trend)
+        trend = beta * (level - last_level) + (1 - beta) * phi * trend
+        s = gamma * (val - level) + (1 - gamma) * s
+        seasonals[k] = s
+        err = val - (level + phi * trend + s)
+        sse += err * err
+    return np.sqrt(sse / len(series))
+
+
+def hw_param_grid(slen, damped):
+    """Candidate (alpha, beta, gamma, phi) rows for the grid search."""
+    steps = np.linspace(0, 1, GRID_STEPS)
+    gammas = steps if slen > 1 else np.zeros(1)
+    phis = np.linspace(*PHI_BOUNDS, GRID_PHI_STEPS) if damped else np.ones(1)
+    return np.array(np.meshgrid(steps, steps, gammas, phis, indexing='ij')).reshape(4, -1).T
+
+
+def fit_hw_params(series, slen, x0=(0.1, 0.1, 0.1), damped=False, fitter='minimize'):
+    """
+    Fit alpha/beta/gamma (and phi if ``damped``) by minimizing in-sample RMSE.
+    ``fitter`` (see FITTERS): 'minimize' -- L-BFGS-B from ``x0``; 'grid' -- the best
+    point of a grid evaluated at once by hw_rmse_grid; 'grid-refine' -- L-BFGS-B from
+    that point instead of ``x0``, so it does not get stuck in a poor local minimum.
+    The initial state does not depend on the parameters, so it is computed once.
+    With ``slen`` 1 there is no seasonality and gamma stays 0.
+    Returns ((alpha, beta, gamma[, phi]), rmse).
+    """
+    if fitter not in FITTERS:
+        raise ValueError(f'Unknown fitter: {fitter}')
+    series = np.asarray(series, dtype=float)
+    level0, trend0, seasonals0 = hw_initial_state(series, slen)
+    if fitter != 'minimize':
+        grid = hw_param_grid(slen, damped)
+        rmse = hw_rmse_grid(series, slen, grid, level0, trend0, seasonals0)
+        best = int(np.argmin(rmse))
+        params = tuple(float(x) for x in grid[best][:4 if damped else 3])
+        if fitter == 'grid':
+            return params, float(rmse[best])
+        x0 = params
+    bounds = [(0, 1), (0, 1), (0, 1) if slen > 1 else (0, 0)]
+    start = list(x0[:3])
+    if slen == 1:
+        start[2] = 0.0
+    if damped:
+        bounds.append(PHI_BOUNDS)
+        start.append(x0[3] if len(x0) > 3 else PHI_BOUNDS[1])
+
+    def objective(params):
+        preds = hw_filter(series, slen, *params[:3], level0, trend0, seasonals0, start=1,
+                          phi=params[3] if damped else 1.0)[0]
+        preds[0] = series[0]
+        return np.sqrt(np.mean((series - preds) ** 2))  # RMSE
+
+    opt = minimize(objective, x0=start, bounds=bounds)
+    if fitter == 'grid-refine' and opt.fun > rmse[best]:
+        return params, float(rmse[best])
+    return tuple(opt.x), float(opt.fun)
+
+
+def model_name(model):
+    """Short label of a (season length, damped) model, e.g. 'hw12', 'holt-damped'."""
+    slen, damped = model
+    return ('holt' if slen == 1 else f'hw{slen}') + ('-damped' if damped else '')
+
+
+def backtest_origins(n):
+    """Cut-off points of the rolling-origin backtest for a series of length ``n``."""
+    first = max(n - BACKTEST_HORIZON - BACKTEST_FOLDS + 1, 4)
+    return list(range(first, n - BACKTEST_HORIZON + 1))
+
+
+def eligible_models(n, candidates=MODEL_CANDIDATES):
+    """Candidates the backtest of an ``n``-month series can compare (two seasons before the first cut-off)."""
+    origins = backtest_origins(n)
+    # сравниваем только на одних и тех же точках отсечения
+    return [c for c in candidates if origins and max(4, 2 * c[0]) <= origins[0]]
+
+
+def backtest_model(series, slen, damped, origins, fitter='minimize'):
+    """
+    Rolling-origin backtest: for every cut-off in ``origins`` fit on the months
+    before it and forecast the next BACKTEST_HORIZON. Each fit starts from the
+    previous one (with the 'minimize' fitter). Returns (rmse of all forecast errors, parameters of the last fit).
+    """
+    series = np.asarray(series, dtype=float)
+    errors = []
+    params = (0.1, 0.1, 0.1)
+    for t in origins:
+        train = series[:t]
+        params, _ = fit_hw_params(train, slen, x0=params, damped=damped, fitter=fitter)
+        phi = params[3] if damped else 1.0
+        level, trend, seasonals = hw_initial_state(train, slen)
+        _, level, trend, seasonals = hw_filter(train, slen, *params[:3], level, trend, seasonals, start=1, phi=phi)
+        actual = series[t:t + BACKTEST_HORIZON]
+        errors.append(actual - hw_predict(level, trend, seasonals, len(actual), t, phi))
+    errors = np.concatenate(errors)
+    return float(np.sqrt(np.mean(errors ** 2))), [float(x) for x in params]
+
+
+def select_model(series, candidates=MODEL_CANDIDATES, budget_ms=None, executor=None, fitter='minimize'):
+    """
+    Pick the candidate (season length, damped) model with the smallest backtest
+    error. Candidates run in ``executor`` (a process pool, see
+    core.utils.jobs.get_process_executor) or one by one in this process if it is
+    None. Those not finished within ``budget_ms`` are dropped.
+    Returns (model, backtest rmse, its last fitted parameters), or
+    (None, None, None) if the series is too short or nothing finished in time.
+    """
+    origins = backtest_origins(len(series))
+    eligible = eligible_models(len(series), candidates)
+    deadline = time.monotonic() + budget_ms / 1000 if budget_ms is not None else None
+    scores = {}
+    timed_out = failed = 0
+    if executor is None:
+        for i, model in enumerate(eligible):
+            if deadline is not None and time.monotonic() >= deadline:
+                timed_out = len(eligible) - i
+                break
+            scores[model] = backtest_model(series, *model, origins, fitter)
+    elif eligible:
+        try:
+            futures = {executor.submit(backtest_model, series, *model, origins, fitter): model for model in eligible}
+        except BrokenProcessPool:
+            logger.exception('Forecast selection pool is broken')
+            futures = {}
+            failed = len(eligible)
+        done, pending = wait(futures, timeout=max(deadline - time.monotonic(), 0) if deadline is not None else None)
+        timed_out = len(pending)
+        for future in pending:
+            future.cancel()
+        for future in done:
+            try:
+                scores[futures[future]] = future.result()
+            except Exception:
+                failed += 1
+                logger.exception('Backtest of %s failed', model_name(futures[future]))
+    if timed_out:
+        metrics.inc('forecast_selection_timeouts_total')
+    if failed:
+        metrics.inc('forecast_backtest_failures_total', failed)
+    if not scores:
+        return None, None, None
+    best = min(scores, key=lambda model: (scores[model][0], eligible.index(model)))
+    return best, scores[best][0], scores[best][1]
+
+
+def monthly_points(invoices_qs):
+    """[(month_date, total), ...] ordered by month."""
     monthly = (
         invoices_qs
         .annotate(month=TruncMonth('date'))
@@ -61,38 +338,130 @@ def forecast_monthly(invoices_qs, months_ahead=6):
         .annotate(total=Sum('amount'))
         .order_by('month')
     )
+    return [(r['month'], float(r['total'] or 0)) for r in monthly if r['month']]
+
+
+def _state_model(state):
+    return state['slen'], state['damped']
+
+
+def _can_continue(state, months, series, model, now):
+    if not state or state.get('provisional') or (model is not None and _state_model(state) != model):
+        return False
+    k = state['state_len']
+    if k >= len(series) or months[:k] != state['months']:
+        return False
+    if [round(v, 2) for v in series[:k]] != state['values']:
+        return False
+    # раз в REFIT_MAX_AGE или каждые REFIT_EVERY_MONTHS новых месяцев параметры всё равно переподбираем
+    if now - datetime.fromisoformat(state['fitted_at']) > REFIT_MAX_AGE:
+        return False
+    return len(series) - state['fitted_len'] < REFIT_EVERY_MONTHS
+
+
+def _advance(state, months, series, upto):
+    """Move ``state`` over series[state_len:upto] with its stored parameters."""
+    k = state['state_len']
+    if upto <= k:
+        return state
+    alpha, beta, gamma = state['params']
+    fitted, level, trend, seasonals = hw_filter(
+        series[k:upto], state['slen'], alpha, beta, gamma,
+        state['level'], state['trend'], state['seasonals'], offset=k, phi=state['phi'],
+    )
+    resid = series[k:upto] - fitted
+    return dict(
+        state,
+        months=state['months'] + months[k:upto],
+        values=state['values'] + [round(float(v), 2) for v in series[k:upto]],
+        level=level,
+        trend=trend,
+        seasonals=seasonals.tolist(),
+        state_len=upto,
+        resid_sum=state['resid_sum'] + float(resid.sum()),
+        resid_sq=state['resid_sq'] + float((resid ** 2).sum()),
+    )
+
+
+def forecast_from_points(points, months_ahead=6, state=None, now=None, model=None, budget_ms=None, executor=None,
+                         fitter='minimize'):
+    """
+    Forecast from monthly ``points`` ([(month_date, total), ...]).
 
-    points = [(r['month'], float(r['total'] or 0)) for r in monthly if r['month']]
-    if len(points) < 4:
-        return {'historic': [], 'forecast': []}
+    ``state`` is what a previous call returned. If the months it has seen are
+    unchanged, smoothing just continues from it over the new months with the same
+    model and parameters; otherwise the model is chosen again by backtests (see
+    select_model, ``budget_ms`` and ``executor`` are passed to it) and refitted,
+    starting the optimizer from the previous parameters if the model is the same.
+    If the selection did not finish within the budget, the fallback model's state
+    is marked 'provisional': it is never continued, so the next call selects again.
+    ``model`` -- a fixed (season length, damped) model instead of the selection;
+    ``fitter`` -- how parameters are fitted (see fit_hw_params).
+    The stored state stops one month short of the end, so new invoices in the
+    current month do not force a refit.
 
+    Returns (result, state).
+    """
+    if len(points) < MIN_POINTS:
+        return {'historic': [], 'forecast': []}, state
+
+    now = now or datetime.now(timezone.utc)
     series = np.array([p[1] for p in points])
     dates = [p[0] for p in points]
-    slen = 3
-
-    def objective(params):
-        a, b, g = params
-        preds = triple_exponential_smoothing(series, slen, 0, a, b, g)
-        return np.sqrt(np.mean((series - preds) ** 2))  # RMSE
+    months = [d.strftime('%Y-%m') for d in dates]
+    n = len(series)
 
-    opt = minimize(objective, x0=[0.1, 0.1, 0.1], bounds=((0, 1), (0, 1), (0, 1)))
-    a_opt, b_opt, g_opt = opt.x
+    if not _can_continue(state, months, series, model, now):
+        backtest_rmse = None
+        provisional = False
+        x0 = (0.1, 0.1, 0.1)
+        if model is None:
+            with metrics.timer('forecast_selection_seconds'):
+                model, backtest_rmse, params = select_model(series, budget_ms=budget_ms, executor=executor,
+                                                            fitter=fitter)
+            if model is None:
+                # выбор не уложился в бюджет -- запасная модель только на этот раз
+                provisional = bool(eligible_models(n))
+                model = _state_model(state) if state else DEFAULT_MODEL
+            else:
+                x0 = params
+        slen, damped = model
+        if state and _state_model(state) == model:
+            x0 = state['params'] + ([state['phi']] if damped else [])
+        with metrics.timer('forecast_fit_seconds'):
+            params, _ = fit_hw_params(series, slen, x0=x0, damped=damped, fitter=fitter)
+        level, trend, seasonals = hw_initial_state(series, slen)
+        # состояние после первой точки: она же и есть прогноз для себя, остаток 0
+        state = {
+            'slen': slen, 'damped': damped, 'params': [float(x) for x in params[:3]],
+            'phi': float(params[3]) if damped else 1.0, 'backtest_rmse': backtest_rmse,
+            'months': months[:1], 'values': [round(float(series[0]), 2)],
+            'level': level, 'trend': trend, 'seasonals': seasonals.tolist(),
+            'state_len': 1, 'resid_sum': 0.0, 'resid_sq': 0.0,
+            'fitted_at': now.isoformat(), 'fitted_len': n,
+        }
+        if provisional:
+            state['provisional'] = True
 
-    full_series = triple_exponential_smoothing(series, slen, months_ahead, a_opt, b_opt, g_opt)
+    state = _advance(state, months, series, n - 1)
+    final = _advance(state, months, series, n)
 
-    std_dev = np.std(series - np.array(full_series[:len(series)]))
+    mean = final['resid_sum'] / n
+    std_dev = np.sqrt(max(final['resid_sq'] / n - mean ** 2, 0.0))
+    rmse = np.sqrt(final['resid_sq'] / n)
+    tail = hw_predict(final['level'], final['trend'], final['seasonals'], months_ahead, n, final['phi'])
 
     historic = []
     for i in range(len(series)):
         historic.append({
-            'month': dates[i].strftime('%Y-%m'),
+            'month': months[i],
             'value': round(series[i], 2)
         })
 
     forecast = []
     last_date = dates[-1]
     for i in range(months_ahead):
-        val = full_series[len(series) + i]
+        val = tail[i]
         forecast.append({
             'month': _month_add(last_date, i + 1).strftime('%Y-%m'),
             'value': round(max(0, val), 2),
@@ -100,4 +469,80 @@ def forecast_monthly(invoices_qs, months_ahead=6):
             'lower': round(max(0, val - 1.96 * std_dev), 2)
         })
 
-    return {'historic': historic, 'forecast': forecast, 'rmse': round(opt.fun, 2)}
\ No newline at end of file
+    backtest_rmse = final['backtest_rmse']
+    return {
+        'historic': historic,
+        'forecast': forecast,
+        'rmse': round(rmse, 2),
+        'model': model_name(_state_model(final)),
+        'backtest_rmse': round(backtest_rmse, 2) if backtest_rmse is not None else None,
+        'provisional': final.get('provisional', False),
+    }, state
+
+
+def forecast_monthly(invoices_qs, months_ahead=6, fitter='minimize'):
+    return forecast_from_points(monthly_points(invoices_qs), months_ahead, fitter=fitter)[0]
+
+
+def save_forecast_state(owner_id, saved, state, result=None, months_ahead=None, version=None):
+    """
+    Create or update the owner's ForecastState; ``saved`` is the existing row or None.
+    If a concurrent request created the row first, that row is updated instead.
+    """
+    from core.models import ForecastState
+
+    def fill(row):
+        row.update_from_state(state)
+        if version is not None:
+            row.result = result
+            row.result_months_ahead = months_ahead
+            row.result_version = str(version)
+
+    if state is None:
+        return saved
+    if saved is None:
+        saved = ForecastState(owner_id=owner_id)
+        fill(saved)
+        try:
+            with transaction.atomic():
+                saved.save(force_insert=True)
+            return saved
+        except IntegrityError:
+            # два первых запроса владельца считали прогноз одновременно -- строку уже создал другой
+            saved = ForecastState.objects.get(owner_id=owner_id)
+    fill(saved)
+    saved.save()
+    return saved
+
+
+def forecast_for_owner(owner, months_ahead=6, version=None, points=None):
+    """
+    forecast_monthly for all of the owner's invoices, reusing and updating their
+    ForecastState. With ``version`` (see core.utils.cache.get_data_version) a result
+    stored for the same data version, e.g. by precompute_forecasts, is returned as is.
+    ``points`` are the owner's monthly totals if the caller already has them,
+    otherwise they are read from the MonthlyRollup table.
+    A provisional state (the selection ran out of its budget) is not saved.
+    """
+    from core.models import ForecastState
+    from core.utils.jobs import get_process_executor
+    from core.utils.rollup import monthly_points_for_owner
+
+    saved = ForecastState.objects.filter(owner=owner).first()
+    if saved and version is not None and saved.has_result(months_ahead, version):
+        return saved.result
+
+    if points is None:
+        points = monthly_points_for_owner(owner.pk)
+    # запрос ждёт выбора модели не дольше FORECAST_SELECTION_BUDGET_MS
+    result, state = forecast_from_points(
+        points, months_ahead, state=saved.to_state() if saved else None,
+        budget_ms=getattr(settings, 'FORECAST_SELECTION_BUDGET_MS', None),
+        executor=get_process_executor(ready_only=True),
+        fitter=getattr(settings, 'FORECAST_FITTER', 'minimize'),
+    )
+    if state is None or state.get('provisional'):
+        return result
+    if saved is None or version is not None or state != saved.to_state():
+        save_forecast_state(owner.pk, saved, state, result, months_ahead, version)
+    return result
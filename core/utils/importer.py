@@ -1,15 +1,147 @@
 # core/utils/importer.py
 import csv
-from django.utils.dateparse import parse_date
-from django.db import transaction
-from decimal import Decimal, InvalidOperation
+import itertools
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 
-from core.models import Client, Project, Category, Invoice
+from core.models import Client, Project, Category, Invoice, ImportJob
+from core.utils.cache import bump_data_version
+from core.utils import metrics
+from core.utils.jobs import submit_job
+from core.utils.parsing import PARSED_FIELDS, parse_csv_range, parse_invoice_row
+from core.utils.rollup import add_delta, apply_deltas, rollup_key
 
 REQUIRED_COLUMNS = {'date', 'amount', 'client', 'project', 'category', 'paid', 'external_id'}
 
+logger = logging.getLogger(__name__)
 
-def import_invoices_from_file(fileobj, owner):
+# сколько строк CSV копим перед одной пачкой bulk_create
+BATCH_SIZE = 1000
+
+# сколько сообщений об ошибках хранить в ImportJob, остальные только считаются
+JOB_ERROR_LINES = 50
+
+
+class OwnerLookups:
+    """
+    In-memory maps name -> object for one owner's clients, projects and categories,
+    plus the set of external_ids already stored. Everything is loaded with one query
+    per table; missing names are created with bulk_create once per batch.
+    """
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.load()
+
+    def load(self):
+        self.clients = {c.name: c for c in Client.objects.filter(owner=self.owner).order_by('-id')}
+        self.projects = {
+            (p.client_id, p.title): p
+            for p in Project.objects.filter(owner=self.owner).order_by('-id')
+        }
+        self.categories = {c.name: c for c in Category.objects.filter(owner=self.owner).order_by('-id')}
+        self.external_ids = set(
+            Invoice.objects.filter(owner=self.owner).exclude(external_id='')
+            .order_by().values_list('external_id', flat=True)
+        )
+
+    def resolve(self, rows):
+        """Create every client/project/category referenced by ``rows`` that does not exist yet."""
+        new_clients = {r['client'] for r in rows} - self.clients.keys()
+        if new_clients:
+            created = Client.objects.bulk_create([Client(owner=self.owner, name=n) for n in sorted(new_clients)])
+            self.clients.update((c.name, c) for c in created)
+
+        new_categories = {r['category'] for r in rows} - self.categories.keys()
+        if new_categories:
+            created = Category.objects.bulk_create([Category(owner=self.owner, name=n) for n in sorted(new_categories)])
+            self.categories.update((c.name, c) for c in created)
+
+        new_projects = {(self.clients[r['client']].pk, r['project']) for r in rows} - self.projects.keys()
+        if new_projects:
+            created = Project.objects.bulk_create([
+                Project(owner=self.owner, client_id=client_id, title=title)
+                for client_id, title in sorted(new_projects)
+            ])
+            self.projects.update(((p.client_id, p.title), p) for p in created)
+
+
+def write_invoice_batch(rows, lookups, result, batch_size=BATCH_SIZE):
+    """
+    Bulk-insert already parsed rows for ``lookups.owner``. Rows whose external_id is
+    already known (in the DB or earlier in the same file) are counted as skipped.
+    Returns the list of created Invoice objects.
+    """
+    fresh = []
+    for r in rows:
+        ext = r['external_id']
+        if ext:
+            if ext in lookups.external_ids:
+                result['skipped'] += 1
+                continue
+            lookups.external_ids.add(ext)
+        fresh.append(r)
+    if not fresh:
+        return []
+
+    lookups.resolve(fresh)
+    invoices = []
+    deltas = {}
+    for r in fresh:
+        client = lookups.clients[r['client']]
+        category = lookups.categories[r['category']]
+        add_delta(deltas, rollup_key(lookups.owner.pk, r['date'], client.pk, category.pk, r['paid']), r['amount'], 1)
+        invoices.append(Invoice(
+            owner=lookups.owner,
+            project=lookups.projects[(client.pk, r['project'])],
+            category=category,
+            date=r['date'],
+            amount=r['amount'],
+            paid=r['paid'],
+            description=r['description'],
+            external_id=r['external_id'],
+        ))
+    created = Invoice.objects.bulk_create(invoices, batch_size=batch_size)
+    apply_deltas(deltas)
+    # bulk_create не шлёт post_save, поэтому кэш сбрасываем сами
+    bump_data_version(lookups.owner.pk)
+    result['created'] += len(created)
+    return created
+
+
+def commit_invoice_batch(rows, lookups, batch_size=BATCH_SIZE):
+    """
+    write_invoice_batch in its own transaction. If another writer stored some of the
+    same external_ids meanwhile (IntegrityError on the unique constraint), the
+    lookups are reloaded and the batch is retried once without them; if that fails
+    too, the lookups are reloaded again and the error is raised.
+    Returns {'created': n, 'skipped': n}.
+    """
+    for attempt in range(2):
+        result = {'created': 0, 'skipped': 0}
+        try:
+            with transaction.atomic():
+                write_invoice_batch(rows, lookups, result, batch_size)
+            return result
+        except IntegrityError:
+            # откат убрал и созданных в этой пачке клиентов/проекты -- справочники читаем заново
+            lookups.load()
+            if attempt:
+                raise
+
+
+def import_invoices_from_file(fileobj, owner, batch_size=BATCH_SIZE):
+    """
+    Import a CSV file. Every ``batch_size`` rows are committed separately, so a
+    failing batch does not undo the ones before it and the write lock is not held
+    for the whole file; a batch that still fails is reported in 'errors'.
+    """
     result = {'created': 0, 'skipped': 0, 'errors': []}
     decoded = (line.decode('utf-8') if isinstance(line, (bytes, bytearray)) else line for line in fileobj)
     reader = csv.DictReader(decoded)
@@ -18,47 +150,268 @@ def import_invoices_from_file(fileobj, owner):
         result['errors'].append(f"CSV must contain columns: {', '.join(sorted(REQUIRED_COLUMNS))}")
         return result
 
-    with transaction.atomic():
-        for i, row in enumerate(reader, start=1):
+    lookups = OwnerLookups(owner)
+    batch = []
+    first = 1
+
+    def commit(last):
+        try:
+            written = commit_invoice_batch(batch, lookups, batch_size)
+        except IntegrityError as e:
+            result['errors'].append(f"Lines {first}-{last}: {e}")
+            return
+        result['created'] += written['created']
+        result['skipped'] += written['skipped']
+
+    i = 0
+    for i, row in enumerate(reader, start=1):
+        try:
+            batch.append(parse_invoice_row(row))
+        except Exception as e:
+            result['errors'].append(f"Line {i}: {e}")
+            continue
+        if len(batch) >= batch_size:
+            commit(i)
+            batch = []
+            first = i + 1
+    if batch:
+        commit(i)
+    return result
+
+
+def iter_import_chunks(fileobj, owner, chunk_size=BATCH_SIZE, start_line=1, on_error=None, start_offset=None):
+    """
+    Streaming variant of import_invoices_from_file for very large files.
+
+    Every ``chunk_size`` rows are written and committed in their own transaction, so
+    a crash loses at most one chunk. Rows before ``start_line`` (1-based, header not
+    counted) are skipped without parsing. With ``start_offset`` (the 'offset' of the
+    progress that had line start_line - 1) a binary ``fileobj`` is seeked there after
+    reading the header, so the committed rows are not read at all. Bad rows are not
+    collected in memory but passed to ``on_error(line, row, message)``.
+
+    Yields a progress dict after each committed chunk; its 'line' is the last data
+    line that is safely stored and 'offset' the byte offset right after it (resume
+    with start_line=line + 1, start_offset=offset). A chunk that cannot be stored
+    because of an IntegrityError (see commit_invoice_batch) goes to ``on_error`` row by row.
+    """
+    consumed = 0
+
+    def decoded():
+        nonlocal consumed
+        for line in fileobj:
+            if isinstance(line, (bytes, bytearray)):
+                consumed += len(line)
+                line = line.decode('utf-8')
+            else:
+                consumed += len(line.encode('utf-8'))
+            yield line
+
+    reader = csv.DictReader(decoded())
+    headers = set(reader.fieldnames or [])
+    if not REQUIRED_COLUMNS.issubset(headers):
+        raise ValueError(f"CSV must contain columns: {', '.join(sorted(REQUIRED_COLUMNS))}")
+
+    if start_offset and start_line > 1:
+        # заголовок уже прочитан, дальше читаем с первой незакоммиченной строки
+        fileobj.seek(start_offset - 1)
+        if fileobj.read(1) != b'\n':
+            raise ValueError(f"Offset {start_offset} is not at the start of a CSV row")
+        consumed = start_offset
+    else:
+        for _ in itertools.islice(reader, start_line - 1):
+            pass
+    progress = {'line': start_line - 1, 'offset': consumed, 'rows': 0, 'created': 0, 'skipped': 0, 'errors': 0}
+
+    lookups = OwnerLookups(owner)
+    line = start_line - 1
+    while True:
+        batch = []
+        for line, row in enumerate(itertools.islice(reader, chunk_size), start=line + 1):
             try:
-                date = parse_date(row.get('date', '').strip())
-                if date is None:
-                    raise ValueError("Invalid date (use YYYY-MM-DD)")
-                try:
-                    amount = Decimal(row.get('amount', '').strip())
-                    if amount <= 0:
-                        raise ValueError("Amount must be positive")
-                except (InvalidOperation, ValueError) as e:
-                    raise ValueError("Invalid amount: " + str(e))
-
-                paid = str(row.get('paid', '')).strip().lower() in ('1', 'true', 'yes', 'y')
-                client_name = row.get('client', '').strip() or 'Unknown'
-                project_title = row.get('project', '').strip() or 'Default project'
-                category_name = row.get('category', '').strip() or 'Uncategorized'
-                external_id = row.get('external_id', '').strip()
-                description = row.get('description', '').strip()
-
-                client_obj, _ = Client.objects.get_or_create(owner=owner, name=client_name)
-                project_obj, _ = Project.objects.get_or_create(owner=owner, client=client_obj, title=project_title)
-                category_obj, _ = Category.objects.get_or_create(owner=owner, name=category_name)
-
-                if external_id:
-                    exists = Invoice.objects.filter(owner=owner, external_id=external_id).exists()
-                    if exists:
-                        result['skipped'] += 1
-                        continue
-
-                Invoice.objects.create(
-                    owner=owner,
-                    project=project_obj,
-                    category=category_obj,
-                    date=date,
-                    amount=amount,
-                    paid=paid,
-                    description=description,
-                    external_id=external_id,
-                )
-                result['created'] += 1
+                batch.append((line, row, parse_invoice_row(row)))
             except Exception as e:
-                result['errors'].append(f"Line {i}: {e}")
-    return result
+                progress['errors'] += 1
+                if on_error:
+                    on_error(line, row, str(e))
+        if line == progress['line']:
+            break
+
+        try:
+            result = commit_invoice_batch([parsed for _, _, parsed in batch], lookups)
+        except IntegrityError as e:
+            # пачка не записалась и после повтора -- её строки уходят в отказы, импорт идёт дальше
+            result = {'created': 0, 'skipped': 0}
+            progress['errors'] += len(batch)
+            if on_error:
+                for failed_line, row, _ in batch:
+                    on_error(failed_line, row, f"Not stored: {e}")
+        progress['created'] += result['created']
+        progress['skipped'] += result['skipped']
+        progress['rows'] += line - progress['line']
+        progress['line'] = line
+        progress['offset'] = consumed
+        yield dict(progress)
+
+
+def csv_ranges(path, chunk_size):
+    """
+    Split a CSV file into byte ranges of ``chunk_size`` records for parse_csv_range.
+    Only counts quotes and newlines, so a quoted field may span lines.
+    Returns (fieldnames, [(start, end, first_line, n_records), ...]).
+    """
+    with open(path, 'rb') as f:
+        fieldnames = next(csv.reader([f.readline().decode('utf-8')]), [])
+        if not REQUIRED_COLUMNS.issubset(fieldnames):
+            raise ValueError(f"{path}: CSV must contain columns: {', '.join(sorted(REQUIRED_COLUMNS))}")
+        ranges = []
+        start = pos = f.tell()
+        line = count = quotes = 0
+        for raw in f:
+            pos += len(raw)
+            quotes += raw.count(b'"')
+            # перевод строки внутри кавычек -- запись продолжается
+            if quotes % 2:
+                continue
+            # пустые строки csv пропускает, в нумерацию они не входят
+            if raw.strip(b'\r\n'):
+                count += 1
+            if count == chunk_size:
+                ranges.append((start, pos, line + 1, count))
+                line += count
+                start, count = pos, 0
+        if count:
+            ranges.append((start, pos, line + 1, count))
+    return fieldnames, ranges
+
+
+def import_invoice_files(jobs, workers=None, chunk_size=BATCH_SIZE, on_error=None):
+    """
+    Import several CSV files, ``jobs`` being a list of (path, owner) pairs.
+
+    This process only splits the files into byte ranges (see csv_ranges); a pool
+    of ``workers`` processes reads, decodes and validates them. The database
+    writes stay in this process and run one chunk at a time, in file order, each
+    chunk in its own transaction (safe for SQLite). Lookups are shared between
+    files of the same owner, so duplicates across files are skipped too.
+
+    Yields (path, progress) after every committed chunk, progress having the same
+    keys as in iter_import_chunks.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = 2 * workers
+    lookups = {}
+    in_flight = deque()
+
+    def chunks():
+        for path, owner in jobs:
+            fieldnames, ranges = csv_ranges(path, chunk_size)
+            for start, end, first_line, n_rows in ranges:
+                yield path, owner, fieldnames, start, end, first_line, n_rows
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        source = chunks()
+        progress = {}
+        while True:
+            for path, owner, fieldnames, start, end, first_line, n_rows in itertools.islice(
+                    source, max_in_flight - len(in_flight)):
+                future = pool.submit(parse_csv_range, path, start, end, fieldnames, first_line)
+                in_flight.append((path, owner, first_line + n_rows - 1, n_rows, future))
+            if not in_flight:
+                break
+
+            path, owner, last_line, n_rows, future = in_flight.popleft()
+            parsed, errors = future.result()
+            if on_error:
+                for line, row, message in errors:
+                    on_error(path, line, row, message)
+
+            if owner.pk not in lookups:
+                lookups[owner.pk] = OwnerLookups(owner)
+            result = commit_invoice_batch([dict(zip(PARSED_FIELDS, row)) for row in parsed], lookups[owner.pk])
+
+            stats = progress.setdefault((path, owner.pk), {'line': 0, 'rows': 0, 'created': 0, 'skipped': 0, 'errors': 0})
+            stats['line'] = last_line
+            stats['rows'] += n_rows
+            stats['created'] += result['created']
+            stats['skipped'] += result['skipped']
+            stats['errors'] += len(errors)
+            yield path, dict(stats)
+
+
+def start_import_job(owner, path, filename):
+    """Queue a background import of the spooled CSV at ``path``."""
+    job = ImportJob.objects.create(owner=owner, path=path, filename=filename[:255], size=os.path.getsize(path))
+    submit_job(run_import_job, job.pk)
+    return job
+
+
+def run_import_job(job_id, chunk_size=BATCH_SIZE):
+    """
+    Import a pending ImportJob chunk by chunk, saving progress after every committed chunk.
+    A job that was interrupted continues from the byte offset after its last committed line.
+    Returns False if the job was already taken by another worker.
+    """
+    claimed = ImportJob.objects.filter(pk=job_id, status='pending').update(
+        status='running', started_at=timezone.now()
+    )
+    if not claimed:
+        return False
+
+    job = ImportJob.objects.select_related('owner').get(pk=job_id)
+
+    def on_error(line, row, message):
+        job.errors += 1
+        metrics.inc('import_rows_total', result='error')
+        if len(job.error_lines) < JOB_ERROR_LINES:
+            job.error_lines.append(f"Line {line}: {message}")
+
+    progress_fields = ['line', 'rows', 'created', 'skipped', 'errors', 'error_lines', 'position', 'updated_at']
+    try:
+        with open(job.path, 'rb') as f:
+            base = {'rows': job.rows, 'created': job.created, 'skipped': job.skipped}
+            for progress in iter_import_chunks(f, job.owner, chunk_size=chunk_size, start_line=job.line + 1,
+                                               on_error=on_error, start_offset=job.position if job.line else None):
+                metrics.inc('import_rows_total', base['created'] + progress['created'] - job.created, result='created')
+                metrics.inc('import_rows_total', base['skipped'] + progress['skipped'] - job.skipped, result='skipped')
+                job.line = progress['line']
+                job.rows = base['rows'] + progress['rows']
+                job.created = base['created'] + progress['created']
+                job.skipped = base['skipped'] + progress['skipped']
+                job.position = progress['offset']
+                job.save(update_fields=progress_fields)
+    except Exception as e:
+        logger.exception('Import job %s failed', job.pk)
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=progress_fields + ['status', 'error', 'finished_at'])
+        return True
+
+    job.status = 'done'
+    job.position = job.size
+    job.finished_at = timezone.now()
+    job.save(update_fields=progress_fields + ['status', 'finished_at'])
+    metrics.observe('import_rows_per_second', import_job_stats(job)['rows_per_sec'])
+    try:
+        os.remove(job.path)
+    except FileNotFoundError:
+        pass
+    return True
+
+
+def requeue_stale_import_jobs():
+    """Put 'running' jobs whose worker died (no progress for IMPORT_JOB_TIMEOUT seconds) back in the queue."""
+    timeout = timedelta(seconds=getattr(settings, 'IMPORT_JOB_TIMEOUT', 10 * 60))
+    return ImportJob.objects.filter(status='running', updated_at__lt=timezone.now() - timeout).update(status='pending')
+
+
+def import_job_stats(job, now=None):
+    """Progress numbers for the status endpoint: percent of the file done, rows/s, elapsed seconds."""
+    now = now or timezone.now()
+    elapsed = ((job.finished_at or now) - job.started_at).total_seconds() if job.started_at else 0
+    return {
+        'percent': round(100 * job.position / job.size, 1) if job.size else (100.0 if job.status == 'done' else 0.0),
+        'rows_per_sec': round(job.rows / elapsed, 1) if elapsed > 0 else 0.0,
+        'elapsed': round(elapsed, 1),
+    }
@@ -0,0 +1,110 @@
+# core/utils/jobs.py
+# Простой фоновый исполнитель внутри веб-процесса. Для нескольких процессов
+# или когда потоки нежелательны: BACKGROUND_JOBS = 'command' и отдельно
+# запущенный `python manage.py run_jobs`.
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_cpu_executor = None
+_process_executor = None
+_lock = threading.Lock()
+
+# модуль с задачами пула процессов: запуск spawn-процесса и импорт numpy/scipy -- это секунды
+PROCESS_POOL_PRELOAD = 'core.utils.forecast'
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'BACKGROUND_JOB_WORKERS', 2),
+                thread_name_prefix='core-jobs',
+            )
+    return _executor
+
+
+def _run(fn, args):
+    try:
+        fn(*args)
+    except Exception:
+        logger.exception('Background job %s%r failed', getattr(fn, '__name__', fn), args)
+    finally:
+        close_old_connections()
+
+
+def submit_job(fn, *args):
+    """
+    Run ``fn(*args)`` in the background after the current transaction commits.
+    Does nothing when BACKGROUND_JOBS is 'command': the run_jobs worker picks pending jobs up.
+    """
+    if getattr(settings, 'BACKGROUND_JOBS', 'thread') != 'thread':
+        return
+    transaction.on_commit(lambda: get_executor().submit(_run, fn, args))
+
+
+def get_cpu_executor():
+    global _cpu_executor
+    with _lock:
+        if _cpu_executor is None:
+            _cpu_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'FORECAST_WORKERS', 2),
+                thread_name_prefix='core-cpu',
+            )
+    return _cpu_executor
+
+
+def _warm_up(module):
+    importlib.import_module(module)
+
+
+def get_process_executor(ready_only=False):
+    """
+    Pool of FORECAST_SELECTION_WORKERS processes for pure computations without the
+    database (forecast backtests), or None if it is 0: then they run in the caller.
+    A new pool starts its processes and imports PROCESS_POOL_PRELOAD in them right away.
+    With ``ready_only`` None is returned while the pool still has unfinished work
+    (startup, or tasks of an earlier caller that ran out of time), so a caller with
+    a time budget computes in its own process instead of queueing behind it.
+    """
+    global _process_executor
+    workers = getattr(settings, 'FORECAST_SELECTION_WORKERS', 2)
+    if not workers:
+        return None
+    with _lock:
+        # упавший процесс ломает весь пул -- тогда создаём новый
+        if _process_executor is None or _process_executor._broken:
+            # spawn, а не fork: в веб-процессе уже работают потоки, форк мог бы унести чужие локи
+            _process_executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+            )
+            for _ in range(workers):
+                _process_executor.submit(_warm_up, PROCESS_POOL_PRELOAD)
+        if ready_only and _process_executor._pending_work_items:
+            return None
+    return _process_executor
+
+
+def _call(fn, args):
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_blocking(fn, *args):
+    """
+    Await ``fn(*args)`` run in a small bounded pool of FORECAST_WORKERS threads.
+    For CPU-heavy work in async views (the forecast fit): the event loop keeps
+    serving other requests, and no more than that many fits run at once.
+    """
+    return await asyncio.get_running_loop().run_in_executor(get_cpu_executor(), _call, fn, args)
@@ -0,0 +1,235 @@
+# core/utils/metrics.py
+# Метрики производительности в памяти процесса, отдаются в текстовом формате Prometheus
+# на /metrics. Запись -- словарь под одним локом, поэтому их можно не выключать в проде.
+# Если задан METRICS_DIR, каждый процесс (воркеры веб-сервера, run_jobs) раз в
+# METRICS_FLUSH_INTERVAL секунд сбрасывает туда свой снимок, а /metrics их суммирует.
+# Снимки завершившихся процессов сворачиваются в retired.json и удаляются, чтобы
+# счётчики не пропадали, а каталог не рос с каждым перезапуском воркеров.
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: без flock снимки завершившихся процессов не сворачиваются
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+RATE_BUCKETS = (100, 500, 1000, 5000, 10000, 25000, 50000, 100000)
+
+# имя -> (тип, описание, бакеты гистограммы)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by view, method and status code', None),
+    'http_request_duration_seconds': ('histogram', 'Request latency by view', LATENCY_BUCKETS),
+    'http_request_db_queries': ('histogram', 'SQL queries per request by view', QUERY_BUCKETS),
+    'http_request_db_seconds': ('histogram', 'Time spent in SQL per request by view', LATENCY_BUCKETS),
+    'http_slow_requests_total': ('counter', 'Requests slower than SLOW_REQUEST_SECONDS by view', None),
+    'forecast_fit_seconds': ('histogram', 'Holt-Winters parameter fit time', LATENCY_BUCKETS),
+    'forecast_selection_seconds': ('histogram', 'Forecast model selection (backtests) time', LATENCY_BUCKETS),
+    'forecast_selection_timeouts_total': ('counter', 'Model selections cut short by the time budget', None),
+    'forecast_backtest_failures_total': ('counter', 'Candidate backtests that raised an error', None),
+    'import_rows_total': ('counter', 'Imported CSV rows by result (created, skipped, error)', None),
+    'import_rows_per_second': ('histogram', 'Throughput of finished import jobs', RATE_BUCKETS),
+}
+
+_lock = threading.Lock()
+# (имя, метки) -> число для счётчика или [счётчики бакетов..., +Inf, сумма] для гистограммы
+_values = {}
+_last_flush = 0.0
+# каталоги METRICS_DIR, куда этот процесс писал снимок; при выходе он сворачивается в retired.json
+_flushed_roots = set()
+
+RETIRED = 'retired.json'
+
+
+def _key(name, labels):
+    if name not in METRICS:
+        raise KeyError(f'Unknown metric {name!r}')
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    buckets = METRICS[name][2]
+    with _lock:
+        slots = _values.get(key)
+        if slots is None:
+            slots = _values[key] = [0] * (len(buckets) + 1) + [0.0]
+        # бакеты хранятся без накопления, суммируются при выводе
+        slots[bisect.bisect_left(buckets, value)] += 1
+        slots[-1] += value
+
+
+@contextmanager
+def timer(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def reset():
+    with _lock:
+        _values.clear()
+
+
+def _snapshot():
+    with _lock:
+        return [[name, list(labels), value if isinstance(value, (int, float)) else list(value)]
+                for (name, labels), value in _values.items()]
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def flush(force=False):
+    """Write this process's metrics to METRICS_DIR, at most once per METRICS_FLUSH_INTERVAL unless ``force``."""
+    global _last_flush
+    root = metrics_dir()
+    now = time.monotonic()
+    if not root or not force and now - _last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+        return
+    _last_flush = now
+    os.makedirs(root, exist_ok=True)
+    _write(os.path.join(root, f'{os.getpid()}.json'), _snapshot())
+    if not _flushed_roots:
+        atexit.register(retire_own)
+    _flushed_roots.add(os.fspath(root))
+
+
+def _write(path, snapshot):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _retire(root, paths):
+    """Fold the snapshots at ``paths`` into RETIRED and delete them."""
+    with open(os.path.join(root, '.lock'), 'a') as lock:
+        # под локом один и тот же снимок не свернут два процесса сразу
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        retired = os.path.join(root, RETIRED)
+        snapshots = [_read(retired) or []]
+        taken = []
+        for path in paths:
+            snapshot = _read(path)
+            if snapshot is not None:
+                snapshots.append(snapshot)
+                taken.append(path)
+        if not taken:
+            return
+        _write(retired, [[name, [list(pair) for pair in labels], value]
+                         for (name, labels), value in _merge(snapshots).items()])
+        for path in taken:
+            os.remove(path)
+
+
+def retire_own():
+    """At process exit: write the final snapshot and fold it into RETIRED."""
+    snapshot = _snapshot()
+    for root in _flushed_roots:
+        path = os.path.join(root, f'{os.getpid()}.json')
+        if fcntl is None or not os.path.exists(path):
+            continue
+        _write(path, snapshot)
+        _retire(root, [path])
+
+
+def _collect():
+    """Merged metrics of this process and, with METRICS_DIR, of the other processes' snapshots."""
+    snapshots = [_snapshot()]
+    root = metrics_dir()
+    if root and os.path.isdir(root):
+        own = f'{os.getpid()}.json'
+        # воркер, убитый без atexit (SIGKILL, OOM), оставил снимок -- сворачиваем его здесь
+        if fcntl is not None:
+            stale = [os.path.join(root, name) for name in os.listdir(root)
+                     if name.endswith('.json') and name != own and name[:-5].isdigit() and not _alive(int(name[:-5]))]
+            if stale:
+                _retire(root, stale)
+        for name in os.listdir(root):
+            if not name.endswith('.json') or name == own:
+                continue
+            snapshot = _read(os.path.join(root, name))
+            if snapshot is not None:
+                snapshots.append(snapshot)
+    return _merge(snapshots)
+
+
+def _merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot:
+            if name not in METRICS:
+                continue
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if isinstance(value, list):
+                current = merged.setdefault(key, [0] * len(value))
+                merged[key] = [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    merged = _collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted(((labels, value) for (n, labels), value in merged.items() if n == name), key=lambda s: s[0])
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            if kind == 'counter':
+                lines.append(f'{name}{_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {value[-1]}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
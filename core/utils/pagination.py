@@ -0,0 +1,133 @@
+# core/utils/pagination.py
+# Keyset-пагинация: страница N стоит столько же, сколько первая --
+# вместо OFFSET фильтр "после последней строки" по индексу (owner, date, id).
+import base64
+import json
+from dataclasses import dataclass, field
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: str = None
+    prev_cursor: str = None
+    ordering: tuple = field(default=())
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+def _field_name(term):
+    return term.lstrip('-')
+
+
+def encode_cursor(ordering, values, direction):
+    payload = {'o': ','.join(ordering), 'k': [str(v) for v in values], 'd': direction}
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _to_python(qs, name, value):
+    # ключом может быть и аннотация (например, search_rank)
+    if name in qs.query.annotations:
+        return qs.query.annotations[name].output_field.to_python(value)
+    return qs.model._meta.get_field(name).to_python(value)
+
+
+def decode_cursor(cursor, ordering, qs):
+    """Return (values, direction) or raise InvalidCursor; the cursor must belong to the same ordering."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if payload['o'] != ','.join(ordering) or payload['d'] not in ('n', 'p') or len(payload['k']) != len(ordering):
+            raise InvalidCursor('Cursor does not match the current ordering')
+        values = [_to_python(qs, _field_name(t), v) for t, v in zip(ordering, payload['k'])]
+    except InvalidCursor:
+        raise
+    except Exception:
+        raise InvalidCursor('Malformed cursor')
+    return values, payload['d']
+
+
+def _after(ordering, values):
+    """
+    Rows strictly after ``values`` in ``ordering``. The leading column also gets a
+    plain range bound so the database can start the index scan at the right place.
+    """
+    q = Q()
+    for i in reversed(range(len(ordering))):
+        name = _field_name(ordering[i])
+        op = 'lt' if ordering[i].startswith('-') else 'gt'
+        step = Q(**{f'{name}__{op}': values[i]})
+        q = step if i == len(ordering) - 1 else step | (Q(**{name: values[i]}) & q)
+    first = _field_name(ordering[0])
+    bound = Q(**{f"{first}__{'lte' if ordering[0].startswith('-') else 'gte'}": values[0]})
+    return bound & q
+
+
+def _reverse(ordering):
+    return tuple(t[1:] if t.startswith('-') else f'-{t}' for t in ordering)
+
+
+def _page_query(qs, ordering, cursor, page_size):
+    """The queryset that fetches one page (plus one row) and the direction of ``cursor``."""
+    direction = 'n'
+    if cursor:
+        values, direction = decode_cursor(cursor, ordering, qs)
+        scan = ordering if direction == 'n' else _reverse(ordering)
+        qs = qs.filter(_after(scan, values))
+    else:
+        scan = ordering
+    # одна лишняя строка говорит, есть ли следующая страница
+    return qs.order_by(*scan)[:page_size + 1], direction
+
+
+def _build_page(rows, ordering, cursor, direction, page_size, key):
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == 'p':
+        rows.reverse()
+
+    if key is None:
+        names = [_field_name(t) for t in ordering]
+
+        def key(obj):
+            return [getattr(obj, n) for n in names]
+
+    page = KeysetPage(rows, ordering=ordering)
+    if rows:
+        if direction == 'n' and more or direction == 'p':
+            page.next_cursor = encode_cursor(ordering, key(rows[-1]), 'n')
+        if direction == 'p' and more or direction == 'n' and cursor:
+            page.prev_cursor = encode_cursor(ordering, key(rows[0]), 'p')
+    return page
+
+
+def keyset_page(qs, ordering=('-date', '-id'), cursor=None, page_size=20, key=None):
+    """
+    One page of ``qs`` in ``ordering`` (non-null columns or annotations, the last one unique).
+    ``cursor`` is a next/prev cursor from a previous page; None means the first page.
+    ``key(row)`` returns the ordering values of a row; by default they are read as
+    attributes, pass one for values()/values_list() querysets.
+    Raises InvalidCursor for a cursor that cannot be used.
+    """
+    ordering = tuple(ordering)
+    query, direction = _page_query(qs, ordering, cursor, page_size)
+    return _build_page(list(query), ordering, cursor, direction, page_size, key)
+
+
+async def akeyset_page(qs, ordering=('-date', '-id'), cursor=None, page_size=20, key=None):
+    """keyset_page for async views: the page is fetched with the async ORM."""
+    ordering = tuple(ordering)
+    query, direction = _page_query(qs, ordering, cursor, page_size)
+    return _build_page([row async for row in query], ordering, cursor, direction, page_size, key)
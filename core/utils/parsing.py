@@ -0,0 +1,58 @@
+# core/utils/parsing.py
+# Чистый разбор строк CSV без обращения к моделям: модуль импортируется
+# в процессах пула, где Django-приложения не инициализированы.
+import csv
+import io
+from django.utils.dateparse import parse_date
+from decimal import Decimal, InvalidOperation
+
+
+def parse_invoice_row(row):
+    """Validate one CSV row and return a plain dict of cleaned values (raises ValueError)."""
+    date = parse_date((row.get('date') or '').strip())
+    if date is None:
+        raise ValueError("Invalid date (use YYYY-MM-DD)")
+    try:
+        amount = Decimal((row.get('amount') or '').strip())
+        if amount <= 0:
+            raise ValueError("Amount must be positive")
+    except (InvalidOperation, ValueError) as e:
+        raise ValueError("Invalid amount: " + str(e))
+
+    return {
+        'date': date,
+        'amount': amount,
+        'paid': str(row.get('paid') or '').strip().lower() in ('1', 'true', 'yes', 'y'),
+        'client': (row.get('client') or '').strip() or 'Unknown',
+        'project': (row.get('project') or '').strip() or 'Default project',
+        'category': (row.get('category') or '').strip() or 'Uncategorized',
+        'external_id': (row.get('external_id') or '').strip(),
+        'description': (row.get('description') or '').strip(),
+    }
+
+
+# порядок полей в кортежах, которые parse_csv_range возвращает вместо словарей
+PARSED_FIELDS = ('date', 'amount', 'paid', 'client', 'project', 'category', 'external_id', 'description')
+
+
+def parse_csv_range(path, start, end, fieldnames, first_line):
+    """
+    Read and parse the CSV records in bytes [start, end) of ``path``, ``first_line``
+    being the data line number of the first one. Runs inside worker processes, so
+    only the offsets go to the worker and only compact results come back.
+    Returns (rows, errors): rows as tuples in PARSED_FIELDS order, errors as
+    (line, row, message).
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    reader = csv.DictReader(io.StringIO(data.decode('utf-8'), newline=''), fieldnames=fieldnames)
+    rows, errors = [], []
+    for line, row in enumerate(reader, start=first_line):
+        try:
+            parsed = parse_invoice_row(row)
+        except Exception as e:
+            errors.append((line, row, str(e)))
+            continue
+        rows.append(tuple(parsed[k] for k in PARSED_FIELDS))
+    return rows, errors
@@ -0,0 +1,131 @@
+# core/utils/rollup.py
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, F, Subquery, Sum
+from django.db.models.functions import TruncMonth
+
+from core.models import Invoice, MonthlyRollup
+
+
+def rollup_key(owner_id, day, client_id, category_id, paid):
+    return owner_id, day.replace(day=1), client_id, category_id, bool(paid)
+
+
+def add_delta(deltas, key, amount, count):
+    total, n = deltas.get(key, (Decimal('0'), 0))
+    deltas[key] = (total + amount, n + count)
+
+
+def apply_deltas(deltas):
+    """
+    Add {key: (amount, count)} to MonthlyRollup, creating missing rows in one bulk insert.
+    If several rows share a key, the delta goes to exactly one of them.
+    """
+    missing = []
+    with transaction.atomic():
+        for key, (amount, count) in deltas.items():
+            if not amount and not count:
+                continue
+            owner_id, month, client_id, category_id, paid = key
+            one_row = MonthlyRollup.objects.filter(
+                owner_id=owner_id, month=month, client_id=client_id, category_id=category_id, paid=paid,
+            ).values('pk')[:1]
+            updated = MonthlyRollup.objects.filter(pk=Subquery(one_row)).update(
+                total=F('total') + amount, count=F('count') + count,
+            )
+            # отрицательная дельта без строки -- сводку уже удалили (например, каскадом)
+            if not updated and count > 0:
+                missing.append(MonthlyRollup(owner_id=owner_id, month=month, client_id=client_id,
+                                             category_id=category_id, paid=paid, total=amount, count=count))
+        if missing:
+            MonthlyRollup.objects.bulk_create(missing)
+        emptied = {key[0] for key, (amount, count) in deltas.items() if count < 0}
+        if emptied:
+            MonthlyRollup.objects.filter(owner_id__in=emptied, count__lte=0).delete()
+
+
+def rebuild_rollups(owner_ids=None):
+    """Recompute rollups from the invoices (all owners or only ``owner_ids``). Returns rows written."""
+    invoices = Invoice.objects.all()
+    rollups = MonthlyRollup.objects.all()
+    if owner_ids is not None:
+        invoices = invoices.filter(owner_id__in=owner_ids)
+        rollups = rollups.filter(owner_id__in=owner_ids)
+    rows = (
+        invoices
+        .annotate(month=TruncMonth('date'))
+        .values('owner_id', 'month', 'project__client_id', 'category_id', 'paid')
+        .annotate(total=Sum('amount'), n=Count('id'))
+        .order_by()
+    )
+    with transaction.atomic():
+        rollups.delete()
+        created = MonthlyRollup.objects.bulk_create([
+            MonthlyRollup(owner_id=r['owner_id'], month=r['month'], client_id=r['project__client_id'],
+                          category_id=r['category_id'], paid=r['paid'], total=r['total'], count=r['n'])
+            for r in rows.iterator()
+        ], batch_size=1000)
+    return len(created)
+
+
+def _summary_rows(owner):
+    return (
+        MonthlyRollup.objects.filter(owner=owner)
+        .values('month', 'client__name', 'paid', 'total', 'count')
+        .order_by('month')
+    )
+
+
+def _summarize(rows):
+    total = unpaid_sum = Decimal('0')
+    count = unpaid_count = 0
+    monthly = {}
+    by_client = defaultdict(Decimal)
+    for r in rows:
+        if not r['count'] and not r['total']:
+            continue
+        total += r['total']
+        count += r['count']
+        if not r['paid']:
+            unpaid_sum += r['total']
+            unpaid_count += r['count']
+        monthly[r['month']] = monthly.get(r['month'], Decimal('0')) + r['total']
+        by_client[r['client__name']] += r['total']
+    return {
+        'total': total,
+        'count': count,
+        'avg': total / count if count else None,
+        'unpaid_sum': unpaid_sum,
+        'unpaid_count': unpaid_count,
+        'points': [(month, float(value)) for month, value in monthly.items()],
+        'by_client': sorted(by_client.items(), key=lambda x: x[1], reverse=True),
+    }
+
+
+def owner_rollup_summary(owner):
+    """
+    Everything the dashboard needs from the rollup table in a single query:
+    totals, monthly points (as for forecast.monthly_points) and totals per client.
+    """
+    return _summarize(_summary_rows(owner))
+
+
+def monthly_points_for_owner(owner_id):
+    """Same as forecast.monthly_points over the owner's invoices, read from the rollup table."""
+    monthly = (
+        MonthlyRollup.objects.filter(owner_id=owner_id)
+        .values('month')
+        .annotate(total=Sum('total'))
+        .order_by('month')
+    )
+    return [(r['month'], float(r['total'] or 0)) for r in monthly if r['total']]
+
+
+def invoice_count_for_owner(owner_id):
+    """Number of the owner's invoices from the rollup table, without counting core_invoice rows."""
+    return MonthlyRollup.objects.filter(owner_id=owner_id).aggregate(n=Sum('count'))['n'] or 0
+
+
+async def ainvoice_count_for_owner(owner_id):
+    return (await MonthlyRollup.objects.filter(owner_id=owner_id).aaggregate(n=Sum('count')))['n'] or 0
@@ -0,0 +1,266 @@
+# core/utils/search.py
+# Полнотекстовый поиск по инвойсам: название проекта, клиент, external_id, описание.
+# SQLite -- виртуальная таблица FTS5, PostgreSQL -- таблица с tsvector и GIN-индексом.
+# Обе поддерживаются триггерами в самой базе, поэтому bulk_create в импорте,
+# update() и правки проектов/клиентов попадают в индекс без кода на Python.
+# SQLite при AlterField пересоздаёт core_invoice и теряет триггеры -- после каждого
+# migrate их наличие проверяет ensure_search_triggers (см. core.apps).
+import re
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+SQLITE_TABLE = 'core_invoice_fts'
+POSTGRES_TABLE = 'core_invoice_search'
+
+# поля с весами: совпадение в названии проекта/клиенте важнее, чем в описании
+SQLITE_DDL = [
+    f"""CREATE VIRTUAL TABLE {SQLITE_TABLE} USING fts5(
+        title, client, external_id, description, owner_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+    f"INSERT INTO {SQLITE_TABLE} ({SQLITE_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 10.0, 5.0, 1.0, 0.0)')",
+    f"""CREATE TRIGGER {SQLITE_TABLE}_ai AFTER INSERT ON core_invoice BEGIN
+        INSERT INTO {SQLITE_TABLE} (rowid, title, client, external_id, description, owner_id)
+        SELECT NEW.id, COALESCE(p.title, ''), COALESCE(c.name, ''), NEW.external_id, NEW.description, NEW.owner_id
+        FROM (SELECT NEW.project_id AS project_id) AS i
+        LEFT JOIN core_project p ON p.id = i.project_id
+        LEFT JOIN core_client c ON c.id = p.client_id;
+    END""",
+    f"""CREATE TRIGGER {SQLITE_TABLE}_au AFTER UPDATE ON core_invoice
+    WHEN OLD.project_id IS NOT NEW.project_id OR OLD.external_id IS NOT NEW.external_id
+        OR OLD.description IS NOT NEW.description OR OLD.owner_id IS NOT NEW.owner_id
+    BEGIN
+        DELETE FROM {SQLITE_TABLE} WHERE rowid = OLD.id;
+        INSERT INTO {SQLITE_TABLE} (rowid, title, client, external_id, description, owner_id)
+        SELECT NEW.id, COALESCE(p.title, ''), COALESCE(c.name, ''), NEW.external_id, NEW.description, NEW.owner_id
+        FROM (SELECT NEW.project_id AS project_id) AS i
+        LEFT JOIN core_project p ON p.id = i.project_id
+        LEFT JOIN core_client c ON c.id = p.client_id;
+    END""",
+    f"""CREATE TRIGGER {SQLITE_TABLE}_ad AFTER DELETE ON core_invoice BEGIN
+        DELETE FROM {SQLITE_TABLE} WHERE rowid = OLD.id;
+    END""",
+    f"""CREATE TRIGGER {SQLITE_TABLE}_project_au AFTER UPDATE ON core_project
+    WHEN OLD.title IS NOT NEW.title OR OLD.client_id IS NOT NEW.client_id
+    BEGIN
+        UPDATE {SQLITE_TABLE}
+        SET title = NEW.title, client = COALESCE((SELECT name FROM core_client WHERE id = NEW.client_id), '')
+        WHERE rowid IN (SELECT id FROM core_invoice WHERE project_id = NEW.id);
+    END""",
+    f"""CREATE TRIGGER {SQLITE_TABLE}_client_au AFTER UPDATE ON core_client
+    WHEN OLD.name IS NOT NEW.name
+    BEGIN
+        UPDATE {SQLITE_TABLE} SET client = NEW.name
+        WHERE rowid IN (SELECT i.id FROM core_invoice i JOIN core_project p ON p.id = i.project_id
+                        WHERE p.client_id = NEW.id);
+    END""",
+]
+
+SQLITE_TRIGGERS = [
+    f'{SQLITE_TABLE}_ai', f'{SQLITE_TABLE}_au', f'{SQLITE_TABLE}_ad',
+    f'{SQLITE_TABLE}_project_au', f'{SQLITE_TABLE}_client_au',
+]
+
+SQLITE_DROP = [
+    f"DROP TRIGGER IF EXISTS {SQLITE_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {SQLITE_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {SQLITE_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {SQLITE_TABLE}_project_au",
+    f"DROP TRIGGER IF EXISTS {SQLITE_TABLE}_client_au",
+    f"DROP TABLE IF EXISTS {SQLITE_TABLE}",
+]
+
+SQLITE_POPULATE = [
+    f"DELETE FROM {SQLITE_TABLE}",
+    f"""INSERT INTO {SQLITE_TABLE} (rowid, title, client, external_id, description, owner_id)
+        SELECT i.id, COALESCE(p.title, ''), COALESCE(c.name, ''), i.external_id, i.description, i.owner_id
+        FROM core_invoice i
+        LEFT JOIN core_project p ON p.id = i.project_id
+        LEFT JOIN core_client c ON c.id = p.client_id""",
+    f"INSERT INTO {SQLITE_TABLE} ({SQLITE_TABLE}) VALUES ('optimize')",
+]
+
+POSTGRES_DDL = [
+    f"""CREATE TABLE {POSTGRES_TABLE} (
+        invoice_id bigint PRIMARY KEY REFERENCES core_invoice (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        owner_id bigint NOT NULL,
+        document tsvector NOT NULL
+    )""",
+    f"CREATE INDEX {POSTGRES_TABLE}_document ON {POSTGRES_TABLE} USING gin (document)",
+    f"""CREATE FUNCTION {POSTGRES_TABLE}_refresh() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO {POSTGRES_TABLE} (invoice_id, owner_id, document)
+        SELECT NEW.id, NEW.owner_id,
+               setweight(to_tsvector('simple', coalesce(p.title, '')), 'A')
+               || setweight(to_tsvector('simple', coalesce(c.name, '')), 'A')
+               || setweight(to_tsvector('simple', NEW.external_id), 'B')
+               || setweight(to_tsvector('simple', NEW.description), 'C')
+        FROM (SELECT NEW.project_id AS project_id) AS i
+        LEFT JOIN core_project p ON p.id = i.project_id
+        LEFT JOIN core_client c ON c.id = p.client_id
+        ON CONFLICT (invoice_id) DO UPDATE SET owner_id = EXCLUDED.owner_id, document = EXCLUDED.document;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    f"""CREATE TRIGGER {POSTGRES_TABLE}_invoice AFTER INSERT OR UPDATE OF project_id, external_id, description, owner_id
+        ON core_invoice FOR EACH ROW EXECUTE FUNCTION {POSTGRES_TABLE}_refresh()""",
+    # переименование проекта/клиента: "трогаем" project_id инвойсов, их триггер пересчитает документ
+    f"""CREATE FUNCTION {POSTGRES_TABLE}_touch_project() RETURNS trigger AS $$
+    BEGIN
+        UPDATE core_invoice SET project_id = project_id WHERE project_id = NEW.id;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    f"""CREATE TRIGGER {POSTGRES_TABLE}_project AFTER UPDATE OF title, client_id ON core_project
+        FOR EACH ROW WHEN (OLD.title IS DISTINCT FROM NEW.title OR OLD.client_id IS DISTINCT FROM NEW.client_id)
+        EXECUTE FUNCTION {POSTGRES_TABLE}_touch_project()""",
+    f"""CREATE FUNCTION {POSTGRES_TABLE}_touch_client() RETURNS trigger AS $$
+    BEGIN
+        UPDATE core_invoice SET project_id = project_id
+        WHERE project_id IN (SELECT id FROM core_project WHERE client_id = NEW.id);
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    f"""CREATE TRIGGER {POSTGRES_TABLE}_client AFTER UPDATE OF name ON core_client
+        FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+        EXECUTE FUNCTION {POSTGRES_TABLE}_touch_client()""",
+]
+
+POSTGRES_DROP = [
+    f"DROP TRIGGER IF EXISTS {POSTGRES_TABLE}_invoice ON core_invoice",
+    f"DROP TRIGGER IF EXISTS {POSTGRES_TABLE}_project ON core_project",
+    f"DROP TRIGGER IF EXISTS {POSTGRES_TABLE}_client ON core_client",
+    f"DROP FUNCTION IF EXISTS {POSTGRES_TABLE}_refresh()",
+    f"DROP FUNCTION IF EXISTS {POSTGRES_TABLE}_touch_project()",
+    f"DROP FUNCTION IF EXISTS {POSTGRES_TABLE}_touch_client()",
+    f"DROP TABLE IF EXISTS {POSTGRES_TABLE}",
+]
+
+POSTGRES_POPULATE = [
+    f"TRUNCATE {POSTGRES_TABLE}",
+    "UPDATE core_invoice SET project_id = project_id",
+]
+
+_backends = {}
+
+
+def sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if cursor.fetchone()[0]:
+            return True
+        # в некоторых сборках FTS5 загружается как встроенное расширение без compile option
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+            cursor.execute("DROP TABLE temp.fts5_probe")
+        except Exception:
+            return False
+        return True
+
+
+def install_search_index(connection, populate=True):
+    """Create (or re-create) the search table and triggers. Returns the backend name or None."""
+    if connection.vendor == 'sqlite' and sqlite_has_fts5(connection):
+        statements = SQLITE_DROP + SQLITE_DDL + (SQLITE_POPULATE if populate else [])
+        backend = 'sqlite'
+    elif connection.vendor == 'postgresql':
+        statements = POSTGRES_DROP + POSTGRES_DDL + (POSTGRES_POPULATE if populate else [])
+        backend = 'postgresql'
+    else:
+        return None
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+    _backends.pop((connection.alias, str(connection.settings_dict['NAME'])), None)
+    return backend
+
+
+def uninstall_search_index(connection):
+    statements = {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+    _backends.pop((connection.alias, str(connection.settings_dict['NAME'])), None)
+
+
+def ensure_search_triggers(connection):
+    """
+    Re-create and refill the SQLite search index if its table exists but some of
+    its triggers are gone (a table rebuild in a migration drops them). Returns True
+    if the index was rebuilt.
+    """
+    if connection.vendor != 'sqlite' or SQLITE_TABLE not in connection.introspection.table_names():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+                       [f'{SQLITE_TABLE}_%'])
+        existing = {row[0] for row in cursor.fetchall()}
+    if existing >= set(SQLITE_TRIGGERS):
+        return False
+    install_search_index(connection)
+    return True
+
+
+def search_backend(using='default'):
+    """'sqlite', 'postgresql' or None when the index is not installed (then search falls back to icontains)."""
+    connection = connections[using]
+    key = (using, str(connection.settings_dict['NAME']))
+    if key not in _backends:
+        tables = set(connection.introspection.table_names())
+        if connection.vendor == 'sqlite' and SQLITE_TABLE in tables:
+            _backends[key] = 'sqlite'
+        elif connection.vendor == 'postgresql' and POSTGRES_TABLE in tables:
+            _backends[key] = 'postgresql'
+        else:
+            _backends[key] = None
+    return _backends[key]
+
+
+def search_terms(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def icontains_filter(text):
+    return (
+        Q(project__title__icontains=text) |
+        Q(project__client__name__icontains=text) |
+        Q(external_id__icontains=text) |
+        Q(description__icontains=text)
+    )
+
+
+def search_invoices(qs, text, owner_id):
+    """
+    Filter ``qs`` to the owner's invoices matching ``text``. Every word must match,
+    the last ones as a prefix too, so as-you-type queries work ("acm sit" finds
+    "ACME / Site"). The result is annotated with ``search_rank`` (higher is more relevant).
+    """
+    terms = search_terms(text)
+    backend = search_backend(qs.db)
+    if not terms or backend is None:
+        return qs.filter(icontains_filter(text)).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    # поисковая таблица присоединяется к запросу по id: MATCH выполняется один раз на весь
+    # запрос, а ранг берётся из той же строки, без подзапроса на каждый инвойс
+    if backend == 'sqlite':
+        match = ' '.join(f'"{t}"*' for t in terms)
+        qs = qs.extra(
+            tables=[SQLITE_TABLE],
+            # "+" не даёт планировщику искать по rowid в FTS-таблице: иначе (например, в COUNT)
+            # он перебирает инвойсы и выполняет MATCH заново для каждого
+            where=[f'"core_invoice"."id" = +"{SQLITE_TABLE}".rowid', f'"{SQLITE_TABLE}" MATCH %s',
+                   f'"{SQLITE_TABLE}".owner_id = %s'],
+            params=[match, owner_id],
+        )
+        # rank в FTS5 -- bm25 с весами колонок, чем меньше, тем лучше
+        rank = RawSQL(f'-"{SQLITE_TABLE}".rank', [], output_field=FloatField())
+    else:
+        match = ' & '.join(f"{t}:*" for t in terms)
+        qs = qs.extra(
+            tables=[POSTGRES_TABLE],
+            where=[f'"{POSTGRES_TABLE}".invoice_id = "core_invoice"."id"',
+                   f""""{POSTGRES_TABLE}".document @@ to_tsquery('simple', %s)""", f'"{POSTGRES_TABLE}".owner_id = %s'],
+            params=[match, owner_id],
+        )
+        rank = RawSQL(f"""ts_rank("{POSTGRES_TABLE}".document, to_tsquery('simple', %s))""", [match],
+                      output_field=FloatField())
+    return qs.annotate(search_rank=rank)
@@ -0,0 +1,83 @@
+# core/utils/statuses.py
+# Статусы инвойсов (overdue/paid/sent) пересчитываются пачками по id: каждая пачка --
+# своя короткая транзакция, и читатели SQLite не ждут один UPDATE на всю таблицу.
+import time
+from django.db import transaction
+from django.db.models import Case, Max, Value, When
+from django.utils import timezone
+
+from core.models import STATUS_UNSYNCED, Invoice, InvoiceStatusWatermark
+
+BATCH_SIZE = 1000
+
+
+def status_passes(today, watermark=None, max_id=None):
+    """
+    (name, queryset, new status) for every transition. With a ``watermark`` the
+    overdue passes only look at invoices that fell due or were added since that run.
+    """
+    unpaid = Invoice.objects.filter(paid=False)
+    overdue = unpaid.filter(date__lt=today).exclude(status='overdue')
+    if watermark is None:
+        newly_due = [('overdue', overdue, 'overdue')]
+    else:
+        newly_due = [
+            ('overdue', overdue.filter(date__gte=watermark.date), 'overdue'),
+            # добавленные после прошлого запуска задним числом
+            ('overdue (new)', overdue.filter(pk__gt=watermark.last_invoice_id, pk__lte=max_id), 'overdue'),
+        ]
+    return newly_due + [
+        # оплатили или сняли оплату
+        ('paid', Invoice.objects.filter(STATUS_UNSYNCED), Case(
+            When(paid=True, then=Value('paid')),
+            When(date__lt=today, then=Value('overdue')),
+            default=Value('sent'),
+        )),
+        # срок перенесли вперёд
+        ('not due', unpaid.filter(date__gte=today, status='overdue'), 'sent'),
+    ]
+
+
+def update_in_batches(qs, status, batch_size=BATCH_SIZE, sleep=0):
+    """
+    Set ``status`` on the rows of ``qs`` batch by batch in primary key order.
+    Yields (rows updated, seconds) for every batch.
+    """
+    last_id = 0
+    while True:
+        started = time.monotonic()
+        with transaction.atomic():
+            ids = list(qs.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return
+            # условия qs повторяются: строку могли изменить между выборкой и UPDATE
+            updated = qs.filter(pk__in=ids).update(status=status)
+        last_id = ids[-1]
+        yield updated, time.monotonic() - started
+        if sleep:
+            time.sleep(sleep)
+
+
+def update_invoice_statuses(today=None, batch_size=BATCH_SIZE, sleep=0, full=False, on_batch=None):
+    """
+    Bring Invoice.status in line with ``paid`` and the due date for all users:
+    overdue when unpaid and past due, paid when paid, sent when unpaid and not due yet.
+    Unless ``full``, only invoices that fell due or were added since the last run are
+    checked for becoming overdue. ``on_batch(name, number, updated, seconds)`` is called
+    after every batch. Returns {pass name: rows updated}.
+    """
+    today = today or timezone.localdate()
+    watermark = None if full else InvoiceStatusWatermark.objects.first()
+    # id берём до проходов: добавленные во время запуска проверит следующий
+    max_id = Invoice.objects.aggregate(m=Max('pk'))['m'] or 0
+
+    totals = {}
+    for name, qs, status in status_passes(today, watermark, max_id):
+        totals[name] = 0
+        for number, (updated, seconds) in enumerate(update_in_batches(qs, status, batch_size, sleep), 1):
+            totals[name] += updated
+            if on_batch:
+                on_batch(name, number, updated, seconds)
+
+    InvoiceStatusWatermark.objects.update_or_create(pk=1, defaults={'date': today, 'last_invoice_id': max_id})
+    return totals
@@ -0,0 +1,110 @@
+# core/utils/uploads.py
+# Загруженные CSV между превью и подтверждением импорта лежат во временных файлах
+# на диске (по токену), а не в сессии: в django_session не пишутся мегабайты.
+import csv
+import itertools
+import os
+import re
+import secrets
+import time
+from django.conf import settings
+from django.core.files.move import file_move_safe
+
+from core.models import ImportJob
+from core.utils.importer import REQUIRED_COLUMNS
+
+# превью читает только первые строки файла
+PREVIEW_ROWS = 50
+
+_TOKEN_RE = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+def upload_root():
+    return getattr(settings, 'UPLOAD_ROOT', os.path.join(settings.BASE_DIR, 'uploads'))
+
+
+def _path(owner_id, token):
+    return os.path.join(upload_root(), str(owner_id), f'{token}.csv')
+
+
+def spool_upload(uploaded_file, owner_id):
+    """
+    Store an uploaded file for a later import and return its token. A file that
+    Django already spooled to a temporary file is moved, not copied.
+    """
+    token = secrets.token_urlsafe(24)
+    path = _path(owner_id, token)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        # закрытие NamedTemporaryFile удаляет файл -- сначала переносим, потом закрываем
+        file_move_safe(uploaded_file.temporary_file_path(), path)
+        uploaded_file.close()
+    else:
+        with open(path, 'wb') as out:
+            for chunk in uploaded_file.chunks():
+                out.write(chunk)
+    return token
+
+
+def spooled_path(owner_id, token):
+    """Path of the owner's spooled upload, or None for an unknown/expired token."""
+    if not token or not _TOKEN_RE.match(token):
+        return None
+    path = _path(owner_id, token)
+    return path if os.path.exists(path) else None
+
+
+def discard_upload(owner_id, token):
+    path = spooled_path(owner_id, token)
+    if path:
+        os.remove(path)
+
+
+def cleanup_uploads(max_age=None):
+    """
+    Remove spooled uploads older than UPLOAD_MAX_AGE seconds (abandoned previews),
+    except files of imports that are still queued or running. Returns the count.
+    """
+    max_age = max_age if max_age is not None else getattr(settings, 'UPLOAD_MAX_AGE', 60 * 60)
+    root = upload_root()
+    if not os.path.isdir(root):
+        return 0
+    in_use = set(ImportJob.objects.filter(status__in=['pending', 'running']).values_list('path', flat=True))
+    removed = 0
+    deadline = time.time() - max_age
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if path in in_use:
+                continue
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def preview_csv(path, max_rows=PREVIEW_ROWS):
+    """
+    Header and the first ``max_rows`` rows of a CSV file, reading only as much of it as needed.
+    Returns a dict with header, rows, has_more, missing (required columns) and error.
+    """
+    result = {'header': [], 'rows': [], 'has_more': False, 'missing': [], 'error': None}
+    with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        reader = csv.reader(f)
+        try:
+            head = list(itertools.islice(reader, max_rows + 2))
+        except csv.Error as e:
+            result['error'] = f"Line {reader.line_num}: {e}"
+            return result
+    if not head:
+        result['error'] = 'File is empty'
+        return result
+    result['header'] = head[0]
+    result['rows'] = head[1:max_rows + 1]
+    result['has_more'] = len(head) > max_rows + 1
+    # как в импорте: имена колонок сравниваются как есть
+    result['missing'] = sorted(REQUIRED_COLUMNS - set(head[0]))
+    return result
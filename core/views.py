@@ -1,73 +1,120 @@
 from django.views.generic import ListView, CreateView, TemplateView, FormView, View
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.forms import UserCreationForm
-from django.shortcuts import render, redirect
-from django.http import HttpResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.db import transaction
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
 from django.contrib.auth import login
-import csv
+import asyncio
+import os
+from asgiref.sync import sync_to_async
 from datetime import date
 from django.http import JsonResponse
 from django.db.models import Sum, Avg, Count, Q
 from .forms import InvoiceForm, CSVUploadForm
-from .utils.importer import import_invoices_from_file
+from .utils.importer import import_job_stats, start_import_job
 from django.db.models.functions import TruncMonth
 from django.views.generic import TemplateView
 from django.shortcuts import render
 from django.db.models import Sum, Avg, Count, Q
 from django.db.models.functions import TruncMonth
-from .models import Invoice
-from .utils.forecast import forecast_monthly
+from .models import ExportJob, ImportJob, Invoice
+from .utils.cache import aget_cached_forecast, get_cached_forecast, get_cached_search, set_cached_search
+from .utils.rollup import ainvoice_count_for_owner, invoice_count_for_owner, owner_rollup_summary
+from .utils.pagination import InvalidCursor, akeyset_page, keyset_page
+from .utils.filters import InvalidQuery, compile_invoice_query
+from .utils.uploads import PREVIEW_ROWS, discard_upload, preview_csv, spool_upload, spooled_path
+from .utils.api import INVOICE_API_KEYS, aiter_ndjson, invoice_api_rows, iter_ndjson, json_response, row_key
+from .utils.export import EXPORT_FORMATS, iter_invoice_csv_rows, request_export
+from .utils import metrics
+
+def invoice_total(request, qs, compiled):
+    """
+    Total for the paginated list: exact COUNT(*) only when asked with ?count=1,
+    free from the rollup table when nothing is filtered, otherwise unknown (None).
+    """
+    if request.GET.get('count') in ('1', 'true'):
+        return qs.count()
+    if not compiled.filtered:
+        return invoice_count_for_owner(request.user.pk)
+    return None
+
+
+async def ainvoice_total(request, qs, compiled):
+    if request.GET.get('count') in ('1', 'true'):
+        return await qs.acount()
+    if not compiled.filtered:
+        return await ainvoice_count_for_owner(request.user.pk)
+    return None
+
 
 class InvoiceListView(LoginRequiredMixin, ListView):
     model = Invoice
     template_name = 'core/invoice_list.html'
-    paginate_by = 20
+    page_size = 20
 
     def get_queryset(self):
+        # в HTML-списке плохие параметры просто игнорируются, API отвечает на них 400
+        self.compiled = compile_invoice_query(self.request.GET, strict=False)
         qs = Invoice.objects.filter(owner=self.request.user).select_related('project', 'category', 'project__client')
-        q = self.request.GET
-
-        search = q.get('q')
-        if search:
-            qs = qs.filter(
-                Q(project__title__icontains=search) |
-                Q(project__client__name__icontains=search) |
-                Q(external_id__icontains=search) |
-                Q(description__icontains=search)
-            )
+        return self.compiled.apply(qs, self.request.user.pk)
 
-        client = q.get('client')
-        if client:
-            qs = qs.filter(project__client__id=client)
+    def get_ordering(self):
+        return self.compiled.ordering
 
-        project = q.get('project')
-        if project:
-            qs = qs.filter(project__id=project)
+    def is_fragment(self):
+        return self.request.headers.get('X-Requested-With') == 'XMLHttpRequest'
 
-        category = q.get('category')
-        if category:
-            qs = qs.filter(category__id=category)
+    def get_template_names(self):
+        # живой поиск получает только таблицу и навигацию, без layout
+        if self.is_fragment():
+            return ['core/invoice_list_results.html']
+        return super().get_template_names()
 
-        paid = q.get('paid')
-        if paid in ('1', '0', 'true', 'false', 'True', 'False'):
-            if paid.lower() in ('1', 'true'):
-                qs = qs.filter(paid=True)
-            else:
-                qs = qs.filter(paid=False)
+    def get(self, request, *args, **kwargs):
+        response = self.render_fragment() if self.is_fragment() else self.render_page()
+        # по одному URL отдаётся и страница, и фрагмент
+        patch_vary_headers(response, ['X-Requested-With'])
+        return response
 
-        date_from = q.get('date_from')
-        date_to = q.get('date_to')
-        if date_from:
-            qs = qs.filter(date__gte=date_from)
-        if date_to:
-            qs = qs.filter(date__lte=date_to)
+    def render_fragment(self):
+        """Rendered results fragment, cached per user, data version and query string."""
+        params = self.request.GET.copy()
+        params['q'] = params.get('q', '').strip()
+        key = '&'.join(sorted(params.urlencode().split('&')))
+        content = get_cached_search(self.request.user.pk, key)
+        if content is not None:
+            return HttpResponse(content)
+        response = self.render_page()
+        response.render()
+        set_cached_search(self.request.user.pk, key, response.content)
+        return response
 
-        order = q.get('order', '-date')  # default: newest first
-        qs = qs.order_by(order)
-        return qs
+    def render_page(self):
+        request = self.request
+        self.object_list = self.get_queryset()
+        try:
+            self.page = keyset_page(self.object_list, self.get_ordering(), request.GET.get('cursor'), self.page_size)
+        except InvalidCursor:
+            # курсор от другой сортировки или испорченный -- показываем первую страницу
+            self.page = keyset_page(self.object_list, self.get_ordering(), None, self.page_size)
+        return self.render_to_response(self.get_context_data(object_list=self.page.items))
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['page'] = self.page
+        ctx['total'] = invoice_total(self.request, self.object_list, self.compiled)
+        params = self.request.GET.copy()
+        for name, cursor in (('next_url', self.page.next_cursor), ('prev_url', self.page.prev_cursor)):
+            if cursor:
+                params['cursor'] = cursor
+                ctx[name] = '?' + params.urlencode()
+        return ctx
 
 
 class InvoiceCreateView(LoginRequiredMixin, CreateView):
@@ -78,51 +125,54 @@ class InvoiceCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.owner = self.request.user
+        external_id = form.cleaned_data.get('external_id')
+        if external_id and Invoice.objects.filter(owner=self.request.user, external_id=external_id).exists():
+            form.add_error('external_id', 'Invoice with this external id already exists')
+            return self.form_invalid(form)
         return super().form_valid(form)
 
 
 class DashboardView(LoginRequiredMixin, TemplateView):
     template_name = 'core/dashboard.html'
+    # запросов к БД на сбор данных, когда прогноз уже в кэше:
+    # сводка MonthlyRollup и агрегат просроченных
+    query_budget = 2
+
+    def overdue_invoices(self, user):
+        # просрочка считается по дням, поэтому по самим инвойсам
+        return Invoice.objects.filter(owner=user, paid=False, date__lt=date.today())
+
+    def overdue_aggregates(self):
+        return {'overdue_sum': Sum('amount'), 'overdue_count': Count('id')}
+
+    def dashboard_queries(self, user):
+        # суммы, помесячный ряд и разбивка по клиентам -- из сводной таблицы,
+        # её размер зависит от числа месяцев, а не инвойсов
+        summary = owner_rollup_summary(user)
+        return summary, self.overdue_invoices(user).aggregate(**self.overdue_aggregates())
+
+    def get_dashboard_data(self, user):
+        summary, overdue_agg = self.dashboard_queries(user)
+        forecast_dict = get_cached_forecast(user, months_ahead=6, points=summary['points'])
+        return self.dashboard_context(summary, overdue_agg, forecast_dict)
+
+    def dashboard_context(self, summary, overdue_agg, forecast_dict):
+        points = summary['points']
+        best = max(points, key=lambda p: p[1], default=None)
+        best_month = best[0].strftime('%Y-%m') if best else None
 
-    def get(self, request, *args, **kwargs):
-        user = request.user
-        invoices = Invoice.objects.filter(owner=user)
-
-        agg = invoices.aggregate(
-            total=Sum('amount'),
-            avg=Avg('amount'),
-            count=Count('id'),
-            unpaid_count=Count('id', filter=Q(paid=False)),
-            unpaid_sum=Sum('amount', filter=Q(paid=False)),
-        )
-
-        today = date.today()
-        overdue_agg = invoices.filter(paid=False, date__lt=today).aggregate(
-            overdue_sum=Sum('amount'),
-            overdue_count=Count('id')
-        )
-
-        best = invoices.annotate(month=TruncMonth('date')) \
-            .values('month') \
-            .annotate(total=Sum('amount')) \
-            .order_by('-total') \
-            .first()
-        best_month = best['month'].strftime('%Y-%m') if best and best.get('month') else None
-
-        forecast_dict = forecast_monthly(invoices, months_ahead=6)
         historic_data = forecast_dict.get('historic', []) or []
         forecast_data = forecast_dict.get('forecast', []) or []
 
-        by_client = invoices.values('project__client__name').annotate(total=Sum('amount')).order_by('-total')
-        client_labels = [x['project__client__name'] or 'Unknown' for x in by_client]
-        client_values = [float(x['total'] or 0) for x in by_client]
+        client_labels = [name or 'Unknown' for name, _ in summary['by_client']]
+        client_values = [float(total or 0) for _, total in summary['by_client']]
 
-        context = {
-            'total_income': float(agg['total'] or 0),
-            'avg_amount': float(agg['avg'] or 0),
-            'count': int(agg['count'] or 0),
-            'unpaid_count': int(agg['unpaid_count'] or 0),
-            'unpaid_sum': float(agg['unpaid_sum'] or 0),
+        return {
+            'total_income': float(summary['total'] or 0),
+            'avg_amount': float(summary['avg'] or 0),
+            'count': int(summary['count'] or 0),
+            'unpaid_count': int(summary['unpaid_count'] or 0),
+            'unpaid_sum': float(summary['unpaid_sum'] or 0),
             'overdue_sum': float(overdue_agg.get('overdue_sum') or 0),
             'overdue_count': int(overdue_agg.get('overdue_count') or 0),
             'best_month': best_month,
@@ -131,7 +181,41 @@ class DashboardView(LoginRequiredMixin, TemplateView):
             'client_labels': client_labels,
             'client_values': client_values,
         }
-        return render(request, self.template_name, context)
+
+    def get(self, request, *args, **kwargs):
+        return render(request, self.template_name, self.get_dashboard_data(request.user))
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """
+    LoginRequiredMixin for async views: the user is loaded with the async auth API
+    first, so neither the check nor the templates touch the DB from the event loop.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        response = super().dispatch(request, *args, **kwargs)
+        # без входа LoginRequiredMixin сразу отдаёт редирект, а не корутину
+        return await response if asyncio.iscoroutine(response) else response
+
+
+class AsyncDashboardView(AsyncLoginRequiredMixin, DashboardView):
+    """
+    DashboardView for ASGI servers (ASYNC_VIEWS = True). The rollup summary and the
+    overdue aggregate run one after the other in a single sync_to_async call, off the
+    event loop, and a forecast that is not cached yet is fitted in the bounded CPU
+    pool (FORECAST_WORKERS), so one process keeps serving other requests meanwhile.
+    """
+
+    async def get_dashboard_data(self, user):
+        # async ORM выполняет запросы в одном потоке по очереди, gather их не распараллелил бы --
+        # поэтому оба запроса одним переходом в синхронный поток
+        summary, overdue_agg = await sync_to_async(self.dashboard_queries)(user)
+        forecast_dict = await aget_cached_forecast(user, months_ahead=6, points=summary['points'])
+        return self.dashboard_context(summary, overdue_agg, forecast_dict)
+
+    async def get(self, request, *args, **kwargs):
+        return render(request, self.template_name, await self.get_dashboard_data(request.user))
 
 
 class CSVUploadView(LoginRequiredMixin, FormView):
@@ -140,52 +224,147 @@ class CSVUploadView(LoginRequiredMixin, FormView):
     success_url = reverse_lazy('core:invoice_upload')
 
     def form_valid(self, form):
+        # импорт идёт в фоне, страница загрузки опрашивает прогресс задачи
         uploaded_file = form.cleaned_data['file']
-        result = import_invoices_from_file(uploaded_file, owner=self.request.user)
-        self.request.session['import_result'] = result
-        return super().form_valid(form)
+        token = spool_upload(uploaded_file, self.request.user.pk)
+        job = start_import_job(self.request.user, spooled_path(self.request.user.pk, token), uploaded_file.name)
+        return import_job_redirect(job)
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         result = self.request.session.pop('import_result', None)
         ctx['import_result'] = result
+        job_id = self.request.GET.get('job')
+        if job_id and job_id.isdigit():
+            ctx['import_job'] = ImportJob.objects.filter(pk=job_id, owner=self.request.user).first()
         return ctx
 
+
+def import_job_redirect(job):
+    return redirect(f"{reverse('core:invoice_upload')}?job={job.pk}")
+
+
+def import_job_data(job):
+    data = {
+        'id': job.pk,
+        'filename': job.filename,
+        'status': job.status,
+        'rows': job.rows,
+        'created': job.created,
+        'skipped': job.skipped,
+        'errors': job.errors,
+        'error_lines': job.error_lines,
+        'error': job.error,
+        'line': job.line,
+    }
+    data.update(import_job_stats(job))
+    return data
+
+
+class ImportJobStatusView(LoginRequiredMixin, View):
+    def get(self, request, pk, *args, **kwargs):
+        job = get_object_or_404(ImportJob, pk=pk, owner=request.user)
+        return JsonResponse(import_job_data(job))
+
 class CSVPreviewView(LoginRequiredMixin, FormView):
+    """Spool the upload to disk and show its first rows; the import is confirmed separately."""
     template_name = 'core/upload_preview.html'
     form_class = CSVUploadForm
 
+    def get(self, request, *args, **kwargs):
+        return redirect('core:invoice_upload')
+
+    def form_invalid(self, form):
+        return render(self.request, 'core/upload.html', {'form': form})
+
     def form_valid(self, form):
         f = form.cleaned_data['file']
-        decoded = f.read().decode('utf-8').splitlines()
-        reader = csv.reader(decoded)
-        rows = list(reader)[:50]
-        self.request.session['csv_preview'] = f.read().decode('utf-8')  # or better: store bytes
-        return render(self.request, 'core/upload_preview.html', {'rows': rows, 'form': form})
+        token = spool_upload(f, self.request.user.pk)
+        preview = preview_csv(spooled_path(self.request.user.pk, token))
+        return render(self.request, self.template_name, {
+            'form': form,
+            'token': token,
+            'filename': f.name,
+            'size': f.size,
+            'preview': preview,
+            'max_rows': PREVIEW_ROWS,
+        })
+
+
+class CSVConfirmImportView(LoginRequiredMixin, View):
+    """POST token: start a background import of the spooled file or drop it with ``cancel``."""
+
+    def post(self, request, *args, **kwargs):
+        token = request.POST.get('token')
+        if 'cancel' in request.POST:
+            discard_upload(request.user.pk, token)
+            return redirect('core:invoice_upload')
+
+        path = spooled_path(request.user.pk, token)
+        if path is None:
+            request.session['import_result'] = {
+                'created': 0, 'skipped': 0, 'errors': ['Uploaded file expired, please upload it again'],
+            }
+            return redirect('core:invoice_upload')
+        job = start_import_job(request.user, path, request.POST.get('filename') or os.path.basename(path))
+        return import_job_redirect(job)
 
 
 class ExportInvoicesCSVView(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
-        invoices = Invoice.objects.filter(owner=request.user).select_related('project', 'category')
-        response = HttpResponse(content_type='text/csv')
+        invoices = Invoice.objects.filter(owner=request.user)
+        response = StreamingHttpResponse(iter_invoice_csv_rows(invoices), content_type='text/csv')
         fname = f"invoices_{request.user.username}_{timezone.now().date()}.csv"
         response['Content-Disposition'] = f'attachment; filename="{fname}"'
-        writer = csv.writer(response)
-        writer.writerow(['date', 'amount', 'client', 'project', 'category', 'paid', 'external_id', 'description'])
-        for inv in invoices:
-            writer.writerow([
-                inv.date.isoformat(),
-                f"{inv.amount}",
-                inv.project.client.name if inv.project and inv.project.client else '',
-                inv.project.title if inv.project else '',
-                inv.category.name if inv.category else '',
-                'True' if inv.paid else 'False',
-                inv.external_id,
-                inv.description or '',
-            ])
         return response
 
 
+def export_job_data(job):
+    data = {
+        'id': job.pk,
+        'format': job.format,
+        'status': job.status,
+        'rows': job.rows,
+        'size': job.size,
+        'error': job.error,
+        'status_url': reverse('core:export_job_status', args=[job.pk]),
+        'download_url': None,
+    }
+    if job.status == 'done':
+        data['download_url'] = reverse('core:export_job_download', args=[job.pk])
+    return data
+
+
+class ExportJobCreateView(LoginRequiredMixin, View):
+    """POST: queue a background export (or reuse a file made from the same data)."""
+
+    def post(self, request, *args, **kwargs):
+        fmt = request.POST.get('format', 'csv')
+        try:
+            job = request_export(request.user, fmt)
+        except ValueError as e:
+            return JsonResponse({'error': str(e), 'formats': list(EXPORT_FORMATS)}, status=400)
+        return JsonResponse(export_job_data(job), status=200 if job.status == 'done' else 202)
+
+
+class ExportJobStatusView(LoginRequiredMixin, View):
+    def get(self, request, pk, *args, **kwargs):
+        job = get_object_or_404(ExportJob, pk=pk, owner=request.user)
+        return JsonResponse(export_job_data(job))
+
+
+class ExportJobDownloadView(LoginRequiredMixin, View):
+    def get(self, request, pk, *args, **kwargs):
+        job = get_object_or_404(ExportJob, pk=pk, owner=request.user, status='done')
+        try:
+            f = open(job.path, 'rb')
+        except FileNotFoundError:
+            raise Http404('Export file was removed, request a new export')
+        ExportJob.objects.filter(pk=job.pk).update(last_accessed_at=timezone.now())
+        fname = f"invoices_{request.user.username}_{job.finished_at.date()}.{EXPORT_FORMATS[job.format]}"
+        return FileResponse(f, as_attachment=True, filename=fname)
+
+
 class SignUpView(CreateView):
     form_class = UserCreationForm
     template_name = 'registration/signup.html'
@@ -199,28 +378,102 @@ class SignUpView(CreateView):
 
 
 class InvoiceListApiView(LoginRequiredMixin, View):
+    """
+    GET ?q=&order=&limit=&cursor=&count=1 plus the list filters (see core.utils.filters)
+    -- one page of invoices, newest first or by relevance when searching.
+    Walk the whole list by passing back ``next`` as ``cursor``.
+    ?format=ndjson streams all matching invoices (or the first ``limit``), one JSON object per line.
+    """
+    # без limit первая страница та же, что отдавал API до курсоров: до 200 строк
+    default_limit = 200
+    max_limit = 200
+
+    def parse_query(self, request):
+        """(compiled query, limit); raises InvalidQuery for bad parameters."""
+        compiled = compile_invoice_query(request.GET)
+        try:
+            limit = max(int(request.GET.get('limit', self.default_limit)), 1)
+        except ValueError:
+            raise InvalidQuery('limit must be an integer')
+        return compiled, limit
+
     def get(self, request, *args, **kwargs):
-        q = request.GET.get('q', '').strip()
-        qs = Invoice.objects.filter(owner=request.user).select_related('project', 'category', 'project__client')
-        if q:
-            qs = qs.filter(
-                Q(project__title__icontains=q) |
-                Q(project__client__name__icontains=q) |
-                Q(external_id__icontains=q) |
-                Q(description__icontains=q)
+        try:
+            compiled, limit = self.parse_query(request)
+        except InvalidQuery as e:
+            return json_response({'error': str(e)}, status=400)
+        qs = compiled.apply(Invoice.objects.filter(owner=request.user), request.user.pk)
+
+        if request.GET.get('format') == 'ndjson':
+            rows = invoice_api_rows(qs.order_by(*compiled.ordering))
+            if 'limit' in request.GET:
+                rows = rows[:limit]
+            return StreamingHttpResponse(iter_ndjson(rows.iterator(chunk_size=2000)),
+                                         content_type='application/x-ndjson')
+
+        extra, key = row_key(compiled.ordering)
+        try:
+            page = keyset_page(invoice_api_rows(qs, extra), compiled.ordering, request.GET.get('cursor'),
+                               min(limit, self.max_limit), key=key)
+        except InvalidCursor as e:
+            return json_response({'error': str(e)}, status=400)
+        return json_response(self.page_data(page, invoice_total(request, qs, compiled)))
+
+    def page_data(self, page, count):
+        return {
+            'invoices': [dict(zip(INVOICE_API_KEYS, row)) for row in page.items],
+            'next': page.next_cursor,
+            'prev': page.prev_cursor,
+            'count': count,
+        }
+
+
+class AsyncInvoiceListApiView(AsyncLoginRequiredMixin, InvoiceListApiView):
+    """InvoiceListApiView for ASGI servers: the page and the total are read through the async ORM."""
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            compiled, limit = self.parse_query(request)
+        except InvalidQuery as e:
+            return json_response({'error': str(e)}, status=400)
+        # поиск при первом вызове выбирает бэкенд по списку таблиц -- это синхронный запрос
+        qs = await sync_to_async(compiled.apply)(Invoice.objects.filter(owner=request.user), request.user.pk)
+
+        if request.GET.get('format') == 'ndjson':
+            rows = invoice_api_rows(qs.order_by(*compiled.ordering))
+            if 'limit' in request.GET:
+                rows = rows[:limit]
+            return StreamingHttpResponse(aiter_ndjson(rows),
+                                         content_type='application/x-ndjson')
+
+        extra, key = row_key(compiled.ordering)
+        try:
+            page, count = await asyncio.gather(
+                akeyset_page(invoice_api_rows(qs, extra), compiled.ordering, request.GET.get('cursor'),
+                             min(limit, self.max_limit), key=key),
+                ainvoice_total(request, qs, compiled),
             )
-        invoices = qs.order_by('-date')[:200]
-        data = []
-        for inv in invoices:
-            data.append({
-                'id': inv.id,
-                'date': inv.date.isoformat(),
-                'project': inv.project.title if inv.project else '',
-                'client': inv.project.client.name if inv.project and inv.project.client else '',
-                'category': inv.category.name if inv.category else '',
-                'amount': str(inv.amount),
-                'paid': bool(inv.paid),
-                'external_id': inv.external_id,
-                'description': inv.description or '',
-            })
-        return JsonResponse({'invoices': data})
\ No newline at end of file
+        except InvalidCursor as e:
+            return json_response({'error': str(e)}, status=400)
+        return json_response(self.page_data(page, count))
+
+
+class MetricsView(View):
+    """
+    Prometheus scrape endpoint; open to staff users, to requests with
+    ``Authorization: Bearer <METRICS_TOKEN>`` and to METRICS_ALLOWED_IPS.
+    """
+
+    def allowed(self, request):
+        if request.user.is_staff:
+            return True
+        token = getattr(settings, 'METRICS_TOKEN', None)
+        scheme, _, given = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if token and scheme.lower() == 'bearer' and constant_time_compare(given.strip(), token):
+            return True
+        return request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ())
+
+    def get(self, request, *args, **kwargs):
+        if not self.allowed(request):
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')